@@ -127,7 +127,7 @@ cd "${PROJECT_ROOT_IN_APP}"
      "PyQt5.QtGamepad" "PyQt5.QtRemoteObjects" "PyQt5.QtScxml" "PyQt5.QtWebChannel" # More exclusions
  )
  for MOD in "${MODULES_TO_EXCLUDE[@]}"; do PYINSTALLER_ARGS+=( "--exclude-module" "${MOD}" ); done
- HIDDEN_IMPORTS_LIST=( "PyQt5.sip" "PyQt5.QtCore" "PyQt5.QtGui" "PyQt5.QtWidgets" "PyQt5.QtSvg" "PyQt5.QtPrintSupport" "google.generativeai" "google.ai.generativelanguage" "google.auth" "google.api_core" "google.protobuf" "google.type" "google.rpc" "proto" "grpc" "PIL" "pkg_resources" "argparse" "backend_cli" "socket" ) # Added socket
+ HIDDEN_IMPORTS_LIST=( "PyQt5.sip" "PyQt5.QtCore" "PyQt5.QtGui" "PyQt5.QtWidgets" "PyQt5.QtSvg" "PyQt5.QtPrintSupport" "google.generativeai" "google.ai.generativelanguage" "google.auth" "google.api_core" "google.protobuf" "google.type" "google.rpc" "proto" "grpc" "PIL" "pkg_resources" "argparse" "backend_cli" "socket" "socketserver" "selectors" "mmap" "uuid" "PyQt5.QtNetwork" "asyncio" "select" "resource" "ctypes" "hashlib" "termios" "fcntl" ) # Added socket
  for IMP in "${HIDDEN_IMPORTS_LIST[@]}"; do PYINSTALLER_ARGS+=( "--hidden-import" "${IMP}" ); done
  PYINSTALLER_ARGS+=( "linux_ai_assistant_gui.py" )
  echo "Finalna komenda PyInstaller: ${PYTHON_VENV_EXEC} -m PyInstaller ${PYINSTALLER_ARGS[*]}"
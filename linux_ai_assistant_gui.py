@@ -11,15 +11,17 @@ import locale
 import socket
 import subprocess
 import traceback # Upewnij się, że jest
-from typing import Dict, Optional, List, Any, Set
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, List, Any, Set, Callable, Tuple
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                             QHBoxLayout, QTextEdit, QLineEdit, QPushButton,
                             QLabel, QDialog, QTabWidget, QCheckBox, QMessageBox,
                             QAction, QMenu, QStyle, QFileDialog, QStatusBar,
                             QDialogButtonBox, QFormLayout, QGroupBox, QSizePolicy,
-                            QSpacerItem)
-from PyQt5.QtGui import QFont, QIcon, QTextCursor, QColor, QPalette, QPixmap
+                            QSpacerItem, QPlainTextEdit)
+from PyQt5.QtGui import QFont, QIcon, QTextCursor, QColor, QPalette, QPixmap, QFontMetrics
 from PyQt5.QtCore import Qt, QProcess, QSettings, QSize, pyqtSignal, QTimer, QProcessEnvironment, QEvent
+from PyQt5.QtNetwork import QLocalSocket
 
 
 # --- Constants for Pre-filled Cache ---
@@ -61,6 +63,7 @@ PREFILLED_EXPLANATIONS_CACHE_EN: Dict[str, str] = {
 }
 
 _IS_BACKEND_MODE = os.environ.get("LAA_BACKEND_MODE") == "1"
+_IS_FROZEN_BUILD = getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS')
 
 if _IS_BACKEND_MODE:
     try:
@@ -90,6 +93,7 @@ if _IS_BACKEND_MODE:
 
 GeminiIntegration = None
 GeminiApiResponse_class_ref = None
+default_socket_path = None
 if not _IS_BACKEND_MODE:
     try:
         module_base_path = ""
@@ -101,6 +105,7 @@ if not _IS_BACKEND_MODE:
         if module_base_path not in sys.path:
              sys.path.insert(0, module_base_path)
         from modules.gemini_integration import GeminiIntegration, GeminiApiResponse
+        from modules.backend_protocol import default_socket_path
         GeminiApiResponse_class_ref = GeminiApiResponse
     except ImportError as e:
         print(f"CRITICAL (GUI): Could not import GeminiIntegration module. Error: {e}", file=sys.stderr)
@@ -130,6 +135,12 @@ DEFAULT_CONFIG = {
     "api_keys": {"gemini": "", "openai": "", "anthropic": ""},
     "show_instructions": True, "theme": "dark", "max_history": 100,
     "verbose_logging": True, "gui_model_name": 'gemini-1.5-flash-latest',
+    "use_shared_backend": True, # Najpierw spróbuj serwera `backend_cli.py --socket`, dopiero potem uruchom własny
+    "in_process_backend": _IS_FROZEN_BUILD, # W AppImage ponowne uruchomienie paczki jako backendu kosztuje najwięcej
+    "show_resource_usage": True, # Czas CPU, max RSS, I/O i przełączenia kontekstu po każdym poleceniu
+    "embedded_terminal": True, # Polecenia interaktywne (htop, vim...) w pseudoterminalu backendu, w oknie asystenta; False - zewnętrzny emulator
+    # Limity dla wykonywanych poleceń (None = bez limitu); use_cgroup: zakres cgroup v2 przez systemd-run, jeśli dostępny
+    "command_limits": {"memory_mb": None, "cpu_seconds": None, "max_processes": None, "cpu_quota_percent": None, "use_cgroup": False},
     "force_ai_for_commands": ["rm", "top", "htop", "nano", "vim", "less", "man"]
 }
 
@@ -399,8 +410,87 @@ class TerminalWidget(QTextEdit):
         char_format.setForeground(text_color); cursor.setCharFormat(char_format)
         cursor.insertText(text + "\n"); self.moveCursor(QTextCursor.End); self.ensureCursorVisible()
 
+    def append_stream_text(self, text, message_type="system"):
+        # Surowy fragment wyjścia polecenia (bez dopisywania nowej linii) - strumieniowanie na żywo
+        self.moveCursor(QTextCursor.End); cursor = self.textCursor(); char_format = cursor.charFormat()
+        char_format.setForeground(self.colors.get(message_type, self.palette().color(QPalette.Text))); cursor.setCharFormat(char_format)
+        cursor.insertText(text); self.moveCursor(QTextCursor.End); self.ensureCursorVisible()
+
+
+class PtyTerminalWidget(QPlainTextEdit):
+    # Ekran polecenia interaktywnego uruchomionego w pseudoterminalu backendu: backend przysyła zmienione wiersze
+    # (zdarzenia 'screen'), widżet zamienia tylko te bloki dokumentu, a klawisze zamienia na sekwencje terminala.
+    key_input = pyqtSignal(str)
+    size_changed = pyqtSignal(int, int)
+    SPECIAL_KEYS = {Qt.Key_Return: "\r", Qt.Key_Enter: "\r", Qt.Key_Backspace: "\x7f", Qt.Key_Tab: "\t", Qt.Key_Backtab: "\x1b[Z",
+                    Qt.Key_Escape: "\x1b", Qt.Key_Insert: "\x1b[2~", Qt.Key_Delete: "\x1b[3~", Qt.Key_PageUp: "\x1b[5~",
+                    Qt.Key_PageDown: "\x1b[6~", Qt.Key_F1: "\x1bOP", Qt.Key_F2: "\x1bOQ", Qt.Key_F3: "\x1bOR", Qt.Key_F4: "\x1bOS",
+                    Qt.Key_F5: "\x1b[15~", Qt.Key_F6: "\x1b[17~", Qt.Key_F7: "\x1b[18~", Qt.Key_F8: "\x1b[19~",
+                    Qt.Key_F9: "\x1b[20~", Qt.Key_F10: "\x1b[21~", Qt.Key_F11: "\x1b[23~", Qt.Key_F12: "\x1b[24~"}
+    CURSOR_KEYS = {Qt.Key_Up: "A", Qt.Key_Down: "B", Qt.Key_Right: "C", Qt.Key_Left: "D", Qt.Key_Home: "H", Qt.Key_End: "F"}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setReadOnly(True); self.setFont(QFont("Monospace", 10)); self.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.setUndoRedoEnabled(False); self.setObjectName("PtyTerminalWidget"); self.setFocusPolicy(Qt.StrongFocus)
+        self.setTextInteractionFlags(Qt.TextSelectableByMouse | Qt.TextSelectableByKeyboard)
+        self.rows, self.cols = 0, 0
+        self.application_cursor_keys = False
+        self._resize_timer = QTimer(self); self._resize_timer.setSingleShot(True)
+        self._resize_timer.timeout.connect(lambda: self.size_changed.emit(*self.screen_size()))
+
+    def screen_size(self) -> Tuple[int, int]:
+        metrics = QFontMetrics(self.font())
+        viewport = self.viewport().size()
+        return max(viewport.height() // metrics.lineSpacing(), 5), max(viewport.width() // max(metrics.horizontalAdvance("M"), 1), 20)
+
+    def apply_update(self, update: Dict[str, Any]):
+        rows, cols = update.get("rows", self.rows), update.get("cols", self.cols)
+        if rows != self.rows: self.setPlainText("\n" * (rows - 1)) # Jeden blok dokumentu na wiersz ekranu
+        self.rows, self.cols = rows, cols
+        cursor = QTextCursor(self.document())
+        cursor.beginEditBlock()
+        for row, text in update.get("lines", []):
+            block = self.document().findBlockByNumber(row)
+            if not block.isValid(): continue
+            cursor.setPosition(block.position()); cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
+            cursor.insertText(text)
+        cursor.endEditBlock()
+        self.application_cursor_keys = update.get("application_cursor_keys", self.application_cursor_keys)
+        cursor_row, cursor_col = update.get("cursor", (0, 0))
+        block = self.document().findBlockByNumber(cursor_row)
+        if block.isValid():
+            text_cursor = self.textCursor(); text_cursor.setPosition(block.position() + min(cursor_col, block.length() - 1)); self.setTextCursor(text_cursor)
+        self.setCursorWidth(2 if update.get("cursor_visible", True) else 0)
+
+    def reset(self):
+        self.clear(); self.rows, self.cols = 0, 0; self.application_cursor_keys = False
+
+    def keyPressEvent(self, event):
+        key, modifiers = event.key(), event.modifiers()
+        if key in self.CURSOR_KEYS:
+            data = ("\x1bO" if self.application_cursor_keys else "\x1b[") + self.CURSOR_KEYS[key]
+        elif key in self.SPECIAL_KEYS:
+            data = self.SPECIAL_KEYS[key]
+        elif modifiers & Qt.ControlModifier and Qt.Key_A <= key <= Qt.Key_Z:
+            data = chr(key - Qt.Key_A + 1)
+        else:
+            data = event.text()
+        if not data: return super().keyPressEvent(event)
+        if modifiers & Qt.AltModifier: data = "\x1b" + data
+        self.key_input.emit(data)
+
+    def focusNextPrevChild(self, next_child: bool) -> bool:
+        return False # Tab trafia do programu, nie zmienia fokusu
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._resize_timer.start(100)
+
 
 class LinuxAIAssistantGUI(QMainWindow):
+    backend_message_ready = pyqtSignal(dict) # Odpowiedzi silnika w procesie, dostarczane z wątku roboczego do wątku GUI
+
     def load_input_history(self):
         self.input_history = []
         self.current_history_index = 0
@@ -437,8 +527,24 @@ class LinuxAIAssistantGUI(QMainWindow):
         super().__init__()
         self._theme_applied_once = False # Ten może zostać tutaj
         self.current_command: Optional[str] = None
-        self.process: Optional[QProcess] = None
-        self.current_exec_process: Optional[QProcess] = None
+        # Długo działający proces backendu (backend_cli.py --serve), współdzielony przez wszystkie żądania,
+        # albo połączenie z serwerem `backend_cli.py --socket` uruchomionym poza GUI
+        self.backend_server: Optional[QProcess] = None
+        self.backend_socket: Optional[QLocalSocket] = None
+        # Albo silnik w procesie GUI (backend_cli.LinuxAIAssistant na wątku roboczym) - bez uruchamiania drugiej kopii paczki
+        self.in_process_backend = None
+        self._in_process_pool: Optional[ThreadPoolExecutor] = None
+        self.backend_message_ready.connect(self._dispatch_backend_message)
+        self._backend_server_buffer = bytearray()
+        self._backend_pending_requests: Dict[str, Callable[[Optional[Dict[str, Any]]], None]] = {}
+        self._backend_event_handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+        self._exec_streamed_output: Set[str] = set() # Strumienie (stdout/stderr) już wyświetlone na żywo dla bieżącego wykonania
+        self._exec_stream_at_line_start = True
+        self._backend_request_seq = 0
+        self.pending_query_request_id: Optional[str] = None
+        self.pending_exec_request_id: Optional[str] = None
+        self.pty_session_id: Optional[str] = None # Sesja pseudoterminala backendu wyświetlana w PtyTerminalWidget
+        self.pty_command: Optional[str] = None
         self.gui_current_working_dir = os.path.expanduser("~")
         if not os.path.isdir(self.gui_current_working_dir):
             self.gui_current_working_dir = os.path.abspath(os.getcwd())
@@ -495,6 +601,7 @@ class LinuxAIAssistantGUI(QMainWindow):
 
         self.perform_internet_check() # To używa log_message
         self.internet_check_timer.start(60000)
+        QTimer.singleShot(0, self.ensure_backend_server) # Rozgrzej backend zanim padnie pierwsze zapytanie
 
     def perform_internet_check(self):
         previous_offline_state = self.is_offline
@@ -611,6 +718,9 @@ class LinuxAIAssistantGUI(QMainWindow):
         central_widget = QWidget(); self.setCentralWidget(central_widget)
         main_layout = QVBoxLayout(central_widget)
         self.terminal = TerminalWidget(); main_layout.addWidget(self.terminal, 1)
+        self.pty_terminal = PtyTerminalWidget(); self.pty_terminal.hide(); main_layout.addWidget(self.pty_terminal, 1)
+        self.pty_terminal.key_input.connect(self.send_interactive_input)
+        self.pty_terminal.size_changed.connect(self.resize_interactive_session)
         input_layout = QHBoxLayout(); self.prompt_label = QLabel("> ")
         self.prompt_label.setObjectName("PromptLabel")
         input_layout.addWidget(self.prompt_label); self.input_field = QLineEdit(); self.input_field.setObjectName("InputField")
@@ -725,6 +835,7 @@ class LinuxAIAssistantGUI(QMainWindow):
             QLineEdit {{ background-color: {term_bg}; color: {term_user_fg}; border: 1px solid {border}; padding: 4px; border-radius: 3px; }}
             QLineEdit#InputField {{ background-color: {term_bg}; color: {term_user_fg}; border: none; font-family: Monospace; font-size: 10pt; padding: 5px; }}
             QCheckBox {{ color: {base_fg}; }} QTextEdit#TerminalWidget {{ background-color: {term_bg}; border: none; }}
+            QPlainTextEdit#PtyTerminalWidget {{ background-color: {term_bg}; color: {term_user_fg}; border: none; }}
             QTextEdit#GeneratedCommandDisplay, QTextEdit#AIOutputDisplay {{
                 background-color: {'#2C2F3A' if dark else '#FAFAFA'};
                 border: 1px solid {border}; border-radius: 3px;
@@ -919,6 +1030,7 @@ class LinuxAIAssistantGUI(QMainWindow):
             if api_key:
                 self.config["api_keys"]["gemini"] = api_key; self.save_config()
                 self.log_message("API key configured.", "success", True); self._init_ai_engine_for_gui()
+                if not self._backend_pending_requests: self.stop_backend_server() # Nowy klucz trafi do środowiska backendu
             else:
                 self.log_message("API key is required for AI features.", "error", True)
                 QTimer.singleShot(1000, self.prompt_for_api_key)
@@ -952,6 +1064,7 @@ class LinuxAIAssistantGUI(QMainWindow):
                 self.save_input_history()
             if force_ai_cmds_changed: self.log_message(f"Commands to always force AI processing updated: {self.config.get('force_ai_for_commands')}", "system", True)
             if gemini_key_changed or gui_model_changed: self._init_ai_engine_for_gui()
+            if gemini_key_changed and not self._backend_pending_requests: self.stop_backend_server() # Nowy klucz trafi do środowiska backendu
             self.log_message("Settings updated.", "success", True)
         QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
@@ -988,23 +1101,18 @@ class LinuxAIAssistantGUI(QMainWindow):
             self.ai_output_display.setPlaceholderText(self._original_ai_output_placeholder if hasattr(self, '_original_ai_output_placeholder') else "Type a command or query... Analysis or explanation will appear here.")
             if not self.ai_output_display.toPlainText().strip(): self.ai_output_display.clear()
         self.is_processing_animation_active = False; self.input_field.setEnabled(True)
-        # Przywracanie stanu przycisków jest teraz w `process_finished` i `execution_process_finished_from_backend`
-        # oraz `handle_stdout` jeśli nie ma polecenia.
+        # Przywracanie stanu przycisków jest teraz w `query_request_finished` i `execution_process_finished_from_backend`
+        # oraz `handle_query_result` jeśli nie ma polecenia.
         # self.execute_button.setEnabled(True) # Nie tutaj, bo może być jeszcze panel polecenia
         # self.copy_button.setEnabled(True)
         # self.cancel_button.setText("Cancel")
         # self.cancel_button.setEnabled(self.generated_command_panel.isVisible())
         QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
-    def handle_stdout(self):
+    def handle_query_result(self, result_dict: Dict[str, Any]):
         self.stop_processing_animation(restore_placeholder=False)
-        if not self.process: return
-        raw_data = self.process.readAllStandardOutput().data().decode().strip()
-        if not raw_data: return
-
-        self.log_message(f"Backend STDOUT (AI query result): {raw_data}", "debug_backend")
+        self.log_message(f"Backend result (AI query): {json.dumps(result_dict)}", "debug_backend")
         try:
-            result_dict = json.loads(raw_data)
             if GeminiApiResponse_class_ref:
                 self.last_api_response = GeminiApiResponse_class_ref(**result_dict)
             else:
@@ -1076,29 +1184,24 @@ class LinuxAIAssistantGUI(QMainWindow):
                 self.gui_current_working_dir = os.path.abspath(new_wd_from_ai_context)
                 self.log_message(f"GUI CWD context updated from AI to: {self.gui_current_working_dir}", "debug_backend")
                 self.update_prompt_label_text()
-        except json.JSONDecodeError:
-            self.log_message(f"Backend (non-JSON STDOUT process_query): {raw_data}", "error", True)
-            self.ai_output_display.setText("Error: Received malformed data from backend.")
         except Exception as e_parse:
-            self.log_message(f"Error parsing backend response in handle_stdout: {e_parse}", "error", True)
+            self.log_message(f"Error parsing backend response in handle_query_result: {e_parse}", "error", True)
             self.ai_output_display.setText(f"Error parsing backend response: {e_parse}")
             self.last_api_response = None
         QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
-    def handle_stderr(self):
-        self.stop_processing_animation(restore_placeholder=True) # Przywróć placeholder, jeśli był błąd
-        if not self.process: return
-        raw_data = self.process.readAllStandardError().data().decode().strip()
-        if raw_data: self.log_message(f"Backend STDERR (query processing): {raw_data}", "debug_backend")
-        QTimer.singleShot(0, lambda: self.input_field.setFocus())
+    def handle_query_response(self, result: Optional[Dict[str, Any]]):
+        self.pending_query_request_id = None
+        if result is not None:
+            self.handle_query_result(result)
+        self.query_request_finished(result is not None)
 
-    def process_finished(self, exit_code: int, exit_status: QProcess.ExitStatus):
+    def query_request_finished(self, received_result: bool):
         self.stop_processing_animation(restore_placeholder=not self.ai_output_display.toPlainText().strip())
-        status_str = "normally" if exit_status == QProcess.NormalExit else "with a crash"
-        self.log_message(f"Backend process (AI query) finished {status_str}, code: {exit_code}.", "debug_backend")
-        if exit_code != 0 and not self.generated_command_panel.isVisible() and not self.ai_output_display.toPlainText().strip():
-             self.log_message(f"Backend AI query process may have failed (code: {exit_code}).", "error", True)
-             self.ai_output_display.setText(f"AI query process failed (code: {exit_code}).")
+        self.log_message(f"Backend AI query request finished ({'result received' if received_result else 'no result'}).", "debug_backend")
+        if not received_result and not self.generated_command_panel.isVisible() and not self.ai_output_display.toPlainText().strip():
+             self.log_message("Backend AI query failed (backend process stopped before answering).", "error", True)
+             self.ai_output_display.setText("AI query process failed (backend stopped).")
 
         # Przywróć stan przycisków, jeśli nie ma aktywnego polecenia
         if not self.generated_command_panel.isVisible():
@@ -1107,7 +1210,6 @@ class LinuxAIAssistantGUI(QMainWindow):
             self.cancel_button.setText("Cancel")
             self.cancel_button.setEnabled(True) # Cancel (clear) jest zawsze możliwe, jeśli jest tekst
 
-        if self.process: self.process.deleteLater(); self.process = None
         QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
     def execute_command(self):
@@ -1127,6 +1229,11 @@ class LinuxAIAssistantGUI(QMainWindow):
         self.cancel_button.setEnabled(True)
 
 
+        if needs_ext_term and self.config.get("embedded_terminal", True):
+            if not self.start_interactive_session(self.current_command):
+                self.execute_button.setEnabled(True); self.copy_button.setEnabled(True); self.cancel_button.setText("Cancel")
+            return
+
         if needs_ext_term:
             self.log_message(f"Command '{self.current_command}' requires an external terminal. Launching...", "system", True)
             inner_cmd_for_bash = self.current_command.replace("'", "'\\''")
@@ -1200,28 +1307,8 @@ class LinuxAIAssistantGUI(QMainWindow):
         self.log_message(f"Sending to backend (AI-gen, auto-confirm): {self.current_command}", "command", True)
         if cmd_to_backend != self.current_command: self.log_message(f"(Executing as: echo '****' | sudo -S ...)", "debug_backend")
 
-        self.current_exec_process = QProcess(self)
-        self.current_exec_process.readyReadStandardOutput.connect(lambda: self.handle_execution_stdout_from_backend(self.current_exec_process))
-        self.current_exec_process.readyReadStandardError.connect(lambda: self.handle_execution_stderr_from_backend(self.current_exec_process))
-        self.current_exec_process.finished.connect(lambda ec, es, cmd_orig=str(self.current_command): self.execution_process_finished_from_backend(ec, es, cmd_orig, self.current_exec_process))
-        env = QProcessEnvironment.systemEnvironment();
-        gemini_key = self.config["api_keys"].get("gemini", "")
-        if gemini_key: env.insert("GOOGLE_API_KEY", gemini_key)
-        env.insert("LAA_BACKEND_MODE", "1"); env.insert("LAA_VERBOSE_LOGGING_EFFECTIVE", "1" if self.verbose_logging else "0")
-        self.current_exec_process.setProcessEnvironment(env)
-        exec_path, exec_args_list = (sys.executable, []) if getattr(sys,'frozen',False) and hasattr(sys, '_MEIPASS') else \
-                                   (sys.executable, [os.path.join(os.path.dirname(os.path.abspath(__file__)),"src","backend_cli.py")])
-        if not (getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS')) and not os.path.exists(exec_args_list[0]):
-             self.log_message(f"CRITICAL: Dev backend_cli.py not found: {exec_args_list[0]}", "error", True); self.stop_processing_animation()
-             self.execute_button.setEnabled(True); self.copy_button.setEnabled(True); self.cancel_button.setText("Cancel")
-             return
-        exec_args_list.extend(["--query", cmd_to_backend, "--execute", "--json", "--working-dir", self.gui_current_working_dir])
-        logged_args = ' '.join(shlex.quote(arg) for arg in exec_args_list)
-        self.log_message(f"Backend exec cmd (AI-gen): {exec_path} {logged_args}", "debug_backend")
-        self.current_exec_process.start(exec_path, exec_args_list)
-        if not self.current_exec_process.waitForStarted(10000):
-            self.log_message(f"Error starting backend (AI-gen exec): {self.current_exec_process.errorString()}", "error", True); self.stop_processing_animation()
-            if self.current_exec_process: self.current_exec_process.deleteLater(); self.current_exec_process = None
+        if not self.start_backend_execution(cmd_to_backend, str(self.current_command)):
+            self.stop_processing_animation()
             self.execute_button.setEnabled(True); self.copy_button.setEnabled(True); self.cancel_button.setText("Cancel")
         QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
@@ -1232,33 +1319,72 @@ class LinuxAIAssistantGUI(QMainWindow):
         self.cancel_button.setText("Stop")
         self.cancel_button.setEnabled(True) # Aktywuj Stop
 
-        self.current_exec_process = QProcess(self)
-        self.current_exec_process.readyReadStandardOutput.connect(lambda: self.handle_execution_stdout_from_backend(self.current_exec_process))
-        self.current_exec_process.readyReadStandardError.connect(lambda: self.handle_execution_stderr_from_backend(self.current_exec_process))
         self.waiting_for_basic_command_explanation_for = command_str
-        self.current_exec_process.finished.connect(lambda ec, es, cmd=command_str, proc_instance=self.current_exec_process: self.execution_process_finished_from_backend(ec, es, cmd, proc_instance))
-        env = QProcessEnvironment.systemEnvironment()
-        gemini_key = self.config["api_keys"].get("gemini", "")
-        if gemini_key: env.insert("GOOGLE_API_KEY", gemini_key)
-        env.insert("LAA_BACKEND_MODE", "1"); env.insert("LAA_VERBOSE_LOGGING_EFFECTIVE", "1" if self.verbose_logging else "0")
-        self.current_exec_process.setProcessEnvironment(env)
-        exec_path, exec_args_list = (sys.executable, []) if getattr(sys,'frozen',False) and hasattr(sys, '_MEIPASS') else \
-                                   (sys.executable, [os.path.join(os.path.dirname(os.path.abspath(__file__)),"src","backend_cli.py")])
-        if not (getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS')) and not os.path.exists(exec_args_list[0]):
-             self.log_message(f"CRITICAL: Dev backend_cli.py not found: {exec_args_list[0]}", "error", True); self.stop_processing_animation()
-             self.execute_button.setEnabled(True); self.copy_button.setEnabled(True); self.cancel_button.setText("Cancel"); self.cancel_button.setEnabled(False)
-             return
-        exec_args_list.extend(["--query", command_str, "--execute", "--json", "--working-dir", self.gui_current_working_dir])
-        logged_args = ' '.join(shlex.quote(arg) for arg in exec_args_list)
-        self.log_message(f"Backend exec cmd (basic): {exec_path} {logged_args}", "debug_backend")
-        self.current_exec_process.start(exec_path, exec_args_list)
-        if not self.current_exec_process.waitForStarted(10000):
-            self.log_message(f"Błąd startu backendu (basic exec): {self.current_exec_process.errorString()}", "error", True); self.stop_processing_animation()
-            if self.current_exec_process: self.current_exec_process.deleteLater(); self.current_exec_process = None
+        if not self.start_backend_execution(command_str, command_str):
+            self.stop_processing_animation()
             self.waiting_for_basic_command_explanation_for = None
             self.execute_button.setEnabled(True); self.copy_button.setEnabled(True); self.cancel_button.setText("Cancel"); self.cancel_button.setEnabled(False)
         QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
+    def start_backend_execution(self, cmd_to_backend: str, executed_command: str) -> bool:
+        # `executed_command` to polecenie widziane przez użytkownika (bez hasła sudo), używane przy zakończeniu
+        self._exec_streamed_output = set(); self._exec_stream_at_line_start = True
+        request_id = self.send_backend_request(
+            "execute", {"command": cmd_to_backend, "working_dir": self.gui_current_working_dir, "stream": True},
+            lambda res, cmd=executed_command: self.handle_execution_response(res, cmd),
+            on_event=self.handle_execution_output_event
+        )
+        if not request_id: return False
+        self.pending_exec_request_id = request_id
+        return True
+
+    def start_interactive_session(self, command: str) -> bool:
+        # Polecenie interaktywne w pseudoterminalu backendu, wyświetlane w miejscu logu (bez zewnętrznego emulatora)
+        self.terminal.hide(); self.pty_terminal.reset(); self.pty_terminal.show()
+        rows, cols = self.pty_terminal.screen_size()
+        request_id = self.send_backend_request(
+            "interactive", {"command": command, "working_dir": self.gui_current_working_dir, "rows": rows, "cols": cols},
+            lambda res, cmd=command: self.handle_interactive_started(res, cmd),
+            on_event=lambda event, cmd=command: self.handle_interactive_event(event, cmd)
+        )
+        if not request_id:
+            self.pty_terminal.hide(); self.terminal.show(); return False
+        self.pty_command = command
+        self.log_message(f"Running '{command}' in the embedded terminal (Stop ends it).", "system", True)
+        self.pty_terminal.setFocus()
+        return True
+
+    def handle_interactive_started(self, res: Optional[Dict[str, Any]], command: str):
+        if res and res.get("success") and res.get("session"):
+            self.pty_session_id = str(res["session"])
+            if (self.pty_terminal.rows, self.pty_terminal.cols) not in ((0, 0), self.pty_terminal.screen_size()):
+                self.resize_interactive_session(*self.pty_terminal.screen_size()) # Okno zmieniło rozmiar przed odpowiedzią
+            return
+        if res is not None: self.log_message(f"Could not start '{command}': {res.get('error', 'unknown error')}", "error", True)
+        self.finish_interactive_session(command, None)
+
+    def handle_interactive_event(self, event: Dict[str, Any], command: str):
+        if event.get("event") == "screen": self.pty_terminal.apply_update(event)
+        elif event.get("event") == "exit": self.finish_interactive_session(command, event.get("result"))
+
+    def send_interactive_input(self, data: str):
+        if self.pty_session_id: self.send_backend_request("pty", {"session": self.pty_session_id, "data": data}, lambda res: None)
+
+    def resize_interactive_session(self, rows: int, cols: int):
+        if self.pty_session_id: self.send_backend_request("pty", {"session": self.pty_session_id, "rows": rows, "cols": cols}, lambda res: None)
+
+    def finish_interactive_session(self, command: str, res: Optional[Dict[str, Any]]):
+        self.pty_session_id = None; self.pty_command = None
+        self.pty_terminal.hide(); self.terminal.show()
+        if res is None:
+            self.execution_process_finished_from_backend(-1, QProcess.CrashExit, command); return
+        new_wd = res.get("working_dir")
+        if new_wd and os.path.abspath(new_wd) != self.gui_current_working_dir:
+            self.gui_current_working_dir = os.path.abspath(new_wd); self.update_prompt_label_text()
+        resource_usage = self.format_resource_usage(res)
+        if resource_usage and self.config.get("show_resource_usage", True): self.log_message(resource_usage, "system", True)
+        self.execution_process_finished_from_backend(res.get("return_code", -1), QProcess.NormalExit, command)
+
     def request_ai_explanation_for_executed_command(self, command_str: str):
         self.start_processing_animation(f"Getting AI explanation for: {command_str}") # Animacja już powinna być zatrzymana
         cached_explanation = self.explanations_cache.get(command_str)
@@ -1304,32 +1430,60 @@ class LinuxAIAssistantGUI(QMainWindow):
         finally:
             self.stop_processing_animation(restore_placeholder=False); QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
-    def handle_execution_stdout_from_backend(self, proc: Optional[QProcess]):
-        if not proc: return
-        raw_data = proc.readAllStandardOutput().data().decode().strip()
-        if not raw_data: return
-        self.log_message(f"Backend Exec STDOUT (JSON expected): {raw_data}", "debug_backend")
+    def handle_execution_response(self, res: Optional[Dict[str, Any]], executed_command: str):
+        self.pending_exec_request_id = None
+        if res is None: # Backend zakończył się (Stop lub awaria) zanim odpowiedział
+            self.execution_process_finished_from_backend(-1, QProcess.CrashExit, executed_command)
+            return
+        self.handle_execution_stdout_from_backend(res)
+        if res.get("cancelled"): self.execution_process_finished_from_backend(-1, QProcess.CrashExit, executed_command)
+        else: self.execution_process_finished_from_backend(0, QProcess.NormalExit, executed_command)
+
+    def handle_execution_output_event(self, event: Dict[str, Any]):
+        data = event.get("data") or ""
+        if not data: return
+        stream_name = event.get("stream", "stdout")
+        self._exec_streamed_output.add(stream_name)
+        self.terminal.append_stream_text(data, "error" if stream_name == "stderr" else "system")
+        self._exec_stream_at_line_start = data.endswith("\n")
+
+    def handle_execution_stdout_from_backend(self, res: Dict[str, Any]):
+        self.log_message(f"Backend Exec result: {json.dumps(res)}", "debug_backend")
         try:
-            res = json.loads(raw_data)
-            if res.get("stdout"): self.log_message(res.get("stdout").strip(), "system", True)
-            if not res.get("success", False) and res.get("stderr"): self.log_message(res.get("stderr").strip(), "error", True)
+            if not self._exec_stream_at_line_start: self.terminal.append_stream_text("\n"); self._exec_stream_at_line_start = True
+            # Strumienie wyświetlone już na żywo (zdarzenia 'output') nie są powtarzane z wyniku końcowego
+            if res.get("stdout") and "stdout" not in self._exec_streamed_output: self.log_message(res.get("stdout").strip(), "system", True)
+            if not res.get("success", False) and res.get("stderr") and "stderr" not in self._exec_streamed_output: self.log_message(res.get("stderr").strip(), "error", True)
             new_wd = res.get("working_dir")
             if new_wd and os.path.abspath(new_wd) != self.gui_current_working_dir:
                 self.gui_current_working_dir = os.path.abspath(new_wd)
                 self.log_message(f"GUI: Working directory updated to: {self.gui_current_working_dir}", "debug_backend")
                 self.update_prompt_label_text() # Zaktualizuj prompt w GUI
+            for stream_name in ("stdout", "stderr"):
+                spill_path = res.get(f"{stream_name}_spill_path")
+                if spill_path: self.log_message(f"Output truncated in memory: full {stream_name} ({res.get(f'{stream_name}_total_bytes', 0)} bytes) saved to {spill_path}", "system", True)
+            if res.get("timed_out"): self.log_message("Command timed out and was terminated; output above is what it produced before that.", "error", True)
+            if res.get("limits_exceeded"): self.log_message(f"Command stopped by resource limit: {', '.join(res['limits_exceeded'])}", "error", True)
+            resource_usage = self.format_resource_usage(res)
+            if resource_usage and self.config.get("show_resource_usage", True): self.log_message(resource_usage, "system", True)
             fix_sugg = res.get("fix_suggestion")
             if fix_sugg: self.log_message(f"\n--- AI Fix Suggestion ---\n{fix_sugg}\n--------------------------", "assistant", True)
-        except json.JSONDecodeError: self.log_message(f"Backend Exec (non-JSON STDOUT): {raw_data}", "system", True)
+        except Exception as e_res: self.log_message(f"Error handling backend execution result: {e_res}", "error", True)
         QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
-    def handle_execution_stderr_from_backend(self, proc: Optional[QProcess]):
-        if not proc: return
-        raw_data = proc.readAllStandardError().data().decode().strip()
-        if raw_data: self.log_message(f"Backend Exec STDERR (raw): {raw_data}", "debug_backend")
-        QTimer.singleShot(0, lambda: self.input_field.setFocus())
-
-    def execution_process_finished_from_backend(self, exit_code: int, exit_status: QProcess.ExitStatus, executed_command: str, proc: Optional[QProcess]):
+    @staticmethod
+    def format_resource_usage(res: Dict[str, Any]) -> Optional[str]:
+        # Pola rusage z backendu - pokazywane tylko te, które zmierzono: trwała powłoka podaje czas CPU i blokowe I/O
+        # (bez maksymalnego RSS i przełączeń kontekstu), polecenia wbudowane - nic
+        if res.get("cpu_user_time") is None: return None
+        parts = [f"{res.get('execution_time', 0.0):.3f}s wall", f"{res['cpu_user_time']:.3f}s user", f"{res['cpu_system_time']:.3f}s sys"]
+        if res.get("max_rss_kb") is not None: parts.append(f"max RSS {res['max_rss_kb'] / 1024:.1f} MB")
+        if res.get("block_input_ops") is not None: parts.append(f"block I/O {res['block_input_ops']} in / {res['block_output_ops']} out")
+        if res.get("voluntary_context_switches") is not None:
+            parts.append(f"ctx switches {res['voluntary_context_switches']} vol / {res['involuntary_context_switches']} invol")
+        return "Resources: " + ", ".join(parts)
+
+    def execution_process_finished_from_backend(self, exit_code: int, exit_status: QProcess.ExitStatus, executed_command: str):
         self.stop_processing_animation(restore_placeholder=False) # Zatrzymaj animację, jeśli była (np. z execute_basic_command)
 
         # Zawsze przywracaj stan przycisków po zakończeniu wykonania
@@ -1368,10 +1522,6 @@ class LinuxAIAssistantGUI(QMainWindow):
         if not self.generated_command_panel.isVisible():
             self.execute_button.setEnabled(False)
 
-
-        if proc and proc == self.current_exec_process:
-            proc.deleteLater()
-            self.current_exec_process = None
         QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
     def copy_content(self):
@@ -1396,12 +1546,16 @@ class LinuxAIAssistantGUI(QMainWindow):
         self.log_message("Command cancelled.", "system", True); QTimer.singleShot(0, lambda: self.input_field.setFocus())
 
     def handle_cancel_or_stop_button(self):
-        if self.current_exec_process and self.current_exec_process.state() == QProcess.Running:
-            # Tryb "Stop"
+        if self.pty_session_id:
+            # Zamknięcie sesji pseudoterminala (SIGHUP jak przy zamknięciu okna terminala); zakończy ją zdarzenie 'exit'
+            self.send_backend_request("pty", {"session": self.pty_session_id, "close": True}, lambda res: None)
+            self.cancel_button.setEnabled(False); self.cancel_button.setText("Stopping...")
+        elif self.pending_exec_request_id:
+            # Tryb "Stop" - operacja 'cancel' przerywa tylko polecenie (SIGTERM, potem SIGKILL); backend i trwała powłoka
+            # (katalog roboczy, zmienne) działają dalej, a przerwane 'execute' odpowiada z "cancelled": true
             self.log_message("Attempting to stop current execution...", "system", True)
-            self.current_exec_process.terminate() # Wyślij SIGTERM
-            # Można dodać QTimer, aby po krótkim czasie wysłać kill(), jeśli terminate() nie zadziała
-            # QTimer.singleShot(1000, self.force_kill_if_still_running)
+            self.send_backend_request("cancel", {}, lambda res: None if res is None or res.get("cancelled") else
+                                      self.log_message("Backend: no running command to stop.", "debug_backend"))
             self.cancel_button.setEnabled(False) # Zdezaktywuj, aby uniknąć wielokrotnych kliknięć
             self.cancel_button.setText("Stopping...")
             # Nie ukrywamy panelu ani nie resetujemy current_command tutaj, czekamy na sygnał `finished`
@@ -1527,28 +1681,182 @@ class LinuxAIAssistantGUI(QMainWindow):
             self.ai_output_display.setText("Offline: AI query processing unavailable. Check connection or use basic commands.")
             self.stop_processing_animation(); return
         self.log_message("Processing (detailed) query with backend...", "debug_backend")
-        if self.process and self.process.state() == QProcess.Running:
+        if self.pending_query_request_id:
             self.log_message("Backend busy. Please wait for the current operation to complete.", "error", True); self.stop_processing_animation(); return
-        self.process = QProcess(self); self.process.readyReadStandardOutput.connect(self.handle_stdout) # Tutaj był błąd
-        self.process.readyReadStandardError.connect(self.handle_stderr); self.process.finished.connect(self.process_finished)
-        env = QProcessEnvironment.systemEnvironment();
+        if not self.config["api_keys"].get("gemini", ""): self.log_message("Warning: Gemini API key not found in config for backend process.", "error", True)
+        request_id = self.send_backend_request("query", {"query": detailed_query, "working_dir": self.gui_current_working_dir}, self.handle_query_response)
+        if not request_id: self.stop_processing_animation(); return
+        self.pending_query_request_id = request_id
+        QTimer.singleShot(0, lambda: self.input_field.setFocus())
+
+    def _backend_launch_spec(self) -> Optional[Tuple[str, List[str]]]:
+        if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'): return sys.executable, []
+        backend_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "backend_cli.py")
+        if not os.path.exists(backend_script):
+            self.log_message(f"CRITICAL: Dev backend_cli.py not found: {backend_script}", "error", True); return None
+        return sys.executable, [backend_script]
+
+    def _connect_shared_backend(self) -> bool:
+        if not self.config.get("use_shared_backend", True) or not default_socket_path: return False
+        socket_path = default_socket_path()
+        if not os.path.exists(socket_path): return False
+        backend_socket = QLocalSocket(self)
+        backend_socket.connectToServer(socket_path)
+        if not backend_socket.waitForConnected(500):
+            self.log_message(f"Shared backend at {socket_path} not reachable: {backend_socket.errorString()}", "debug_backend")
+            backend_socket.deleteLater(); return False
+        self.backend_socket = backend_socket
+        self._backend_server_buffer = bytearray()
+        backend_socket.readyRead.connect(lambda: self._handle_backend_output(backend_socket.readAll().data()))
+        backend_socket.disconnected.connect(lambda sock=backend_socket: self.backend_socket_disconnected(sock))
+        self.log_message(f"Connected to shared backend: {socket_path}", "debug_backend")
+        return True
+
+    def ensure_backend_server(self) -> bool:
+        if self.backend_socket and self.backend_socket.state() == QLocalSocket.ConnectedState: return True
+        if self.backend_server and self.backend_server.state() != QProcess.NotRunning: return True
+        if self._connect_shared_backend(): return True
+        launch_spec = self._backend_launch_spec()
+        if not launch_spec: return False
+        exec_path, exec_args_list = launch_spec
+        self.backend_server = QProcess(self)
+        self._backend_server_buffer = bytearray()
+        self.backend_server.readyReadStandardOutput.connect(self.handle_backend_server_stdout)
+        self.backend_server.readyReadStandardError.connect(self.handle_backend_server_stderr)
+        self.backend_server.finished.connect(lambda ec, es, proc=self.backend_server: self.backend_server_finished(ec, es, proc))
+        env = QProcessEnvironment.systemEnvironment()
         gemini_key = self.config["api_keys"].get("gemini", "")
         if gemini_key: env.insert("GOOGLE_API_KEY", gemini_key)
-        else: self.log_message("Warning: Gemini API key not found in config for backend process.", "error", True)
         env.insert("LAA_BACKEND_MODE", "1"); env.insert("LAA_VERBOSE_LOGGING_EFFECTIVE", "1" if self.verbose_logging else "0")
-        self.process.setProcessEnvironment(env)
-        exec_path, exec_args_list = (sys.executable, []) if getattr(sys,'frozen',False) and hasattr(sys, '_MEIPASS') else \
-                                   (sys.executable, [os.path.join(os.path.dirname(os.path.abspath(__file__)),"src","backend_cli.py")])
-        if not (getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS')) and not os.path.exists(exec_args_list[0]):
-             self.log_message(f"CRITICAL: Dev backend_cli.py not found: {exec_args_list[0]}", "error", True); self.stop_processing_animation(); return
-        exec_args_list.extend(["--query", detailed_query, "--json", "--working-dir", self.gui_current_working_dir])
-        logged_args = ' '.join(shlex.quote(arg) for arg in exec_args_list)
-        self.log_message(f"Cmd to backend (detailed_query): {exec_path} {logged_args}", "debug_backend")
-        self.process.start(exec_path, exec_args_list)
-        if not self.process.waitForStarted(7000):
-            self.log_message(f"Error starting backend: {self.process.errorString()}", "error", True); self.stop_processing_animation()
-            if self.process: self.process.deleteLater(); self.process = None
-        QTimer.singleShot(0, lambda: self.input_field.setFocus())
+        self.backend_server.setProcessEnvironment(env)
+        exec_args_list = exec_args_list + ["--serve", "--working-dir", self.gui_current_working_dir] + self._command_limit_args()
+        self.log_message(f"Starting backend server: {exec_path} {' '.join(shlex.quote(arg) for arg in exec_args_list)}", "debug_backend")
+        self.backend_server.start(exec_path, exec_args_list)
+        if not self.backend_server.waitForStarted(10000):
+            self.log_message(f"Error starting backend: {self.backend_server.errorString()}", "error", True)
+            self.backend_server.deleteLater(); self.backend_server = None
+            return False
+        return True
+
+    def _command_limit_args(self) -> List[str]:
+        limits = self.config.get("command_limits") or {}
+        flags = {"memory_mb": "--limit-memory", "cpu_seconds": "--limit-cpu", "max_processes": "--limit-procs", "cpu_quota_percent": "--limit-cpu-quota"}
+        args = [arg for key, flag in flags.items() if limits.get(key) is not None for arg in (flag, str(limits[key]))]
+        return args + (["--cgroup"] if limits.get("use_cgroup") else [])
+
+    def ensure_in_process_backend(self) -> bool:
+        if self.in_process_backend is not None: return True
+        try:
+            import backend_cli # src/ jest już w sys.path (import modułu gemini_integration)
+        except Exception as e:
+            self.log_message(f"In-process backend unavailable ({e}), falling back to backend process.", "error", True)
+            self.config["in_process_backend"] = False; return False
+        gemini_key = self.config["api_keys"].get("gemini", "")
+        original_env_api_key = os.environ.get('GOOGLE_API_KEY')
+        try:
+            if gemini_key: os.environ['GOOGLE_API_KEY'] = gemini_key
+            limits = backend_cli.ResourceLimits(**(self.config.get("command_limits") or {}))
+            self.in_process_backend = backend_cli.LinuxAIAssistant(initial_working_dir=self.gui_current_working_dir,
+                                                                   resource_limits=limits if limits.is_set() else None)
+        except Exception as e:
+            self.log_message(f"Error initializing in-process backend: {e}", "error", True); return False
+        finally: # GeminiIntegration czyta klucz w konstruktorze, potem przywracamy środowisko
+            if original_env_api_key is not None: os.environ['GOOGLE_API_KEY'] = original_env_api_key
+            elif 'GOOGLE_API_KEY' in os.environ: del os.environ['GOOGLE_API_KEY']
+        # Jeden wątek - żądania obsługiwane po kolei, tak jak w pętli --serve
+        if not self._in_process_pool: self._in_process_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="laa-backend")
+        self._backend_dispatch_request = backend_cli.dispatch_request
+        self.log_message("In-process backend initialized.", "debug_backend")
+        return True
+
+    def _run_in_process_request(self, request: Dict[str, Any]):
+        assistant = self.in_process_backend
+        if assistant is None: return
+        self.backend_message_ready.emit(self._backend_dispatch_request(assistant, request, self.backend_message_ready.emit))
+
+    def send_backend_request(self, op: str, payload: Dict[str, Any], callback: Callable[[Optional[Dict[str, Any]]], None],
+                             on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[str]:
+        use_in_process = self.config.get("in_process_backend", False) and self.ensure_in_process_backend()
+        if not use_in_process and not self.ensure_backend_server(): return None
+        self._backend_request_seq += 1
+        request_id = str(self._backend_request_seq)
+        request = dict(payload, id=request_id, op=op)
+        self._backend_pending_requests[request_id] = callback
+        if on_event: self._backend_event_handlers[request_id] = on_event
+        if use_in_process:
+            if op == "cancel": self._run_in_process_request(request) # Pula wykonuje właśnie przerywane polecenie
+            else: self._in_process_pool.submit(self._run_in_process_request, request)
+            return request_id
+        transport = self.backend_socket if self.backend_socket else self.backend_server
+        transport.write((json.dumps(request) + "\n").encode("utf-8"))
+        return request_id
+
+    def handle_backend_server_stdout(self):
+        if not self.backend_server: return
+        self._handle_backend_output(self.backend_server.readAllStandardOutput().data())
+
+    def _handle_backend_output(self, data: bytes):
+        self._backend_server_buffer.extend(data)
+        while b"\n" in self._backend_server_buffer:
+            raw_line, _, rest = bytes(self._backend_server_buffer).partition(b"\n")
+            self._backend_server_buffer = bytearray(rest)
+            line = raw_line.decode("utf-8", errors="replace").strip()
+            if not line: continue
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                self.log_message(f"Backend (non-JSON STDOUT): {line}", "debug_backend"); continue
+            self._dispatch_backend_message(message)
+
+    def _dispatch_backend_message(self, message: Dict[str, Any]):
+        if "event" in message: # Zdarzenie pośrednie (np. fragment wyjścia) - żądanie nadal oczekuje na odpowiedź
+            # Sesja 'interactive' wysyła zdarzenia także po odpowiedzi - aż do zdarzenia 'exit'
+            handlers = self._backend_event_handlers
+            event_handler = handlers.pop(str(message.get("id")), None) if message.get("event") == "exit" else handlers.get(str(message.get("id")))
+            if event_handler: event_handler(message)
+            return
+        if not (isinstance(message.get("result"), dict) and message["result"].get("session")):
+            self._backend_event_handlers.pop(str(message.get("id")), None)
+        callback = self._backend_pending_requests.pop(str(message.get("id")), None)
+        if not callback:
+            self.log_message(f"Backend message without pending request: {message.get('id')!r} ({message.get('op')})", "debug_backend"); return
+        if "result" in message: callback(message["result"])
+        else: callback({"success": False, "error": message.get("error", "Unknown backend error")})
+
+    def handle_backend_server_stderr(self):
+        if not self.backend_server: return
+        raw_data = self.backend_server.readAllStandardError().data().decode(errors="replace").strip()
+        if raw_data: self.log_message(f"Backend STDERR: {raw_data}", "debug_backend")
+
+    def backend_server_finished(self, exit_code: int, exit_status: QProcess.ExitStatus, proc: QProcess):
+        status_str = "normally" if exit_status == QProcess.NormalExit else "with a crash"
+        self.log_message(f"Backend server finished {status_str}, code: {exit_code}.", "debug_backend")
+        if proc is self.backend_server: self.backend_server = None
+        proc.deleteLater()
+        self._fail_pending_backend_requests()
+
+    def backend_socket_disconnected(self, sock: QLocalSocket):
+        self.log_message("Shared backend connection closed.", "debug_backend")
+        if sock is self.backend_socket: self.backend_socket = None
+        sock.deleteLater()
+        self._fail_pending_backend_requests()
+
+    def _fail_pending_backend_requests(self):
+        pending_callbacks = list(self._backend_pending_requests.values())
+        self._backend_pending_requests.clear(); self._backend_event_handlers.clear()
+        for callback in pending_callbacks: callback(None)
+        if self.pty_command: self.finish_interactive_session(self.pty_command, None) # Backend zakończył się z otwartą sesją
+
+    def stop_backend_server(self):
+        if self.in_process_backend is not None:
+            # Wątku nie da się przerwać, ale zabicie powłoki kończy wykonywane polecenie; silnik odtworzymy przy następnym żądaniu
+            self.in_process_backend.command_executor.close(force=True)
+            self.in_process_backend = None
+            self._fail_pending_backend_requests()
+        if self.backend_socket:
+            self.backend_socket.abort() # `disconnected` powiadomi oczekujące żądania; serwer --socket działa dalej
+        if self.backend_server and self.backend_server.state() != QProcess.NotRunning:
+            self.backend_server.kill() # `finished` powiadomi oczekujące żądania
 
     def start_new_session(self):
         if QMessageBox.question(self,"New Session","This will close the current assistant and start a new instance. Are you sure?", QMessageBox.Yes|QMessageBox.No,QMessageBox.No) == QMessageBox.Yes:
@@ -1589,8 +1897,11 @@ class LinuxAIAssistantGUI(QMainWindow):
 
     def closeEvent(self, event: QEvent):
         self.save_input_history(); self.save_config()
-        if self.process and self.process.state() == QProcess.Running: self.process.kill(); self.process.waitForFinished(1000)
-        if self.current_exec_process and self.current_exec_process.state() == QProcess.Running: self.current_exec_process.kill(); self.current_exec_process.waitForFinished(1000)
+        if self.backend_socket: self.backend_socket.disconnectFromServer()
+        if self._in_process_pool: self._in_process_pool.shutdown(wait=False, cancel_futures=True)
+        if self.backend_server and self.backend_server.state() == QProcess.Running:
+            self.backend_server.closeWriteChannel() # EOF na stdin kończy pętlę --serve
+            if not self.backend_server.waitForFinished(1000): self.backend_server.kill(); self.backend_server.waitForFinished(1000)
         super().closeEvent(event)
 
 
@@ -3,14 +3,21 @@ import sys
 import argparse
 import logging
 import readline # type: ignore
-import shutil # Dodano do sprawdzania terminali
 import json
 import getpass
 import shlex
-from typing import Dict, List, Optional, Any, Set
+import shutil
+from typing import Dict, List, Optional, Any, Set, Callable, Tuple
 import locale
 import traceback
-import subprocess # Dodano do Popen dla external terminal
+import subprocess # Polecenia interaktywne w terminalu CLI
+import io
+import socket
+import socketserver
+import threading
+import queue
+import re
+from dataclasses import asdict
 
 if not (getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS')):
     current_script_path = os.path.dirname(os.path.abspath(__file__))
@@ -24,49 +31,82 @@ else:
          sys.path.insert(0, module_path)
 
 
-from command_executor import CommandExecutor, DistributionDetector, SecurityValidator
-from gemini_integration import GeminiIntegration, GeminiApiResponse
+from command_executor import CommandExecutor, CommandResult, DistributionDetector, SecurityValidator, RESOURCE_USAGE_FIELDS
+from pty_session import PtySession, DEFAULT_ROWS as DEFAULT_PTY_ROWS, DEFAULT_COLS as DEFAULT_PTY_COLS
+from resource_limits import ResourceLimits
+from process_control import become_child_subreaper
+from execution_history import ExecutionHistory
+from system_context import SystemContext
+from package_index import parse_package_question
+from gemini_integration import GeminiIntegration, GeminiApiResponse, GeminiConversation
+from backend_protocol import default_socket_path, request_via_socket, output_event, screen_event, exit_event
 
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LOG_FILE = "/tmp/linux_ai_assistant_backend.log" # Zmieniono z laa_gui.log na backend.log
-effective_log_level_backend = logging.INFO # Domyślnie INFO
-handlers_backend: List[logging.Handler] = []
-try:
-    handlers_backend.append(logging.FileHandler(LOG_FILE, mode='a')) # Tryb 'a' do dopisywania
-except Exception as e:
-    # To jest backend, więc nie ma sensu używać print() do GUI. Log na stderr.
-    print(f"OSTRZEŻENIE: Nie można otworzyć pliku logu '{LOG_FILE}': {e}. Logowanie do pliku wyłączone.", file=sys.stderr)
-
-# Ustawienie LAA_VERBOSE_LOGGING_EFFECTIVE powinno być przekazywane z GUI
-if os.environ.get("LAA_VERBOSE_LOGGING_EFFECTIVE") == "1":
-    effective_log_level_backend = logging.DEBUG
-    # W trybie backendu JSON, nie chcemy dodatkowego outputu na stderr, chyba że to błąd krytyczny.
-    # GUI będzie odbierać logi przez dedykowany mechanizm, jeśli zaimplementowany, lub z pliku.
-    # Jeśli backend jest uruchamiany bezpośrednio w CLI (nie przez GUI), wtedy StreamHandler ma sens.
-    if not ("--json" in sys.argv or "-j" in sys.argv): # Tylko jeśli nie jest w trybie JSON dla GUI
-        handlers_backend.append(logging.StreamHandler(sys.stderr)) # Loguj DEBUG na stderr w trybie CLI
-logging.basicConfig(level=effective_log_level_backend, format=LOG_FORMAT, handlers=handlers_backend)
+EXECUTION_HISTORY_FILE = os.path.expanduser("~/.config/linux_ai_assistant/execution_history.jsonl") # Obok config.json GUI
+COMMAND_HISTORY_FILE = os.path.expanduser("~/.config/linux_ai_assistant/command_history.json") # Historia wpisów GUI
+AUDITED_HISTORY_FILES = [os.path.expanduser("~/.bash_history"), COMMAND_HISTORY_FILE] # Domyślne pliki dla --audit-history
+MAX_CWD_ENTRIES_FOR_AI = 2000 # Wpisy CWD przekazywane do GeminiIntegration, które skraca je według budżetu tokenów
 logger_main_cli = logging.getLogger("backend_cli_main") # Logger dla funkcji main tego pliku
 
-# Kolory tylko dla trybu CLI, nie JSON
-if not ("--json" in sys.argv or "-j" in sys.argv):
+# Bez kolorów, dopóki configure_cli_process() nie włączy colorama w trybie CLI
+class Fore: GREEN = YELLOW = CYAN = WHITE = RED = "" # type: ignore
+class Style: RESET_ALL = "" # type: ignore
+
+
+def configure_cli_process(argv: List[str]):
+    # Logowanie, kolory i LC_COLLATE procesu backendu - wywoływane z main(), więc import backend_cli (silnik w procesie GUI)
+    # nie zmienia konfiguracji logowania, locale ani sys.stdout procesu, który go importuje
+    global Fore, Style
+    # Tryby maszynowe (JSON dla GUI, serwer JSON-lines) - bez kolorów i bez logów na stderr
+    machine_output_mode = any(flag in argv for flag in ("--json", "-j", "--serve"))
+    effective_log_level_backend = logging.INFO # Domyślnie INFO
+    handlers_backend: List[logging.Handler] = []
     try:
-        import colorama
-        from colorama import Fore, Style
-        colorama.init(autoreset=True)
-    except ImportError:
-        class Fore: GREEN = YELLOW = CYAN = WHITE = RED = "" # type: ignore
-        class Style: RESET_ALL = "" # type: ignore
-else: # W trybie JSON, wyłącz kolory
-    class Fore: GREEN = YELLOW = CYAN = WHITE = RED = "" # type: ignore
-    class Style: RESET_ALL = "" # type: ignore
+        handlers_backend.append(logging.FileHandler(LOG_FILE, mode='a')) # Tryb 'a' do dopisywania
+    except Exception as e:
+        # To jest backend, więc nie ma sensu używać print() do GUI. Log na stderr.
+        print(f"OSTRZEŻENIE: Nie można otworzyć pliku logu '{LOG_FILE}': {e}. Logowanie do pliku wyłączone.", file=sys.stderr)
+
+    # Ustawienie LAA_VERBOSE_LOGGING_EFFECTIVE powinno być przekazywane z GUI
+    if os.environ.get("LAA_VERBOSE_LOGGING_EFFECTIVE") == "1":
+        effective_log_level_backend = logging.DEBUG
+        # W trybie backendu JSON, nie chcemy dodatkowego outputu na stderr, chyba że to błąd krytyczny.
+        # GUI będzie odbierać logi przez dedykowany mechanizm, jeśli zaimplementowany, lub z pliku.
+        # Jeśli backend jest uruchamiany bezpośrednio w CLI (nie przez GUI), wtedy StreamHandler ma sens.
+        if not machine_output_mode: # Tylko jeśli nie jest w trybie JSON dla GUI
+            handlers_backend.append(logging.StreamHandler(sys.stderr)) # Loguj DEBUG na stderr w trybie CLI
+    logging.basicConfig(level=effective_log_level_backend, format=LOG_FORMAT, handlers=handlers_backend)
+    # Kolejność sortowania ze środowiska raz przy starcie - wbudowane `ls` (builtin_commands) tylko ją odczytuje
+    try: locale.setlocale(locale.LC_COLLATE, "")
+    except locale.Error: pass
+
+    # Kolory tylko dla trybu CLI, nie JSON
+    if not machine_output_mode:
+        try:
+            import colorama
+            colorama.init(autoreset=True)
+            Fore, Style = colorama.Fore, colorama.Style # type: ignore[misc]
+        except ImportError:
+            pass
 
 
 class LinuxAIAssistant:
-    def __init__(self, initial_working_dir: Optional[str] = None):
+    AI_MODEL_NAME = 'gemini-2.5-flash-preview-05-20'
+
+    def __init__(self, initial_working_dir: Optional[str] = None,
+                 ai_engine: Optional[GeminiIntegration] = None,
+                 distro_info: Optional[Dict[str, str]] = None,
+                 resource_limits: Optional[ResourceLimits] = None,
+                 execution_history: Optional[ExecutionHistory] = None,
+                 system_context: Optional[SystemContext] = None):
+        # ai_engine, distro_info, execution_history i system_context mogą być współdzielone między instancjami (tryb --socket);
+        # CWD i historia czatu są per instancja
         self.logger = logging.getLogger("backend_assistant_instance") # Osobny logger dla instancji
         self.logger.info("LinuxAIAssistant (backend instance) logger initialized.")
-        self.command_executor = CommandExecutor(timeout=120) # Domyślny timeout
+        self.command_executor = CommandExecutor(timeout=120, persistent_shell=True, # Domyślny timeout; jedna powłoka bash na sesję
+                                                resource_limits=resource_limits,
+                                                execution_history=execution_history or ExecutionHistory(path=EXECUTION_HISTORY_FILE))
 
         # Ustawianie initial_working_dir dla CommandExecutor
         if initial_working_dir:
@@ -80,10 +120,13 @@ class LinuxAIAssistant:
             self.logger.info(f"Backend: Brak argumentu initial_working_dir. Używam domyślnego CWD egzekutora.")
 
 
-        self.ai_engine = GeminiIntegration(model_name='gemini-2.5-flash-preview-05-20') # Użyj stabilnej nazwy
+        self.ai_engine = ai_engine if ai_engine is not None else GeminiIntegration(model_name=self.AI_MODEL_NAME)
         self.distro_detector = DistributionDetector()
-        self.distro_info = self.distro_detector.detect_distribution()
+        self.distro_info = distro_info if distro_info is not None else self.distro_detector.detect_distribution()
+        SecurityValidator.set_distribution(self.distro_info) # Sekcja "distributions" pakietu reguł bezpieczeństwa
+        self.system_context = system_context if system_context is not None else SystemContext() # Zbierany leniwie przy zapytaniach
         self.chat_history_for_ai: List[Dict[str, Any]] = [] # Historia tylko dla AI, resetowana per sesję z GUI
+        self.ai_conversation: GeminiConversation = self.ai_engine.new_conversation() # Jedna sesja czatu Gemini na rozmowę
 
         try:
             # Próba wykrycia języka systemu dla promptów AI
@@ -123,6 +166,8 @@ class LinuxAIAssistant:
         # Polecenia, które nawet w CLI powinny być kierowane do AI
         self.force_ai_for_commands_cli: Set[str] = {"rm", "top", "htop", "nano", "vim", "less", "man"} # Dodano interaktywne
         self.interactive_commands_requiring_new_terminal: Set[str] = {"top", "htop", "nano", "vim", "less", "man", "mc"}
+        self.interactive_sessions: Dict[str, PtySession] = {} # Sesje pseudoterminala otwarte operacją 'interactive'
+        self._interactive_session_seq = 0
 
 
     def _get_ai_language_instruction(self) -> str:
@@ -133,8 +178,9 @@ class LinuxAIAssistant:
         # Domyślnie angielski
         return "Respond always in English. The command explanation, clarification questions, fix suggestions, and any other text MUST be in English."
 
-    def _add_to_chat_history(self, role: str, text_content: str):
-        # Ogranicz długość pojedynczej wiadomości i całkowitą historię
+    def _add_to_chat_history(self, role: str, text_content: str, in_ai_chat: bool = False):
+        # Ogranicz długość pojedynczej wiadomości i całkowitą historię. Wpisy spoza sesji czatu (in_ai_chat=False - wyniki
+        # poleceń, odpowiedzi lokalne) trafiają do niej jako notatki w następnej wiadomości.
         max_text_len = 1000 # Maksymalna długość pojedynczej części tekstu
         if len(text_content) > max_text_len:
             text_content = text_content[:max_text_len] + " ... (skrócono)"
@@ -143,28 +189,65 @@ class LinuxAIAssistant:
         valid_role = role.lower() if role.lower() in ["user", "model"] else "user"
 
         self.chat_history_for_ai.append({"role": valid_role, "parts": [{"text": text_content}]})
+        if not in_ai_chat: self.ai_conversation.note(f"Użytkownik: {text_content}" if valid_role == "user" else text_content)
 
         # Ogranicz liczbę tur w historii (jedna tura = user + model)
         max_history_turns = 5 # Np. 5 ostatnich interakcji user-model
         if len(self.chat_history_for_ai) > max_history_turns * 2: # *2 bo user i model
             self.chat_history_for_ai = self.chat_history_for_ai[-(max_history_turns * 2):]
 
+    def _answer_package_question(self, query: str) -> Optional[str]:
+        # Pytania "czy X jest zainstalowany" / "jaka wersja X" - odpowiedź z indeksu pakietów, bez AI; None - pytanie dla AI
+        question = parse_package_question(query)
+        if not question: return None
+        kind, name = question
+        index = self.system_context.package_index
+        packages = index.packages()
+        if not index.manager: return None # Nieobsługiwana baza pakietów
+        package = name if name in packages else name.lower()
+        polish = self.system_language == "pl"
+        if package in packages:
+            version = packages[package] or "?"
+            if kind == "version":
+                return f"Zainstalowana wersja pakietu {package}: {version} ({index.manager})." if polish else \
+                       f"Installed version of {package}: {version} ({index.manager})."
+            return f"Tak, pakiet {package} jest zainstalowany (wersja {version}, {index.manager})." if polish else \
+                   f"Yes, {package} is installed (version {version}, {index.manager})."
+        answer = f"Pakiet {name} nie jest zainstalowany ({index.manager})." if polish else f"The package {name} is not installed ({index.manager})."
+        similar = ", ".join(f"{similar_name} {version}" for similar_name, version in index.similar(name))
+        if similar:
+            answer += f" Zainstalowane pakiety o podobnej nazwie: {similar}." if polish else f" Installed packages with a similar name: {similar}."
+        program = shutil.which(name)
+        if program:
+            answer += f" Program {name} jest dostępny: {program}." if polish else f" The program {name} is available: {program}."
+        return answer
+
     def process_query(self, query: str) -> Dict[str, Any]:
         current_dir_for_ai_context = self.command_executor.get_current_working_dir()
         self.logger.info(f"Backend process_query: Zapytanie='{query}', CWD dla kontekstu AI='{current_dir_for_ai_context}'")
+
+        local_answer = self._answer_package_question(query)
+        if local_answer:
+            self.logger.info(f"Backend process_query: Odpowiedź z indeksu pakietów: {local_answer}")
+            self._add_to_chat_history("user", query)
+            self._add_to_chat_history("model", f"Odpowiedź tekstowa AI:\n{local_answer}")
+            return {"success": True, "command": None, "explanation": local_answer, "error": None, "is_text_answer": True,
+                    "needs_file_search": False, "file_search_pattern": None, "file_search_message": None,
+                    "suggested_interaction_input": None, "suggested_button_label": None, "needs_external_terminal": False,
+                    "working_dir": current_dir_for_ai_context}
         self.logger.debug(f"Bieżąca historia czatu PRZED dodaniem zapytania: {json.dumps(self.chat_history_for_ai, indent=2, ensure_ascii=False)}")
 
         cwd_entries_list: List[str] = []
         try:
             if os.path.isdir(current_dir_for_ai_context):
-                all_entries = os.listdir(current_dir_for_ai_context)
-                # Sortuj dla spójności i ogranicz liczbę, aby nie przekroczyć limitu tokenów AI
-                cwd_entries_list = all_entries[:100] # Pierwsze 100 wystarczy dla kontekstu
-                if len(all_entries) > 100 : self.logger.info(f"Backend process_query: Dostarczam pierwsze 100 wpisów z CWD ({len(all_entries)} wszystkich).")
+                all_entries = sorted(os.listdir(current_dir_for_ai_context)) # Sortowanie - ta sama lista nie jest wysyłana ponownie
+                # Ile wpisów trafi do promptu, decyduje budżet tokenów (PromptBudget); tu tylko ochrona przed ogromnymi katalogami
+                cwd_entries_list = all_entries[:MAX_CWD_ENTRIES_FOR_AI]
+                if len(all_entries) > MAX_CWD_ENTRIES_FOR_AI: self.logger.info(f"Backend process_query: Dostarczam pierwsze {MAX_CWD_ENTRIES_FOR_AI} wpisów z CWD ({len(all_entries)} wszystkich).")
                 else: self.logger.info(f"Backend process_query: Dostarczam {len(cwd_entries_list)} wpisów z CWD.")
         except Exception as e: self.logger.warning(f"Backend: Nie udało się odczytać wpisów z CWD ({current_dir_for_ai_context}): {e}")
 
-        self._add_to_chat_history("user", query)
+        self._add_to_chat_history("user", query, in_ai_chat=True)
         self.logger.debug(f"Bieżąca historia czatu PO dodaniu zapytania użytkownika: {json.dumps(self.chat_history_for_ai, indent=2, ensure_ascii=False)}")
 
         if not self.ai_engine.is_configured:
@@ -172,11 +255,14 @@ class LinuxAIAssistant:
             # Zwróć strukturę zgodną z oczekiwaniami GUI, nawet przy błędzie
             return {"success": False, "error": "Silnik AI nie jest skonfigurowany.", "working_dir": current_dir_for_ai_context, "is_text_answer": False, "needs_external_terminal": False}
 
+        system_context = self.system_context.describe(query) # Tylko kategorie, których dotyczy zapytanie
+        if system_context: self.logger.info(f"Backend process_query: Kontekst systemu dla AI: {list(system_context)}")
+
         # Pierwsze wywołanie AI
         api_response = self.ai_engine.generate_command_with_explanation(
             user_prompt=query, distro_info=self.distro_info, working_dir=current_dir_for_ai_context,
-            cwd_file_list=cwd_entries_list, history=self.chat_history_for_ai, # Przekaż aktualną historię
-            language_instruction=self._get_ai_language_instruction()
+            cwd_file_list=cwd_entries_list, conversation=self.ai_conversation, # Historia jest w sesji czatu rozmowy
+            language_instruction=self._get_ai_language_instruction(), system_context=system_context
         )
 
         # Jeśli AI zażądało przeszukania plików
@@ -206,13 +292,8 @@ class LinuxAIAssistant:
             else:
                 search_feedback_to_ai += "Nic nie znaleziono."
 
-            # --- POPRAWIONA LOGIKA BUDOWANIA HISTORII DLA PONOWNEGO WYWOŁANIA ---
-            # Kopiujemy całą historię do tego momentu (która zawiera oryginalne zapytanie użytkownika)
-            history_for_next_turn = [turn.copy() for turn in self.chat_history_for_ai]
-            # Dodajemy odpowiedź systemową (rezultat wyszukiwania) jako turę modelu
-            history_for_next_turn.append({"role": "model", "parts": [{"text": search_feedback_to_ai}]})
-            # Nie modyfikujemy self.chat_history_for_ai tutaj bezpośrednio,
-            # bo _add_to_chat_history na końcu tej funkcji zajmie się finalną odpowiedzią AI.
+            # Odpowiedź SZUKAJ_PLIKOW jest już w sesji czatu; wyniki wyszukiwania idą w następnej wiadomości
+            self.ai_conversation.note(search_feedback_to_ai)
 
             self.logger.info("Ponowne wywołanie AI z oryginalnym zapytaniem i zaktualizowaną listą plików oraz informacją o wyszukiwaniu w historii.")
             api_response = self.ai_engine.generate_command_with_explanation(
@@ -220,8 +301,9 @@ class LinuxAIAssistant:
                 distro_info=self.distro_info,
                 working_dir=current_dir_for_ai_context,
                 cwd_file_list=combined_files_for_ai, # Przekaż połączoną listę plików
-                history=history_for_next_turn,      # Użyj nowo zbudowanej historii
-                language_instruction=self._get_ai_language_instruction()
+                conversation=self.ai_conversation,
+                language_instruction=self._get_ai_language_instruction(),
+                system_context=system_context
             )
 
         # Przygotowanie odpowiedzi dla GUI
@@ -245,14 +327,14 @@ class LinuxAIAssistant:
             error_msg = api_response.error or "Nie udało się przetworzyć zapytania"
             # Nie loguj do głównej historii, jeśli to tylko prośba o szukanie, bo to już obsłużone powyżej
             if api_response.error != "SZUKAJ_PLIKOW":
-                if api_response.error == "CLARIFY_REQUEST": self._add_to_chat_history("model", "System: AI requested clarification.")
-                elif api_response.error == "DANGEROUS_REQUEST": self._add_to_chat_history("model", "System: AI identified query as dangerous.")
+                if api_response.error == "CLARIFY_REQUEST": self._add_to_chat_history("model", "System: AI requested clarification.", in_ai_chat=True)
+                elif api_response.error == "DANGEROUS_REQUEST": self._add_to_chat_history("model", "System: AI identified query as dangerous.", in_ai_chat=True)
                 elif api_response.error: self._add_to_chat_history("model", f"System: Error from AI - {api_response.error}")
             # response_to_gui["error"] już ustawione
         else:
             if api_response.is_text_answer:
                 # response_to_gui["explanation"] już ustawione
-                self._add_to_chat_history("model", f"Odpowiedź tekstowa AI:\n{api_response.explanation}")
+                self._add_to_chat_history("model", f"Odpowiedź tekstowa AI:\n{api_response.explanation}", in_ai_chat=True)
             elif api_response.command:
                 # response_to_gui["command"] i ["explanation"] już ustawione
                 ai_model_response_text = f"Polecenie: {api_response.command}\nWYJAŚNIENIE: {api_response.explanation}"
@@ -260,7 +342,7 @@ class LinuxAIAssistant:
                      ai_model_response_text += f"\nINTERAKCJA_POLECENIE: {api_response.suggested_interaction_input};{api_response.suggested_button_label}"
                 elif api_response.needs_external_terminal and api_response.suggested_button_label:
                      ai_model_response_text += f"\nINTERAKCJA_TERMINAL: ;{api_response.suggested_button_label}"
-                self._add_to_chat_history("model", ai_model_response_text)
+                self._add_to_chat_history("model", ai_model_response_text, in_ai_chat=True)
             # Jeśli needs_file_search było true, ale drugie wywołanie AI nie dało komendy/odpowiedzi tekstowej,
             # to `api_response` może nie mieć `command` ani `is_text_answer`. Wtedy historia modelu
             # będzie zawierać tylko `search_feedback_to_ai` z poprzedniego kroku.
@@ -269,7 +351,8 @@ class LinuxAIAssistant:
         return response_to_gui
 
 
-    def execute_command(self, command: str, is_interactive_sudo_prompt: bool = False) -> Dict[str, Any]:
+    def execute_command(self, command: str, is_interactive_sudo_prompt: bool = False,
+                        output_callback: Optional[Callable[[str, str], None]] = None) -> Dict[str, Any]:
         self.logger.info(f"Backend: Przygotowanie do wykonania: '{command}' (sudo interaktywne: {is_interactive_sudo_prompt}) w CWD: '{self.command_executor.get_current_working_dir()}'")
         command_to_run = command
         original_command_for_log = command # Zachowaj oryginalne polecenie do logowania i analizy błędów
@@ -297,10 +380,12 @@ class LinuxAIAssistant:
             # Jeśli GUI wysyła polecenie sudo, to GUI powinno obsłużyć prompt o hasło i przekazać je przez `echo ... | sudo -S`
 
         self.logger.info(f"Backend: Ostateczne wykonanie: '{command_to_run}' w CWD: '{self.command_executor.get_current_working_dir()}'")
-        result = self.command_executor.execute(command_to_run) # CommandExecutor zajmuje się aktualizacją CWD
+        result = self.command_executor.execute(command_to_run, output_callback=output_callback) # CommandExecutor zajmuje się aktualizacją CWD
 
         fix_suggestion_text: Optional[str] = None
-        if not result.success and (result.stderr or result.return_code != 0): # Jeśli polecenie nie powiodło się
+        if result.cancelled: # Użytkownik sam przerwał polecenie - analiza błędu nie ma sensu
+            self.logger.info(f"Backend: Polecenie '{original_command_for_log}' przerwane na żądanie.")
+        elif not result.success and (result.stderr or result.return_code != 0): # Jeśli polecenie nie powiodło się
             self.logger.info(f"Backend: Polecenie '{original_command_for_log}' nie powiodło się (RC: {result.return_code}). Analizowanie błędu...")
             if self.ai_engine.is_configured:
                 error_analysis_response = self.ai_engine.analyze_execution_error_and_suggest_fix(
@@ -332,11 +417,153 @@ class LinuxAIAssistant:
             self._add_to_chat_history("model", output_summary.strip())
 
 
+        return self._result_to_response(result, original_command_for_log, fix_suggestion_text)
+
+    @staticmethod
+    def _result_to_response(result: CommandResult, command: str, fix_suggestion: Optional[str] = None) -> Dict[str, Any]:
         return {"success": result.success, "stdout": result.stdout, "stderr": result.stderr,
                 "return_code": result.return_code, "execution_time": result.execution_time,
                 "working_dir": result.working_dir, # Zwróć katalog, w którym polecenie było wykonane
-                "command": original_command_for_log, # Zwróć oryginalne polecenie
-                "fix_suggestion": fix_suggestion_text}
+                "command": command, # Zwróć oryginalne polecenie
+                "fix_suggestion": fix_suggestion,
+                "stdout_total_bytes": result.stdout_total_bytes, "stderr_total_bytes": result.stderr_total_bytes,
+                "stdout_spill_path": result.stdout_spill_path, "stderr_spill_path": result.stderr_spill_path,
+                **{field_name: getattr(result, field_name) for field_name in RESOURCE_USAGE_FIELDS},
+                "limits_exceeded": list(result.limits_exceeded), "timed_out": result.timed_out,
+                "cancelled": result.cancelled}
+
+    def execute_for_client(self, command: str, output_callback: Optional[Callable[[str, str], None]] = None) -> Dict[str, Any]:
+        # Wykonanie zlecone przez GUI/klienta (tryb --execute lub żądanie 'execute' serwera)
+        cmd_prefix_exec = command.split(' ', 1)[0].lower()
+        if cmd_prefix_exec in self.interactive_commands_requiring_new_terminal:
+            self.logger.warning(f"Backend: Polecenie '{command}' jest interaktywne i nie może być wykonane bezpośrednio przez backend. Zwracam błąd.")
+            return {
+                "success": False, # Niepowodzenie wykonania przez backend
+                "error": f"Polecenie '{command}' jest interaktywne - uruchom je operacją 'interactive' (pseudoterminal).",
+                "is_text_answer": False,
+                "needs_external_terminal": True, # Kluczowa flaga dla GUI
+                "command": command, # Zwróć oryginalne polecenie
+                "stdout": "", "stderr": "", "return_code": -1, "execution_time": 0.0,
+                "working_dir": self.command_executor.get_current_working_dir()
+            }
+        # is_interactive_sudo_prompt=False, bo GUI powinno obsłużyć hasło i wysłać je przez `echo`
+        return self.execute_command(command, is_interactive_sudo_prompt=False, output_callback=output_callback)
+
+    def start_interactive_for_client(self, command: str, rows: int, cols: int,
+                                     emit_event: Callable[[Dict[str, Any]], None], request_id: Any, op: str) -> Dict[str, Any]:
+        # Polecenie interaktywne w pseudoterminalu backendu. Odpowiedź wraca od razu z identyfikatorem sesji; ekran płynie
+        # zdarzeniami 'screen' (tylko zmienione wiersze), zakończenie - zdarzeniem 'exit' z wynikiem jak dla 'execute'.
+        self._interactive_session_seq += 1
+        session_id = str(self._interactive_session_seq)
+
+        def exited(result: CommandResult):
+            self.interactive_sessions.pop(session_id, None)
+            self._add_to_chat_history("model", f"System: Zakończono interaktywne polecenie '{command}' (RC: {result.return_code}).")
+            emit_event(exit_event(self._result_to_response(result, command), request_id, op))
+        try:
+            session = self.command_executor.execute_interactive(
+                command, rows=rows, cols=cols, on_exit=exited,
+                on_update=lambda update: emit_event(screen_event(update, request_id, op)))
+        except (ValueError, OSError) as e_start:
+            self.logger.warning(f"Backend: Nie można uruchomić polecenia interaktywnego '{command}': {e_start}")
+            return {"success": False, "error": str(e_start), "command": command, "working_dir": self.command_executor.get_current_working_dir()}
+        self.interactive_sessions[session_id] = session
+        return {"success": True, "session": session_id, "command": command, "working_dir": self.command_executor.get_current_working_dir()}
+
+    def control_interactive_session(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        # Operacja 'pty': "data" - wpisany tekst/klawisze, "rows"+"cols" - nowy rozmiar, "close": true - zakończenie (SIGHUP)
+        session_id = str(request.get("session"))
+        session = self.interactive_sessions.get(session_id)
+        if session is not None and not session.running: # Zakończyła się zaraz po uruchomieniu, przed rejestracją
+            del self.interactive_sessions[session_id]; session = None
+        if session is None: return {"success": False, "error": f"Nieznana lub zakończona sesja: {request.get('session')!r}"}
+        if request.get("data"): session.write(str(request["data"]).encode("utf-8"))
+        if request.get("rows") and request.get("cols"): session.resize(int(request["rows"]), int(request["cols"]))
+        if request.get("close"): session.close()
+        return {"success": True}
+
+    @staticmethod
+    def validate_for_client(commands: List[str]) -> Dict[str, Any]:
+        # Werdykty dla wielu poleceń naraz (np. wszystkie kroki planu AI przed pokazaniem go użytkownikowi)
+        verdicts = SecurityValidator.validate_many(commands)
+        return {"success": True, "verdicts": [{"safe": verdict.is_safe, "dangerous_rules": list(verdict.dangerous_rules),
+                                               "confirmation_rules": list(verdict.confirmation_rules),
+                                               "warning_rules": list(verdict.warning_rules)} for verdict in verdicts]}
+
+    def run_in_cli_terminal(self, command: str) -> Optional[int]:
+        # Tryb CLI ma już terminal - program interaktywny dziedziczy go (i pierwszy plan), bez emulatora ani pseudoterminala
+        is_safe, message = SecurityValidator.validate(command)
+        if not is_safe:
+            print(f"{Fore.RED}{message}{Style.RESET_ALL}"); return None
+        self.logger.info(f"Uruchamianie polecenia interaktywnego w terminalu CLI: '{command}'")
+        try:
+            process = subprocess.Popen(["/bin/bash", "-c", command], cwd=self.command_executor.get_current_working_dir())
+        except OSError as e_run:
+            print(f"{Fore.RED}Nie udało się uruchomić '{command}': {e_run}{Style.RESET_ALL}"); return None
+        while True:
+            try: return_code = process.wait(); break
+            except KeyboardInterrupt: continue # Ctrl+C trafia też do programu - czekamy, aż sam się zakończy
+        self._add_to_chat_history("model", f"System: Zakończono interaktywne polecenie '{command}' (RC: {return_code}).")
+        return return_code
+
+    def handle_request(self, request: Dict[str, Any],
+                       emit_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        # Obsługa jednego żądania protokołu JSON-lines (tryb --serve). Odpowiedź zawiera to samo 'id'.
+        # Dla "stream": true zdarzenia 'output' (fragmenty stdout/stderr) idą przez emit_event przed odpowiedzią.
+        request_id = request.get("id")
+        op = request.get("op")
+        response: Dict[str, Any] = {"id": request_id, "op": op}
+        if op == "cancel": # Przychodzi w trakcie innego żądania (z innego wątku) - bez zmiany katalogu roboczego
+            response["result"] = {"success": True, "cancelled": self.command_executor.cancel()}
+            return response
+
+        requested_wd = request.get("working_dir")
+        if requested_wd and os.path.abspath(requested_wd) != self.command_executor.get_current_working_dir():
+            self.command_executor.set_current_working_dir(requested_wd)
+
+        if op == "query":
+            response["result"] = self.process_query(str(request.get("query", "")))
+        elif op == "execute":
+            output_callback = None
+            if request.get("stream") and emit_event:
+                output_callback = lambda stream_name, text: emit_event(output_event(stream_name, text, request_id, op))
+            response["result"] = self.execute_for_client(str(request.get("command", "")), output_callback=output_callback)
+        elif op == "interactive":
+            if not emit_event:
+                response["error"] = "Operacja 'interactive' wymaga strumienia zdarzeń (--serve, --socket lub silnik w procesie GUI)."
+            else:
+                response["result"] = self.start_interactive_for_client(
+                    str(request.get("command", "")), int(request.get("rows") or DEFAULT_PTY_ROWS),
+                    int(request.get("cols") or DEFAULT_PTY_COLS), emit_event, request_id, op)
+        elif op == "pty":
+            response["result"] = self.control_interactive_session(request)
+        elif op == "analyze":
+            analysis = self.ai_engine.analyze_text_input_type(str(request.get("text", "")), language_instruction=self._get_ai_language_instruction())
+            response["result"] = asdict(analysis)
+        elif op == "fix":
+            fix_response = self.ai_engine.analyze_execution_error_and_suggest_fix(
+                str(request.get("command", "")), str(request.get("stderr", "")), int(request.get("return_code", 1)),
+                self.distro_info, self.command_executor.get_current_working_dir(),
+                language_instruction=self._get_ai_language_instruction()
+            )
+            response["result"] = asdict(fix_response)
+        elif op == "history":
+            # Filtry: prefix, return_code, working_dir, since/until (znaczniki czasu), limit (domyślnie 50); od najnowszego
+            records = self.command_executor.history.query(
+                prefix=request.get("prefix"), return_code=request.get("return_code"), working_dir=request.get("working_dir_filter"),
+                since=request.get("since"), until=request.get("until"), limit=int(request.get("limit", 50)))
+            response["result"] = {"success": True, "entries": [record.to_dict() for record in records]}
+        elif op == "validate":
+            commands = request.get("commands")
+            if isinstance(commands, list) and all(isinstance(command, str) for command in commands):
+                response["result"] = self.validate_for_client(commands)
+            else: # Bez listy poleceń nie ma czego oceniać - werdykt dla "" byłby fałszywie bezpieczny
+                response["error"] = "Operacja 'validate' wymaga pola 'commands' z listą poleceń (tekst)."
+        elif op == "ping":
+            response["result"] = {"success": True, "working_dir": self.command_executor.get_current_working_dir()}
+        else:
+            response["error"] = f"Nieznana operacja: {op!r}"
+        return response
 
     def interactive_mode(self):
         self.logger.info("Backend: Wejście w tryb interaktywny.")
@@ -438,45 +665,9 @@ class LinuxAIAssistant:
                     if execute_input.lower() in ["t", "tak", "y", "yes"]:
                         self.logger.info(f"Użytkownik CLI potwierdził wykonanie: '{generated_command}'")
 
-                        # Sprawdzenie, czy polecenie wymaga nowego terminala (na podstawie flagi z AI)
+                        # Polecenie interaktywne (flaga z AI) działa na pierwszym planie w tym samym terminalu co CLI
                         if result.get("needs_external_terminal"):
-                            self.logger.info(f"Polecenie '{generated_command}' wymaga nowego terminala. Próba uruchomienia...")
-                            try:
-                                terminal_emulator = None
-                                # Kolejność preferencji dla emulatorów terminala
-                                for term_cmd in ["gnome-terminal", "konsole", "xfce4-terminal", "lxterminal", "mate-terminal", "xterm"]:
-                                    if shutil.which(term_cmd):
-                                        terminal_emulator = term_cmd
-                                        break
-
-                                if not terminal_emulator: # Jeśli żaden z preferowanych nie jest dostępny
-                                    terminal_emulator = "xterm" # Fallback do xterm, który jest często dostępny
-
-                                # Zbuduj polecenie do wykonania w nowym terminalu
-                                # Upewnij się, że CWD jest ustawiony poprawnie w nowym terminalu
-                                # Dodaj pauzę na końcu, aby użytkownik mógł zobaczyć wynik
-                                cmd_payload = f"cd {shlex.quote(self.command_executor.get_current_working_dir())} && {generated_command}; echo -e '\\n\\n--- Polecenie zakończone. Naciśnij Enter, aby zamknąć ten terminal. ---'; read"
-
-                                if terminal_emulator == "gnome-terminal":
-                                    # gnome-terminal -- bash -c "komenda"
-                                    subprocess.Popen([terminal_emulator, "--", "bash", "-c", cmd_payload])
-                                elif terminal_emulator == "konsole":
-                                     # konsole -e bash -c "komenda"
-                                     subprocess.Popen([terminal_emulator, "-e", "bash", "-c", cmd_payload])
-                                elif terminal_emulator in ["xfce4-terminal", "lxterminal", "mate-terminal"]:
-                                     # te często używają -e lub --command=
-                                     subprocess.Popen([terminal_emulator, "-e", f"bash -c \"{cmd_payload.replace('\"', '\\\"')}\""]) # Wymaga dodatkowego escapowania dla niektórych
-                                else: # xterm i inne, które mogą używać -e
-                                    subprocess.Popen([terminal_emulator, "-e", f"bash -c \"{cmd_payload.replace('\"', '\\\"')}\""])
-
-
-                                print(f"{Fore.GREEN}Polecenie '{generated_command}' powinno zostać uruchomione w nowym oknie terminala.{Style.RESET_ALL}")
-                                print(f"{Fore.CYAN}Możesz kontynuować pracę w tym oknie asystenta.{Style.RESET_ALL}")
-                                self._add_to_chat_history("model", f"System: Uruchomiono '{generated_command}' w nowym terminalu.")
-                            except Exception as e_term:
-                                print(f"{Fore.RED}Nie udało się automatycznie otworzyć nowego terminala dla '{generated_command}'. Błąd: {e_term}{Style.RESET_ALL}")
-                                print(f"{Fore.YELLOW}Proszę ręcznie otworzyć terminal i wykonać: cd {self.command_executor.get_current_working_dir()} && {generated_command}{Style.RESET_ALL}")
-                                self._add_to_chat_history("model", f"System: Nie udało się uruchomić '{generated_command}' w nowym terminalu. Błąd: {e_term}")
+                            self.run_in_cli_terminal(generated_command)
 
                         else: # Normalne wykonanie przez CommandExecutor
                             print(f"{Fore.YELLOW}Wykonywanie...{Style.RESET_ALL}")
@@ -520,17 +711,266 @@ class LinuxAIAssistant:
         print(f"- {Fore.YELLOW}exit/quit{Style.RESET_ALL}: Zakończ\n")
 
 
+def dispatch_request(assistant: LinuxAIAssistant, request: Dict[str, Any],
+                     emit_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    # Wspólne dla --serve, --socket i silnika w procesie GUI: wyjątek zamieniany jest na odpowiedź z 'error'
+    try:
+        return assistant.handle_request(request, emit_event)
+    except Exception as e_handle:
+        logger_main_cli.error(f"Backend: Błąd obsługi żądania {request.get('id')!r}: {e_handle}", exc_info=True)
+        return {"id": request.get("id"), "op": request.get("op"), "error": f"Błąd backendu: {e_handle}"}
+
+
+def serve_json_lines(assistant: LinuxAIAssistant, input_stream, output_stream):
+    # Pętla trybu --serve: jedno żądanie JSON na linię na wejściu, jedna odpowiedź JSON na linię na wyjściu.
+    # Proces (import google.genai, klient Gemini, wykrycie dystrybucji) żyje przez całą sesję GUI.
+    send_lock = threading.Lock() # Zdarzenia sesji pseudoterminala wysyła ich własny wątek
+
+    def send(message: Dict[str, Any]):
+        with send_lock:
+            output_stream.write(json.dumps(message) + "\n")
+            output_stream.flush()
+
+    # Żądania obsługuje po kolei wątek roboczy; pętla odczytu obsługuje 'cancel' od razu, w trakcie wykonywanego polecenia.
+    requests: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+
+    def work():
+        while (request := requests.get()) is not None:
+            try: send(dispatch_request(assistant, request, send))
+            except (BrokenPipeError, ConnectionResetError): # Klient rozłączył się - pozostałe żądania tylko kończymy
+                logger_main_cli.info("Backend --serve: Odbiorca odpowiedzi rozłączył się.")
+
+    worker = threading.Thread(target=work, name="serve-worker", daemon=True)
+    worker.start()
+    logger_main_cli.info("Backend: Tryb --serve uruchomiony, oczekiwanie na żądania JSON-lines.")
+    try:
+        for raw_line in iter(input_stream.readline, ""):
+            line = raw_line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict): raise ValueError("żądanie musi być obiektem JSON")
+            except ValueError as e_req:
+                logger_main_cli.error(f"Backend --serve: Niepoprawne żądanie '{line[:200]}': {e_req}")
+                send({"id": None, "error": f"Niepoprawne żądanie JSON: {e_req}"})
+                continue
+
+            if request.get("op") == "cancel":
+                send(dispatch_request(assistant, request, send))
+            elif request.get("op") == "shutdown":
+                requests.put(None); worker.join() # Odpowiedź na shutdown po odpowiedziach na wcześniejsze żądania
+                send({"id": request.get("id"), "op": "shutdown", "result": {"success": True}})
+                break
+            else:
+                requests.put(request)
+    finally:
+        requests.put(None); worker.join() # EOF - żądania przeczytane przed nim są jeszcze obsługiwane
+    logger_main_cli.info("Backend: Tryb --serve zakończony.")
+
+
+class _AssistantConnectionHandler(socketserver.StreamRequestHandler):
+    # Każde połączenie dostaje własny LinuxAIAssistant (CWD egzekutora, chat_history_for_ai),
+    # klient Gemini, informacje o dystrybucji i kontekst systemu są współdzielone przez serwer.
+    def handle(self):
+        server: "AssistantSocketServer" = self.server # type: ignore[assignment]
+        logger_main_cli.info("Backend --socket: Nowe połączenie klienta.")
+        assistant = LinuxAIAssistant(initial_working_dir=server.initial_working_dir,
+                                     ai_engine=server.shared_ai_engine, distro_info=server.shared_distro_info,
+                                     resource_limits=server.resource_limits, execution_history=server.shared_execution_history,
+                                     system_context=server.shared_system_context)
+        reader = io.TextIOWrapper(self.rfile, encoding="utf-8", errors="replace")
+        writer = io.TextIOWrapper(self.wfile, encoding="utf-8", write_through=True)
+        try:
+            serve_json_lines(assistant, reader, writer)
+        except (BrokenPipeError, ConnectionResetError):
+            logger_main_cli.info("Backend --socket: Klient rozłączył się w trakcie obsługi żądania.")
+        finally:
+            assistant.command_executor.close()
+        logger_main_cli.info("Backend --socket: Połączenie zakończone.")
+
+
+class AssistantSocketServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, initial_working_dir: Optional[str] = None,
+                 resource_limits: Optional[ResourceLimits] = None):
+        self.initial_working_dir = initial_working_dir
+        self.resource_limits = resource_limits
+        self.shared_execution_history = ExecutionHistory(path=EXECUTION_HISTORY_FILE)
+        self.shared_ai_engine = GeminiIntegration(model_name=LinuxAIAssistant.AI_MODEL_NAME)
+        self.shared_distro_info = DistributionDetector.detect_distribution()
+        self.shared_system_context = SystemContext()
+        super().__init__(socket_path, _AssistantConnectionHandler)
+
+
+def serve_unix_socket(socket_path: str, initial_working_dir: Optional[str] = None,
+                      resource_limits: Optional[ResourceLimits] = None):
+    socket_dir = os.path.dirname(socket_path)
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    if os.path.exists(socket_path):
+        # Sprawdź, czy gniazdo należy do działającego serwera, czy zostało po poprzednim uruchomieniu
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socket_path)
+                raise RuntimeError(f"Serwer backendu już działa na gnieździe {socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                logger_main_cli.info(f"Backend --socket: Usuwam nieaktualne gniazdo {socket_path}")
+                os.unlink(socket_path)
+
+    server = AssistantSocketServer(socket_path, initial_working_dir, resource_limits)
+    os.chmod(socket_path, 0o600) # Tylko właściciel może wysyłać polecenia do wykonania
+    logger_main_cli.info(f"Backend --socket: Nasłuchiwanie na {socket_path}")
+    print(f"{Fore.GREEN}Serwer backendu nasłuchuje na {socket_path} (Ctrl+C kończy).{Style.RESET_ALL}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path): os.unlink(socket_path)
+        logger_main_cli.info("Backend --socket: Serwer zatrzymany.")
+
+
+def read_history_file(path: str) -> List[Tuple[int, str]]:
+    # (numer_linii, polecenie): command_history.json GUI to lista JSON; historia powłoki - polecenie na linię,
+    # linie "#<znacznik czasu>" (HISTTIMEFORMAT) są pomijane
+    with open(path, "r", encoding="utf-8", errors="replace") as f: content = f.read()
+    if path.endswith(".json"):
+        return [(index + 1, entry) for index, entry in enumerate(json.loads(content)) if isinstance(entry, str)]
+    return [(index + 1, line) for index, line in enumerate(content.splitlines()) if line.strip() and not re.fullmatch(r"#\d+", line)]
+
+
+def audit_history_files(paths: List[str], processes: int = 0) -> Dict[str, Any]:
+    # Jedno validate_many() dla wszystkich plików; w wyniku tylko polecenia, do których pasuje jakaś reguła
+    entries: List[Tuple[str, int, str]] = []
+    sources: Dict[str, Any] = {}
+    for path in paths:
+        try: lines = read_history_file(path)
+        except FileNotFoundError: continue
+        except (OSError, ValueError) as e:
+            sources[path] = {"error": str(e)}; continue
+        sources[path] = {"commands": len(lines)}
+        entries.extend((path, line_number, command) for line_number, command in lines)
+    verdicts = SecurityValidator.validate_many([command for _, _, command in entries], processes=processes)
+    findings = [{"source": path, "line": line_number, "command": command, "safe": verdict.is_safe,
+                 "dangerous_rules": list(verdict.dangerous_rules), "confirmation_rules": list(verdict.confirmation_rules),
+                 "warning_rules": list(verdict.warning_rules)}
+                for (path, line_number, command), verdict in zip(entries, verdicts)
+                if verdict.dangerous_rules or verdict.confirmation_rules or verdict.warning_rules]
+    return {"success": True, "sources": sources, "checked": len(entries), "findings": findings}
+
+
+def _print_audit_result_cli(audit: Dict[str, Any]):
+    for path, source in audit["sources"].items():
+        if "error" in source: print(f"{Fore.RED}{path}: {source['error']}{Style.RESET_ALL}")
+    for finding in audit["findings"]:
+        color, label = (Fore.RED, "NIEBEZPIECZNE") if not finding["safe"] else \
+                       (Fore.YELLOW, "potwierdzenie") if finding["confirmation_rules"] else (Fore.CYAN, "ostrzeżenie")
+        print(f"{color}[{label}]{Style.RESET_ALL} {finding['source']}:{finding['line']}: {finding['command']}")
+    dangerous = sum(1 for finding in audit["findings"] if not finding["safe"])
+    confirmation = sum(1 for finding in audit["findings"] if finding["safe"] and finding["confirmation_rules"])
+    print(f"Sprawdzono {audit['checked']} poleceń: {dangerous} niebezpiecznych, {confirmation} wymagających potwierdzenia, "
+          f"{len(audit['findings']) - dangerous - confirmation} z ostrzeżeniami.")
+
+
+def _print_execute_result_cli(exec_result: Dict[str, Any]):
+    if exec_result.get("needs_external_terminal"):
+        print(f"{Fore.RED}{exec_result['error']}{Style.RESET_ALL}") # Dla debugowania CLI
+        return
+    print(f"Polecenie: {exec_result.get('command')}")
+    if exec_result.get("success"): print(f"{Fore.GREEN}Wykonano pomyślnie.{Style.RESET_ALL}")
+    else: print(f"{Fore.RED}Błąd wykonania: {exec_result.get('stderr') or exec_result.get('error')}{Style.RESET_ALL}")
+    if exec_result.get("stdout"): print(f"Stdout:\n{exec_result.get('stdout')}")
+    if exec_result.get("cpu_user_time") is not None:
+        usage = f"Zasoby: CPU user {exec_result['cpu_user_time']:.3f}s, sys {exec_result['cpu_system_time']:.3f}s"
+        if exec_result.get("max_rss_kb") is not None:
+            usage += (f", max RSS {exec_result['max_rss_kb']} KB, I/O bloków {exec_result['block_input_ops']}/{exec_result['block_output_ops']}"
+                      f", przełączenia kontekstu {exec_result['voluntary_context_switches']}/{exec_result['involuntary_context_switches']}")
+        print(usage)
+
+
+def _print_query_result_cli(result_process: Dict[str, Any]):
+    if result_process.get("success"):
+        if result_process.get("is_text_answer"):
+            print(f"Odpowiedź AI: {result_process.get('explanation')}")
+        elif result_process.get("command"):
+            print(f"Sugerowane polecenie: {result_process.get('command')}")
+            if result_process.get("explanation"): print(f"Wyjaśnienie: {result_process['explanation']}")
+            if result_process.get("needs_external_terminal"): print(f"{Fore.YELLOW}To polecenie powinno być uruchomione w nowym terminalu.{Style.RESET_ALL}")
+            elif result_process.get("suggested_button_label"):
+                print(f"Sugestia interakcji (etykieta przycisku): {result_process['suggested_button_label']}")
+                print(f"Sugerowana odpowiedź tekstowa: {result_process.get('suggested_interaction_input')}")
+        else: # success, ale brak polecenia/odpowiedzi
+            print(f"Błąd: AI zwróciło sukces, ale bez polecenia/odpowiedzi.")
+    else: # not success
+        if result_process.get("error") == "CLARIFY_REQUEST": print(f"{Fore.YELLOW}AI prosi o doprecyzowanie.{Style.RESET_ALL}")
+        elif result_process.get("error") == "DANGEROUS_REQUEST": print(f"{Fore.RED}AI zidentyfikowało zapytanie jako niebezpieczne.{Style.RESET_ALL}")
+        else: print(f"Błąd: {result_process.get('error')}")
+
+
 def main():
+    configure_cli_process(sys.argv[1:])
     parser = argparse.ArgumentParser(description="Asystent AI dla systemu Linux (Backend)")
     parser.add_argument("--query", "-q", help="Zapytanie do asystenta")
     parser.add_argument("--execute", "-e", action="store_true", help="Automatycznie wykonaj polecenie (używane przez GUI)")
     parser.add_argument("--json", "-j", action="store_true", help="Zwróć wynik w formacie JSON (używane przez GUI)")
     parser.add_argument("--working-dir", "-wd", help="Początkowy katalog roboczy dla sesji backendu (używane przez GUI)")
+    parser.add_argument("--serve", action="store_true", help="Tryb długo działającego backendu: żądania JSON-lines na stdin, odpowiedzi na stdout (używane przez GUI)")
+    parser.add_argument("--socket", nargs="?", const="", default=None, metavar="ŚCIEŻKA",
+                        help=f"Serwer dla wielu klientów na gnieździe Unix (domyślnie {default_socket_path()})")
+    parser.add_argument("--connect", nargs="?", const="", default=None, metavar="ŚCIEŻKA",
+                        help="Wyślij --query (z --execute lub bez) do działającego serwera --socket zamiast uruchamiać własny backend")
+    parser.add_argument("--limit-memory", type=int, metavar="MB", help="Limit pamięci każdego procesu polecenia (RLIMIT_AS) lub zakresu cgroup")
+    parser.add_argument("--limit-cpu", type=int, metavar="SEK", help="Limit czasu CPU każdego procesu polecenia (RLIMIT_CPU)")
+    parser.add_argument("--limit-procs", type=int, metavar="N", help="Limit liczby procesów (RLIMIT_NPROC - wszystkie procesy użytkownika; w cgroup TasksMax)")
+    parser.add_argument("--limit-cpu-quota", type=int, metavar="PROCENT", help="Dławienie CPU poleceń (CPUQuota, tylko z --cgroup)")
+    parser.add_argument("--audit-history", nargs="*", default=None, metavar="PLIK",
+                        help="Sprawdź polecenia z plików historii (domyślnie ~/.bash_history i command_history.json GUI) regułami bezpieczeństwa")
+    parser.add_argument("--cgroup", action="store_true", help="Uruchamiaj polecenia w zakresie cgroup v2 (systemd-run --user --scope), jeśli dostępny")
     args = parser.parse_args()
-
-    logger_main_cli.info(f"Backend uruchomiony z argumentami: query='{args.query}', execute={args.execute}, json={args.json}, working_dir='{args.working_dir}'")
-
-    assistant = LinuxAIAssistant(initial_working_dir=args.working_dir)
+    resource_limits = ResourceLimits(memory_mb=args.limit_memory, cpu_seconds=args.limit_cpu, max_processes=args.limit_procs,
+                                     cpu_quota_percent=args.limit_cpu_quota, use_cgroup=args.cgroup)
+    if not resource_limits.is_set(): resource_limits = None
+
+    logger_main_cli.info(f"Backend uruchomiony z argumentami: query='{args.query}', execute={args.execute}, json={args.json}, serve={args.serve}, socket={args.socket!r}, connect={args.connect!r}, working_dir='{args.working_dir}'")
+
+    if args.audit_history is not None:
+        audit = audit_history_files(args.audit_history or AUDITED_HISTORY_FILES)
+        if args.json: print(json.dumps(audit, ensure_ascii=False))
+        else: _print_audit_result_cli(audit)
+        return
+
+    if args.socket is not None:
+        become_child_subreaper()
+        serve_unix_socket(args.socket or default_socket_path(), initial_working_dir=args.working_dir, resource_limits=resource_limits)
+        return
+
+    if args.connect is not None:
+        if not args.query: parser.error("--connect wymaga --query")
+        request: Dict[str, Any] = {"id": "1", "op": "execute" if args.execute else "query",
+                                   ("command" if args.execute else "query"): args.query}
+        if args.working_dir: request["working_dir"] = os.path.abspath(args.working_dir)
+        on_event = None
+        if args.execute and args.json:
+            request["stream"] = True
+            on_event = lambda event: print(json.dumps(output_event(event["stream"], event["data"])), flush=True)
+        response = request_via_socket(request, args.connect or None, on_event=on_event)
+        result = response.get("result", {"success": False, "error": response.get("error", "Brak odpowiedzi serwera")})
+        if args.json: print(json.dumps(result))
+        elif args.execute: _print_execute_result_cli(result)
+        else: _print_query_result_cli(result)
+        return
+
+    # Osierocone procesy poleceń (np. `polecenie &`) trafiają do backendu i są zbierane po każdym poleceniu
+    become_child_subreaper()
+    assistant = LinuxAIAssistant(initial_working_dir=args.working_dir, resource_limits=resource_limits)
+
+    if args.serve:
+        # Brak skonfigurowanego AI zgłaszany jest per żądanie (process_query zwraca błąd), wykonanie działa offline
+        serve_json_lines(assistant, sys.stdin, sys.stdout)
+        assistant.command_executor.close()
+        return
 
     if not assistant.ai_engine.is_configured:
         # Sprawdź, czy można bezpiecznie uruchomić polecenie offline
@@ -560,53 +1000,20 @@ def main():
     if args.query: # Jeśli podano zapytanie jako argument (zwykle z GUI)
         if args.execute: # GUI prosi o wykonanie polecenia (zwykle podstawowego lub potwierdzonego)
             logger_main_cli.info(f"Backend: Tryb --execute dla polecenia: '{args.query}'")
-            # Sprawdzenie, czy polecenie jest na liście interaktywnych (które backend nie powinien próbować wykonać bezpośrednio dla GUI)
-            cmd_prefix_exec = args.query.split(' ',1)[0].lower()
-            if cmd_prefix_exec in assistant.interactive_commands_requiring_new_terminal:
-                logger_main_cli.warning(f"Backend: Polecenie '{args.query}' w trybie --execute jest interaktywne i nie może być wykonane bezpośrednio przez backend w ten sposób. Zwracam błąd.")
-                # Zwróć informację do GUI, że to polecenie wymaga nowego terminala
-                output = {
-                    "success": False, # Niepowodzenie wykonania przez backend
-                    "error": f"Polecenie '{args.query}' jest interaktywne i powinno być uruchomione w nowym terminalu przez GUI.",
-                    "is_text_answer": False,
-                    "needs_external_terminal": True, # Kluczowa flaga dla GUI
-                    "command": args.query, # Zwróć oryginalne polecenie
-                    "stdout": "", "stderr": "", "return_code": -1, "execution_time": 0.0,
-                    "working_dir": assistant.command_executor.get_current_working_dir()
-                }
-                if args.json: print(json.dumps(output))
-                else: print(f"{Fore.RED}{output['error']}{Style.RESET_ALL}") # Dla debugowania CLI
-            else:
-                # Dla --execute, is_interactive_sudo_prompt=False, bo GUI powinno obsłużyć hasło i wysłać je przez `echo`
-                exec_result = assistant.execute_command(args.query, is_interactive_sudo_prompt=False)
-                if args.json:
-                    print(json.dumps(exec_result))
-                else: # Logika dla CLI, jeśli nie JSON (głównie do debugowania)
-                    print(f"Polecenie: {exec_result.get('command')}")
-                    if exec_result.get("success"): print(f"{Fore.GREEN}Wykonano pomyślnie.{Style.RESET_ALL}")
-                    else: print(f"{Fore.RED}Błąd wykonania: {exec_result.get('stderr') or exec_result.get('error')}{Style.RESET_ALL}")
-                    if exec_result.get("stdout"): print(f"Stdout:\n{exec_result.get('stdout')}")
+            output_callback = None
+            if args.json: # Fragmenty wyjścia jako zdarzenia JSON-lines na bieżąco; ostatnia linia to wynik
+                output_callback = lambda stream_name, text: print(json.dumps(output_event(stream_name, text)), flush=True)
+            exec_result = assistant.execute_for_client(args.query, output_callback=output_callback)
+            if args.json:
+                print(json.dumps(exec_result))
+            else: # Logika dla CLI, jeśli nie JSON (głównie do debugowania)
+                _print_execute_result_cli(exec_result)
         else: # To ścieżka dla GUI do przetwarzania przez AI (--query jest, ale nie --execute)
             result_process = assistant.process_query(args.query)
             if args.json:
                 print(json.dumps(result_process))
             else: # Logika dla CLI, jeśli nie JSON (głównie do debugowania)
-                if result_process.get("success"):
-                    if result_process.get("is_text_answer"):
-                        print(f"Odpowiedź AI: {result_process.get('explanation')}")
-                    elif result_process.get("command"):
-                        print(f"Sugerowane polecenie: {result_process.get('command')}")
-                        if result_process.get("explanation"): print(f"Wyjaśnienie: {result_process['explanation']}")
-                        if result_process.get("needs_external_terminal"): print(f"{Fore.YELLOW}To polecenie powinno być uruchomione w nowym terminalu.{Style.RESET_ALL}")
-                        elif result_process.get("suggested_button_label"):
-                            print(f"Sugestia interakcji (etykieta przycisku): {result_process['suggested_button_label']}")
-                            print(f"Sugerowana odpowiedź tekstowa: {result_process.get('suggested_interaction_input')}")
-                    else: # success, ale brak polecenia/odpowiedzi
-                        print(f"Błąd: AI zwróciło sukces, ale bez polecenia/odpowiedzi.")
-                else: # not success
-                    if result_process.get("error") == "CLARIFY_REQUEST": print(f"{Fore.YELLOW}AI prosi o doprecyzowanie.{Style.RESET_ALL}")
-                    elif result_process.get("error") == "DANGEROUS_REQUEST": print(f"{Fore.RED}AI zidentyfikowało zapytanie jako niebezpieczne.{Style.RESET_ALL}")
-                    else: print(f"Błąd: {result_process.get('error')}")
+                _print_query_result_cli(result_process)
     else: # Tryb interaktywny CLI (jeśli nie podano --query)
         assistant.interactive_mode()
 
@@ -0,0 +1,73 @@
+# Plik: src/modules/backend_protocol.py
+
+import os
+import json
+import socket
+import tempfile
+from typing import Dict, Any, Optional, Callable
+
+# Protokół backendu: jeden obiekt JSON na linię (UTF-8, zakończony '\n').
+# Żądanie: {"id": ..., "op": "query"|"execute"|"interactive"|"pty"|"analyze"|"fix"|"history"|"validate"|"ping"|"cancel"|"shutdown", ...}
+# Odpowiedź: {"id": ..., "op": ..., "result": {...}} albo {"id": ..., "error": "..."}
+# Zdarzenie (przed odpowiedzią, dla "execute" z "stream": true): {"id": ..., "op": ..., "event": "output", "stream": "stdout"|"stderr", "data": "..."}
+# "interactive" ({"command", "rows", "cols"}) odpowiada od razu {"session": ...}; zdarzenia sesji przychodzą także po odpowiedzi:
+# {"event": "screen", "rows", "cols", "lines": [[wiersz, tekst], ...], "cursor": [wiersz, kolumna], ...} ze zmienionymi
+# wierszami ekranu i na końcu {"event": "exit", "result": {...jak dla "execute"}}. Klawisze, rozmiar i zamknięcie:
+# {"op": "pty", "session": ..., "data": "...", "rows": ..., "cols": ..., "close": true}.
+# "validate" ({"commands": [...]}) zwraca {"verdicts": [{"safe", "dangerous_rules", "confirmation_rules", "warning_rules"}, ...]} bez wykonywania.
+# "cancel" przerywa wykonywane właśnie polecenie (SIGTERM, potem SIGKILL do jego procesów); odpowiedź {"cancelled": bool}
+# przychodzi od razu, a przerwane "execute" kończy się odpowiedzią z "cancelled": true. Sesja backendu działa dalej.
+
+SOCKET_DIR_NAME = "linux_ai_assistant"
+SOCKET_FILE_NAME = "backend.sock"
+EVENT_OUTPUT = "output"
+EVENT_SCREEN = "screen"
+EVENT_EXIT = "exit" # Ostatnie zdarzenie sesji "interactive"
+
+
+def default_socket_path() -> str:
+    # Gniazdo per użytkownik: $XDG_RUNTIME_DIR jest prywatny (0700) i czyszczony po wylogowaniu
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, SOCKET_DIR_NAME, SOCKET_FILE_NAME)
+    return os.path.join(tempfile.gettempdir(), f"{SOCKET_DIR_NAME}-{os.getuid()}", SOCKET_FILE_NAME)
+
+
+def output_event(stream_name: str, data: str, request_id: Any = None, op: Optional[str] = None) -> Dict[str, Any]:
+    event: Dict[str, Any] = {"event": EVENT_OUTPUT, "stream": stream_name, "data": data}
+    return {"id": request_id, "op": op, **event} if request_id is not None else event
+
+
+def screen_event(update: Dict[str, Any], request_id: Any, op: Optional[str] = None) -> Dict[str, Any]:
+    return {"id": request_id, "op": op, "event": EVENT_SCREEN, **update}
+
+
+def exit_event(result: Dict[str, Any], request_id: Any, op: Optional[str] = None) -> Dict[str, Any]:
+    return {"id": request_id, "op": op, "event": EVENT_EXIT, "result": result}
+
+
+def encode_message(message: Dict[str, Any]) -> bytes:
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+
+def request_via_socket(request: Dict[str, Any], socket_path: Optional[str] = None,
+                       timeout: Optional[float] = None,
+                       on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    # Jednorazowe żądanie do działającego serwera (backend_cli.py --socket); zwraca odpowiedź o tym samym 'id'
+    path = socket_path or default_socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall(encode_message(request))
+        with client.makefile("r", encoding="utf-8") as reader:
+            for line in reader:
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                if message.get("id") != request.get("id"):
+                    continue
+                if "event" in message:
+                    if on_event: on_event(message)
+                    continue
+                return message
+    raise ConnectionError(f"Serwer backendu ({path}) zamknął połączenie bez odpowiedzi.")
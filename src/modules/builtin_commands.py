@@ -0,0 +1,124 @@
+# Plik: src/modules/builtin_commands.py
+
+import os
+import re
+import pwd
+import shlex
+import locale
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("builtin_commands")
+
+# Najczęstsze proste polecenia (cd, pwd, echo, whoami, ls) obsługiwane w procesie, bez uruchamiania powłoki.
+# Wynik ma być identyczny bajt w bajt z bash/coreutils; każdy nietypowy przypadek (nieznana flaga, błąd,
+# rozwinięcia powłoki) zwraca None i polecenie trafia do prawdziwego programu.
+
+# Jak SHELL_METACHARACTERS w command_executor, ale bez `~` - tylda na początku słowa jest rozwijana tutaj
+UNSUPPORTED_CHARACTERS = re.compile(r"[|&;<>()$`\\*?\[\]{}#!\n]")
+
+
+@dataclass
+class BuiltinResult:
+    stdout: bytes
+    stderr: bytes
+    return_code: int
+    working_dir: str # Katalog roboczy po poleceniu (zmienia go tylko `cd`)
+
+
+def _lines(items: List[str]) -> bytes:
+    return b"".join(os.fsencode(item) + b"\n" for item in items)
+
+
+def _pwd(args: List[str], working_dir: str) -> Optional[BuiltinResult]:
+    # Jak wbudowane `pwd` w bash: domyślnie ścieżka logiczna (-L), -P rozwija dowiązania
+    if args in ([], ["-L"]): return BuiltinResult(_lines([working_dir]), b"", 0, working_dir)
+    if args == ["-P"]: return BuiltinResult(_lines([os.path.realpath(working_dir)]), b"", 0, working_dir)
+    return None
+
+
+def _cd(args: List[str], working_dir: str) -> Optional[BuiltinResult]:
+    if os.environ.get("CDPATH") or len(args) > 1: return None
+    target = args[0] if args else os.environ.get("HOME")
+    if not target or target.startswith("-"): return None # `cd -` i opcje -L/-P zostawiamy powłoce
+    new_dir = os.path.normpath(os.path.join(working_dir, target)) # Ścieżka logiczna, jak `cd` w bash
+    if not os.path.isdir(new_dir) or not os.access(new_dir, os.X_OK): return None # Komunikat błędu zgłosi bash
+    return BuiltinResult(b"", b"", 0, new_dir)
+
+
+def _echo(args: List[str], working_dir: str) -> Optional[BuiltinResult]:
+    # Wbudowane `echo` w bash: opcje tylko na początku i tylko w postaci -[neE]+; -e (sekwencje \) zostawiamy powłoce
+    flags = ""
+    while args and re.fullmatch(r"-[neE]+", args[0]):
+        flags += args[0][1:]; args = args[1:]
+    if "e" in flags: return None
+    text = " ".join(args) + ("" if "n" in flags else "\n")
+    return BuiltinResult(os.fsencode(text), b"", 0, working_dir)
+
+
+def _whoami(args: List[str], working_dir: str) -> Optional[BuiltinResult]:
+    if args: return None
+    try: name = pwd.getpwuid(os.geteuid()).pw_name
+    except KeyError: return None
+    return BuiltinResult(_lines([name]), b"", 0, working_dir)
+
+
+def _collation_key() -> Optional[Callable[[str], object]]:
+    # `ls` sortuje według LC_COLLATE (strcoll); w C/POSIX to kolejność bajtów. locale.setlocale() zmienia stan całego
+    # procesu (w GUI współdzielony z Qt i innymi wątkami), więc tu tylko odczytujemy LC_COLLATE ustawione przy starcie
+    # (backend_cli.main(), QApplication w GUI) - jeśli jest inne niż oczekiwane przez środowisko, wykona się prawdziwe `ls`
+    wanted = os.environ.get("LC_ALL") or os.environ.get("LC_COLLATE") or os.environ.get("LANG") or "C"
+    if wanted in ("C", "POSIX") or wanted.startswith("C."):
+        return os.fsencode
+    try: current = locale.setlocale(locale.LC_COLLATE) # Bez drugiego argumentu - tylko odczyt
+    except locale.Error: return None
+    if locale.normalize(current) != locale.normalize(wanted):
+        logger.debug(f"Locale sortowania procesu '{current}' różne od '{wanted}' - `ls` wykona prawdziwy program.")
+        return None
+    return lambda name: (locale.strxfrm(name), os.fsencode(name))
+
+
+def _ls(args: List[str], working_dir: str) -> Optional[BuiltinResult]:
+    # Tylko `ls [-a|-A|-1] [KATALOG]` - wyjście do potoku to jedna nazwa na linię, bez cytowania
+    show, paths = "default", []
+    for arg in args:
+        if arg.startswith("-") and len(arg) > 1:
+            if arg == "--" or any(flag not in "aA1" for flag in arg[1:]): return None
+            for flag in arg[1:]:
+                if flag == "a": show = "all"
+                elif flag == "A": show = "almost-all"
+        else:
+            paths.append(arg)
+    if len(paths) > 1: return None
+    target = os.path.join(working_dir, paths[0]) if paths else working_dir
+    if not os.path.isdir(target): return None # Pliki i nieistniejące ścieżki obsługuje prawdziwe `ls`
+    sort_key = _collation_key()
+    if sort_key is None: return None
+    try:
+        with os.scandir(target) as entries:
+            names = [entry.name for entry in entries]
+        if show == "all": names += [".", ".."]
+        elif show == "default": names = [name for name in names if not name.startswith(".")]
+        names.sort(key=sort_key)
+    except (OSError, ValueError):
+        return None
+    return BuiltinResult(_lines(names), b"", 0, working_dir)
+
+
+BUILTINS: Dict[str, Callable[[List[str], str], Optional[BuiltinResult]]] = {
+    "pwd": _pwd, "cd": _cd, "echo": _echo, "whoami": _whoami, "ls": _ls,
+}
+# Zmieniają stan powłoki (PWD, OLDPWD) - przy trwałej powłoce musi je wykonać ona sama, inaczej `cd -` się rozjedzie
+SHELL_STATE_BUILTINS = frozenset(["cd"])
+
+
+def run_builtin(command: str, working_dir: str, excluded: Iterable[str] = ()) -> Optional[BuiltinResult]:
+    if not command.strip() or UNSUPPORTED_CHARACTERS.search(command): return None
+    if "~" in command and ("'" in command or '"' in command): return None # Nie wiadomo, czy tylda była w cudzysłowie
+    try: argv = shlex.split(command)
+    except ValueError: return None
+    handler = BUILTINS.get(argv[0]) if argv and argv[0] not in excluded else None
+    if handler is None: return None
+    args = [os.path.expanduser(arg) if arg.startswith("~") else arg for arg in argv[1:]]
+    return handler(args, working_dir)
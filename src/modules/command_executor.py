@@ -3,14 +3,51 @@
 import os
 import subprocess
 import shlex
+import shutil
 import logging
 import re
-# import signal # Nie jest aktywnie używany, można usunąć, jeśli nie ma planów implementacji kill_process
-from typing import Dict, List, Tuple, Optional, Any # Union nie jest tu potrzebny
+import json
+import codecs
+import select
+import selectors
+import mmap
+import tempfile
+import hashlib
+import asyncio
+import weakref
+import threading
+import functools
+import concurrent.futures
+from collections import deque
+import signal
+from typing import Dict, List, Set, Tuple, Optional, Any, Callable, Iterator, Iterable # Union nie jest tu potrzebny
 from dataclasses import dataclass
 import time
 import sys # Nie jest bezpośrednio używany w tej klasie, ale może być w bloku __main__
 
+try:
+    from .persistent_shell import PersistentShell
+    from .builtin_commands import run_builtin, BuiltinResult, SHELL_STATE_BUILTINS
+    from .resource_limits import ResourceLimits
+    from .process_control import (TimeoutEscalation, TERMINATION_GRACE_PERIOD, signal_process_group, track_process_group,
+                                  reap_orphans)
+    from .execution_history import ExecutionHistory, HistoryRecord
+    from .pty_session import PtySession, DEFAULT_ROWS as DEFAULT_PTY_ROWS, DEFAULT_COLS as DEFAULT_PTY_COLS, TERM_NAME as PTY_TERM_NAME
+    from .shell_syntax import ShellSyntaxError, parse as parse_shell, command_text
+    from .security_rules import (SecurityRule, RuleEngine, ValidationReport, RulePackError, DEFAULT_RULES_FILE,
+                                 RELOAD_CHECK_INTERVAL, builtin_rules, apply_rule_pack, load_rule_pack, rules_file_signature)
+except ImportError: # Import płaski (backend_cli.py dodaje src/modules do sys.path)
+    from persistent_shell import PersistentShell
+    from builtin_commands import run_builtin, BuiltinResult, SHELL_STATE_BUILTINS
+    from resource_limits import ResourceLimits
+    from process_control import (TimeoutEscalation, TERMINATION_GRACE_PERIOD, signal_process_group, track_process_group,
+                                 reap_orphans)
+    from execution_history import ExecutionHistory, HistoryRecord
+    from pty_session import PtySession, DEFAULT_ROWS as DEFAULT_PTY_ROWS, DEFAULT_COLS as DEFAULT_PTY_COLS, TERM_NAME as PTY_TERM_NAME
+    from shell_syntax import ShellSyntaxError, parse as parse_shell, command_text
+    from security_rules import (SecurityRule, RuleEngine, ValidationReport, RulePackError, DEFAULT_RULES_FILE,
+                                RELOAD_CHECK_INTERVAL, builtin_rules, apply_rule_pack, load_rule_pack, rules_file_signature)
+
 # Logger będzie używał konfiguracji z modułu nadrzędnego (np. backend_cli.py)
 logger = logging.getLogger("command_executor")
 
@@ -23,10 +60,45 @@ class CommandResult:
     command: str # Oryginalne polecenie, jakie otrzymał executor
     execution_time: float
     working_dir: str# Katalog, który JEST bieżącym katalogiem roboczym PO wykonaniu polecenia
+    # Przy dużym wyjściu stdout/stderr zawierają tylko początek i koniec; całość jest w pliku *_spill_path
+    stdout_total_bytes: int = 0
+    stderr_total_bytes: int = 0
+    stdout_spill_path: Optional[str] = None
+    stderr_spill_path: Optional[str] = None
+    # Skrót BLAKE2b (128 bitów) pełnego wyjścia - także przy obcięciu w pamięci; None dla pustego strumienia
+    stdout_digest: Optional[str] = None
+    stderr_digest: Optional[str] = None
+    # Zużycie zasobów przez proces polecenia (os.wait4/rusage); None, gdy nie da się go zmierzyć (np. polecenie wbudowane)
+    cpu_user_time: Optional[float] = None
+    cpu_system_time: Optional[float] = None
+    max_rss_kb: Optional[int] = None
+    block_input_ops: Optional[int] = None
+    block_output_ops: Optional[int] = None
+    voluntary_context_switches: Optional[int] = None
+    involuntary_context_switches: Optional[int] = None
+    limits_exceeded: Tuple[str, ...] = () # Limity (ResourceLimits), które zakończyły polecenie: "memory", "cpu", "processes"
+    timed_out: bool = False # Przekroczony limit czasu - stdout/stderr zawierają wyjście zebrane do przerwania polecenia
+    cancelled: bool = False # Przerwane przez CommandExecutor.cancel() (operacja 'cancel', przycisk Stop w GUI)
+
+RESOURCE_USAGE_FIELDS = ("cpu_user_time", "cpu_system_time", "max_rss_kb", "block_input_ops", "block_output_ops",
+                         "voluntary_context_switches", "involuntary_context_switches")
+
+@dataclass
+class CommandStep:
+    # Krok dla execute_many(): uruchamiany po udanym zakończeniu kroków o indeksach z depends_on,
+    # w katalogu roboczym, w którym skończył się ostatni z nich
+    command: str
+    depends_on: Tuple[int, ...] = ()
+
+
+VERDICT_CACHE_SIZE = 4096 # Werdykty SecurityValidator.analyze() zapamiętane dla ostatnich poleceń (LRU)
+PARALLEL_VALIDATION_MIN_BATCH = 5000 # validate_many(): mniejsze partie są szybsze w bieżącym procesie niż start puli
+VALIDATION_CHUNK_SIZE = 1000 # Polecenia na jedno zadanie puli procesów
 
-# SecurityValidator i DistributionDetector pozostają bez zmian z poprzedniej wersji
 
 class SecurityValidator:
+    # Wbudowane reguły; pakiet reguł użytkownika (rules_path, zob. security_rules.py) może je zastąpić, wyłączyć
+    # albo uzupełnić, także osobno dla dystrybucji
     DANGEROUS_PATTERNS = [
         r"rm\s+(-[rfRPorfL]+\s+)?(\/|\~|\.\.)",
         r">\s*(\/etc\/passwd|\/etc\/shadow)",
@@ -40,179 +112,774 @@ class SecurityValidator:
         r"mkfs", r"fdisk", r"parted", r"dd", r"shred", r"useradd", r"usermod", r"userdel",
         r"groupadd", r"groupmod", r"groupdel", r"chown", r"chgrp"
     ]
+    rules_path: Optional[str] = DEFAULT_RULES_FILE # None - tylko reguły wbudowane
+    distribution_ids: Tuple[str, ...] = () # ID i ID_LIKE z /etc/os-release - wybór sekcji "distributions" pakietu reguł
+
+    _engine: Optional[RuleEngine] = None
+    _engine_key: Optional[Tuple[Any, ...]] = None
+    _builtin_lists: Optional[Tuple[List[str], List[str]]] = None
+    _next_reload_check = 0.0
+    _reload_lock = threading.Lock()
+
+    @classmethod
+    def set_distribution(cls, distribution: Dict[str, str]):
+        # distribution - wynik DistributionDetector.detect_distribution()
+        ids = [distribution.get("ID", "")] + distribution.get("ID_LIKE", "").split()
+        cls.distribution_ids = tuple(distribution_id.lower() for distribution_id in ids if distribution_id)
+
+    @classmethod
+    def rule_engine(cls) -> RuleEngine:
+        # Bieżące reguły. Plik pakietu jest sprawdzany (mtime) co RELOAD_CHECK_INTERVAL sekund, a po zmianie całość
+        # kompilowana od nowa i podmieniana jednym przypisaniem - długo działający backend nie wymaga restartu.
+        # Błędny plik: ostrzeżenie i dotychczasowe reguły.
+        engine, key = cls._engine, cls._engine_key
+        if engine is not None and time.monotonic() < cls._next_reload_check and key[1] == cls.rules_path and \
+           key[3] == cls.distribution_ids and cls._builtin_lists == (cls.DANGEROUS_PATTERNS, cls.CONFIRMATION_REQUIRED):
+            return engine
+        with cls._reload_lock:
+            builtin_lists = (list(cls.DANGEROUS_PATTERNS), list(cls.CONFIRMATION_REQUIRED)) # Kopie - wykrycie zmian list w miejscu
+            key = (builtin_lists, cls.rules_path, rules_file_signature(cls.rules_path), cls.distribution_ids)
+            if cls._engine is None or key != cls._engine_key:
+                try:
+                    pack = load_rule_pack(cls.rules_path) if cls.rules_path else None
+                    rules = builtin_rules(*builtin_lists)
+                    if pack is not None: rules = apply_rule_pack(rules, pack, cls.distribution_ids)
+                    engine = RuleEngine(rules) # Scalone wyrażenie może nie skompilować się mimo poprawnych wzorców osobno
+                except (RulePackError, re.error) as e:
+                    logger.warning(f"{e} - pakiet reguł pominięty.")
+                    if cls._engine is not None and cls._builtin_lists == builtin_lists: engine = cls._engine
+                    else: engine = RuleEngine(builtin_rules(*builtin_lists))
+                else:
+                    if pack is not None: logger.info(f"Wczytano pakiet reguł bezpieczeństwa {cls.rules_path} ({len(rules)} reguł).")
+                cls._engine, cls._engine_key, cls._builtin_lists = engine, key, builtin_lists
+                cls._cached_analysis.cache_clear() # Werdykty dla poprzednich reguł są nieaktualne
+            cls._next_reload_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+            return cls._engine
+
+    @classmethod
+    def scan(cls, command: str) -> ValidationReport:
+        # Jedno przejście przez surowy tekst polecenia raportuje wszystkie pasujące reguły, także nakładające się
+        return cls.rule_engine().scan(command)
+
+    @classmethod
+    def analyze(cls, command: str) -> ValidationReport:
+        # Reguły "block" pasują w dowolnym miejscu surowego tekstu i tekstu po analizie składni powłoki: bez cudzysłowów
+        # i ukośników (r''m -rf "/"), z dopisaną treścią $(...), `...`, bash -c '...', ssh host '...' oraz skryptów
+        # podanych powłoce lub at na wejście (echo '...' | sh, bash <<< '...', heredoc). Reguły "confirm" i "warn" pomijają
+        # argumenty w cudzysłowie programów, dla których są tylko danymi, np. `echo "uruchom sudo"`. Werdykty w LRU
+        # według polecenia bez skrajnych białych znaków i zestawu reguł.
+        return cls._cached_analysis(command.strip(), cls.rule_engine())
+
+    @staticmethod
+    @functools.lru_cache(maxsize=VERDICT_CACHE_SIZE)
+    def _cached_analysis(command: str, engine: RuleEngine) -> ValidationReport:
+        return analyze_with_engine(command, engine)
+
+    @classmethod
+    def validate_many(cls, commands: Iterable[str], processes: int = 1) -> List[ValidationReport]:
+        # Werdykty w kolejności poleceń (np. cała historia powłoki albo wszystkie kroki planu AI). Powtórzenia są
+        # analizowane raz i nie trafiają do pamięci werdyktów analyze(). processes > 1 (0 - liczba procesorów)
+        # rozdziela partie od PARALLEL_VALIDATION_MIN_BATCH unikalnych poleceń na pulę procesów.
+        normalized = [command.strip() for command in commands]
+        unique = list(dict.fromkeys(normalized))
+        engine = cls.rule_engine()
+        workers = processes or os.cpu_count() or 1
+        if workers > 1 and len(unique) >= PARALLEL_VALIDATION_MIN_BATCH: reports = cls._validate_in_pool(unique, engine, workers)
+        else: reports = [analyze_with_engine(command, engine) for command in unique]
+        verdicts = dict(zip(unique, reports))
+        return [verdicts[command] for command in normalized]
+
+    @staticmethod
+    def _validate_in_pool(commands: List[str], engine: RuleEngine, workers: int) -> List[ValidationReport]:
+        # Reguły przekazywane jawnie - procesy puli kompilują je raz, w inicjalizatorze
+        chunks = [commands[start:start + VALIDATION_CHUNK_SIZE] for start in range(0, len(commands), VALIDATION_CHUNK_SIZE)]
+        try:
+            with concurrent.futures.ProcessPoolExecutor(min(workers, len(chunks)), initializer=_init_validation_worker,
+                                                        initargs=(engine.rules,)) as pool:
+                return [report for reports in pool.map(_validate_chunk, chunks) for report in reports]
+        except (OSError, concurrent.futures.process.BrokenProcessPool) as e:
+            logger.warning(f"Pula procesów walidacji niedostępna ({e}) - walidacja w bieżącym procesie.")
+            return [analyze_with_engine(command, engine) for command in commands]
 
     @classmethod
     def is_dangerous(cls, command: str) -> bool:
-        for pattern in cls.DANGEROUS_PATTERNS:
-            if re.search(pattern, command):
-                logger.warning(f"Dangerous pattern '{pattern}' matched for command: '{command}'")
-                return True
-        return False
+        return bool(cls.analyze(command).dangerous_rules)
 
     @classmethod
     def requires_confirmation(cls, command: str) -> bool:
-        for pattern in cls.CONFIRMATION_REQUIRED:
-            if re.search(pattern, command):
-                return True
-        return False
+        return bool(cls.analyze(command).confirmation_rules)
 
     @classmethod
     def validate(cls, command: str) -> Tuple[bool, str]:
-        if cls.is_dangerous(command):
+        report = cls.analyze(command)
+        if report.warning_rules: logger.info(f"Rules {report.warning_rules} (warn) matched for command: '{command}'")
+        if report.dangerous_rules:
+            logger.warning(f"Dangerous pattern '{report.dangerous_rules[0]}' matched for command: '{command}'")
             return False, f"Polecenie '{command}' zostało zidentyfikowane jako potencjalnie niebezpieczne i zablokowane."
         # Walidacja potwierdzenia jest teraz logiką interfejsu użytkownika, a nie CommandExecutor.
         return True, ""
 
+
+def analyze_with_engine(command: str, engine: RuleEngine) -> ValidationReport:
+    try:
+        text, data_spans = command_text(parse_shell(command))
+    except (ShellSyntaxError, RecursionError) as e: # Składnia spoza parsera (np. case ... esac) albo setki zagnieżdżonych $( - skan całego tekstu
+        logger.debug(f"Walidacja bez analizy składni polecenia '{command}': {e}")
+        return engine.scan(command)
+    return engine.scan_command(command, text, data_spans)
+
+
+_worker_engine: Optional[RuleEngine] = None # Reguły w procesie puli validate_many()
+
+
+def _init_validation_worker(rules: Tuple[SecurityRule, ...]):
+    global _worker_engine
+    _worker_engine = RuleEngine(rules)
+
+
+def _validate_chunk(commands: List[str]) -> List[ValidationReport]:
+    return [analyze_with_engine(command, _worker_engine) for command in commands]
+
+
+DISTRIBUTION_CACHE_FILE = os.path.expanduser("~/.cache/linux_ai_assistant/distribution.json")
+# Klucze /etc/lsb-release -> nazwy pól z dawnego `lsb_release -a` (LSB_Distributor_ID itd.)
+LSB_RELEASE_KEYS = {"DISTRIB_ID": "LSB_Distributor_ID", "DISTRIB_DESCRIPTION": "LSB_Description",
+                    "DISTRIB_RELEASE": "LSB_Release", "DISTRIB_CODENAME": "LSB_Codename"}
+# Bez /etc/lsb-release lsb_release wyprowadza te same pola z os-release
+OS_RELEASE_LSB_KEYS = {"NAME": "LSB_Distributor_ID", "PRETTY_NAME": "LSB_Description",
+                       "VERSION_ID": "LSB_Release", "VERSION_CODENAME": "LSB_Codename"}
+
+
+def parse_release_file(path: str) -> Dict[str, str]:
+    # Pliki os-release/lsb-release: KLUCZ=wartość w składni przypisań powłoki (cudzysłowy, \-sekwencje, komentarze)
+    result: Dict[str, str] = {}
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line: continue
+            key, value = line.split("=", 1)
+            try: value = "".join(shlex.split(value))
+            except ValueError: value = value.strip().strip("\"'")
+            result[key.strip()] = value
+    return result
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    try: stat_result = os.stat(path) # Przez dowiązanie (/etc/os-release -> ../usr/lib/os-release)
+    except OSError: return None
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
 class DistributionDetector:
+    # Wykrywanie bez procesów potomnych: pliki os-release/lsb-release, os.uname() i shutil.which(). Wynik trafia
+    # do cache_path z kluczem (sygnatury plików, wersja jądra, PATH) - kolejne starty backendu tylko go wczytują.
+    OS_RELEASE_FILES = ("/etc/os-release", "/usr/lib/os-release") # Drugi - zapasowy według os-release(5)
+    LSB_RELEASE_FILE = "/etc/lsb-release"
+    PACKAGE_MANAGERS = ("apt", "dnf", "yum", "pacman", "zypper") # Kolejność = pierwszeństwo
+    cache_path: Optional[str] = DISTRIBUTION_CACHE_FILE # None - bez pamięci podręcznej
+
     @staticmethod
     def detect_distribution() -> Dict[str, str]:
+        cls = DistributionDetector
+        key = cls._cache_key()
+        cached = cls._load_cache(key)
+        if cached is not None: return cached
         result: Dict[str, str] = {}
-        # Użyj osobnej, tymczasowej instancji CommandExecutor do wykrywania, aby nie wpływać na stan.
-        # Dajemy krótki timeout, bo te polecenia powinny być szybkie.
+        for path in cls.OS_RELEASE_FILES:
+            try: result.update(parse_release_file(path))
+            except FileNotFoundError: continue
+            except OSError as e: logger.error(f"Błąd przy odczycie {path} w DistributionDetector: {e}")
+            break
+        try: lsb_fields = {LSB_RELEASE_KEYS[k]: v for k, v in parse_release_file(cls.LSB_RELEASE_FILE).items() if k in LSB_RELEASE_KEYS}
+        except OSError: # Jak dawniej przy braku lsb_release - pola LSB_* tylko wtedy, gdy jest co pokazać
+            lsb_fields = {lsb_key: result[key] for key, lsb_key in OS_RELEASE_LSB_KEYS.items() if result.get(key)}
+        result.update(lsb_fields)
+        result["KERNEL"] = os.uname().release
+        for pm_name in cls.PACKAGE_MANAGERS:
+            if shutil.which(pm_name):
+                result["PACKAGE_MANAGER"] = pm_name
+                break
+        cls._store_cache(key, result)
+        return result
+
+    @classmethod
+    def _cache_key(cls) -> List[Any]:
+        # Lista (a nie krotka), aby porównanie z kluczem wczytanym z JSON działało bez konwersji
+        return [[path, file_signature(path)] for path in cls.OS_RELEASE_FILES + (cls.LSB_RELEASE_FILE,)] + \
+               [os.uname().release, os.environ.get("PATH", os.defpath)]
+
+    @classmethod
+    def _load_cache(cls, key: List[Any]) -> Optional[Dict[str, str]]:
+        if not cls.cache_path: return None
         try:
-            temp_executor_os = CommandExecutor(timeout=5)
-            os_release_cmd_res = temp_executor_os.execute("cat /etc/os-release")
-            if os_release_cmd_res.success:
-                for line in os_release_cmd_res.stdout.splitlines():
-                    if "=" in line:
-                        key, value = line.split("=", 1)
-                        result[key.strip()] = value.strip().strip('"')
-        except Exception as e:
-            logger.error(f"Błąd przy odczycie /etc/os-release w DistributionDetector: {e}")
+            with open(cls.cache_path, "r", encoding="utf-8") as f: cached = json.load(f)
+        except (OSError, ValueError): return None
+        if not isinstance(cached, dict) or json.loads(json.dumps(key)) != cached.get("key"): return None
+        distribution = cached.get("distribution")
+        return distribution if isinstance(distribution, dict) else None
 
+    @classmethod
+    def _store_cache(cls, key: List[Any], distribution: Dict[str, str]):
+        if not cls.cache_path: return
+        temp_path = f"{cls.cache_path}.{os.getpid()}.tmp"
+        try: # Zapis atomowy (os.replace) - równoległe starty backendu nie widzą połowy pliku
+            os.makedirs(os.path.dirname(cls.cache_path), exist_ok=True)
+            with open(temp_path, "w", encoding="utf-8") as f: json.dump({"key": key, "distribution": distribution}, f)
+            os.replace(temp_path, cls.cache_path)
+        except OSError as e:
+            logger.debug(f"Nie można zapisać informacji o dystrybucji do {cls.cache_path}: {e}")
+
+
+# Znaki, przy których polecenie wymaga powłoki: potoki, przekierowania, globy, rozwinięcia, podstawienia, komentarze
+SHELL_METACHARACTERS = re.compile(r"[|&;<>()$`\\*?\[\]{}~#!\n]")
+# Słowa, których nie da się uruchomić jako osobny program (wbudowane polecenia i słowa kluczowe bash)
+SHELL_ONLY_WORDS = frozenset([
+    "cd", "export", "source", ".", "alias", "unalias", "exit", "exec", "set", "unset", "eval", "history", "jobs",
+    "fg", "bg", "wait", "read", "ulimit", "umask", "type", "hash", "command", "builtin", "declare", "local",
+    "readonly", "shopt", "trap", "time", "pushd", "popd", "dirs", "let", "logout", "return", "shift", "times",
+    "enable", "help", "caller", "compgen", "complete", "disown", "getopts", "mapfile", "readarray", "suspend",
+    "typeset", "coproc", "if", "then", "else", "elif", "fi", "for", "while", "until", "do", "done", "case",
+    "esac", "function", "select", "[[", "]]",
+])
+
+
+def resolve_plain_argv(command: str, working_dir: str) -> Optional[Tuple[str, List[str]]]:
+    # Zwraca (ścieżka_programu, argv), jeśli polecenie da się uruchomić bez powłoki; w przeciwnym razie None
+    if not command.strip() or SHELL_METACHARACTERS.search(command): return None
+    try: argv = shlex.split(command)
+    except ValueError: return None
+    if not argv or argv[0] in SHELL_ONLY_WORDS or "=" in argv[0]: return None
+    if "/" in argv[0]:
+        program = os.path.join(working_dir, argv[0])
+        if not (os.path.isfile(program) and os.access(program, os.X_OK)): return None
+    else:
+        program = shutil.which(argv[0])
+        if not program: return None # Brak programu - niech bash zgłosi "command not found" ze zwykłym kodem 127
+    return program, argv
+
+
+def cwd_trap_script(command: str, cwd_write_fd: int) -> str:
+    # Pułapka EXIT zapisuje końcowy $PWD do osobnego potoku - jedno wykonanie zamiast ponownego `(polecenie) && pwd`.
+    return f"trap 'printf %s \"$PWD\" >&{cwd_write_fd}' EXIT\n{command}"
+
+
+def shell_argv(script: str) -> Tuple[str, List[str]]:
+    # Jak Popen(script, shell=True, executable="/bin/bash"), ale jako jawne argv (do opakowania przez systemd-run);
+    # argv[0] to /bin/bash, bo bash wywołany jako "sh" przechodzi w tryb POSIX
+    return "/bin/bash", ["/bin/bash", "-c", script]
+
+
+def read_reported_cwd(cwd_read_fd: Optional[int], effective_cwd: str) -> Optional[str]:
+    if cwd_read_fd is None: return effective_cwd # Szybka ścieżka argv nie zmienia katalogu roboczego
+    # Pułapka pisze przed zakończeniem powłoki; odczyt nieblokujący, bo potomkowie w tle mogą trzymać potok otwarty
+    os.set_blocking(cwd_read_fd, False)
+    try: return os.read(cwd_read_fd, 65536).decode("utf-8", errors="replace") or None
+    except BlockingIOError: return None
+
+
+def rusage_fields(rusage) -> Dict[str, Any]:
+    # ru_maxrss w Linuksie jest w KB; ru_inblock/ru_oublock to operacje blokowe (jednostki 512 B)
+    return {"cpu_user_time": rusage.ru_utime, "cpu_system_time": rusage.ru_stime, "max_rss_kb": rusage.ru_maxrss,
+            "block_input_ops": rusage.ru_inblock, "block_output_ops": rusage.ru_oublock,
+            "voluntary_context_switches": rusage.ru_nvcsw, "involuntary_context_switches": rusage.ru_nivcsw}
+
+
+def wait_with_rusage(process: subprocess.Popen, timeout: Optional[float] = None) -> Dict[str, Any]:
+    # Jak Popen.wait(), ale proces zbiera os.wait4 - jądro zwraca przy tym rusage procesu i jego zebranych potomków.
+    # Oczekiwanie przez pidfd (Linux 5.3+), bez pidfd - krótkie odpytywanie.
+    deadline = None if timeout is None else time.time() + timeout
+    try: pidfd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError): pidfd = None
+    try:
+        while True:
+            try: pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            except ChildProcessError: # Proces został już zebrany gdzie indziej - bez rusage
+                process.wait(); return {}
+            if pid: break
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0: raise subprocess.TimeoutExpired(process.args, timeout)
+            if pidfd is not None: select.select([pidfd], [], [], remaining)
+            else: time.sleep(0.005 if remaining is None else min(0.005, remaining))
+    finally:
+        if pidfd is not None: os.close(pidfd)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return rusage_fields(rusage)
+
+
+class OutputCapture:
+    # Przechwytywanie wyjścia ze stałym zużyciem pamięci: w pamięci zostaje pierwsze `head_limit` i ostatnie `tail_limit` bajtów.
+    # Po przekroczeniu limitu całe wyjście trafia do pliku tymczasowego (spill), który można potem stronicować przez mmap.
+    TRUNCATION_MARKER = "\n[... pominięto {skipped} bajtów, pełne wyjście: {path} ...]\n"
+
+    def __init__(self, head_limit: int, tail_limit: int, spill_dir: Optional[str] = None, spill_prefix: str = "laa_output_",
+                 on_spill: Optional[Callable[[str], None]] = None):
+        self.head_limit = head_limit
+        self.tail_limit = tail_limit
+        self.spill_dir = spill_dir
+        self.spill_prefix = spill_prefix
+        self.on_spill = on_spill
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+        self.spill_path: Optional[str] = None
+        self._spill_file = None
+        self._hash = hashlib.blake2b(digest_size=16)
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_bytes > len(self.head) + len(self.tail)
+
+    @property
+    def digest(self) -> Optional[str]:
+        return self._hash.hexdigest() if self.total_bytes else None
+
+    def write(self, data: bytes):
+        self.total_bytes += len(data)
+        self._hash.update(data)
+        if self._spill_file is None and len(self.head) + len(data) <= self.head_limit:
+            self.head.extend(data); return
+        if self._spill_file is None:
+            self._spill_file = tempfile.NamedTemporaryFile(prefix=self.spill_prefix, suffix=".log", dir=self.spill_dir, delete=False)
+            self.spill_path = self._spill_file.name
+            if self.on_spill: self.on_spill(self.spill_path)
+            self._spill_file.write(self.head)
+            head_room = self.head_limit - len(self.head)
+            self.head.extend(data[:head_room])
+            self._spill_file.write(data[:head_room])
+            data = data[head_room:]
+        self._spill_file.write(data)
+        self.tail.extend(data[-self.tail_limit:] if self.tail_limit else b"")
+        if len(self.tail) > self.tail_limit: del self.tail[:len(self.tail) - self.tail_limit]
+
+    def close(self):
+        if self._spill_file is not None:
+            self._spill_file.close(); self._spill_file = None
+
+    def text(self) -> str:
+        if not self.truncated:
+            return (bytes(self.head) + bytes(self.tail)).decode("utf-8", errors="replace")
+        skipped = self.total_bytes - len(self.head) - len(self.tail)
+        return (self.head.decode("utf-8", errors="replace")
+                + self.TRUNCATION_MARKER.format(skipped=skipped, path=self.spill_path)
+                + self.tail.decode("utf-8", errors="replace"))
+
+    @staticmethod
+    def open_spill(path: str) -> mmap.mmap:
+        # Mapowanie pliku z pełnym wyjściem tylko do odczytu - strony ładowane są leniwie przy dostępie do zakresu
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def read_spill_range(path: str, offset: int, length: int) -> str:
+        with OutputCapture.open_spill(path) as mapped:
+            return mapped[offset:offset + length].decode("utf-8", errors="replace")
+
+
+class StreamingExecution:
+    # Wykonanie polecenia z odczytem stdout/stderr na bieżąco (Popen + selektor zamiast capture_output).
+    # Iteracja zwraca krotki (nazwa_strumienia, tekst) w kolejności nadejścia; po jej zakończeniu `result` zawiera CommandResult.
+    READ_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, executor: "CommandExecutor", command: str, working_dir_override: Optional[str] = None):
+        self.executor = executor
+        self.command = command
+        self.effective_cwd = os.path.abspath(working_dir_override if working_dir_override else executor.current_working_dir)
+        self.process: Optional[subprocess.Popen] = None
+        self.result: Optional[CommandResult] = None
+        self._final_cwd: Optional[str] = None
+        self._resource_usage: Dict[str, Any] = {}
+        self._timed_out = self._cancelled = False
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        self.executor.logger.debug(f"Executing command='{self.command}' in effective_cwd='{self.effective_cwd}'")
+        is_safe, safety_message = SecurityValidator.validate(self.command)
+        if not is_safe:
+            self.result = CommandResult(False, "", safety_message, -1, self.command, 0.0, self.effective_cwd)
+            return
+
+        captures = {name: self.executor._new_output_capture() for name in ("stdout", "stderr")}
+        decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in ("stdout", "stderr")}
+        start_time, oom_kills_before = time.time(), self.executor._oom_kill_count()
+        excluded = SHELL_STATE_BUILTINS if self.executor.persistent_shell else () # `cd` w trwałej powłoce zachowuje OLDPWD
+        builtin = run_builtin(self.command, self.effective_cwd, excluded) if self.executor.inprocess_builtins else None
+        shell = self.executor.persistent_shell if builtin is None else None
+        if builtin: chunks = self._builtin_chunks(builtin)
+        elif shell: chunks = shell.run(self.command, self.effective_cwd, self.executor.timeout, self.executor.termination_grace_period)
+        else: chunks = self._run_subprocess()
         try:
-            temp_executor_lsb = CommandExecutor(timeout=5)
-            lsb_output_cmd_res = temp_executor_lsb.execute("lsb_release -a")
-            if lsb_output_cmd_res.success:
-                for line in lsb_output_cmd_res.stdout.splitlines():
-                    if ":" in line:
-                        key, value = line.split(":", 1)
-                        result[f"LSB_{key.strip().replace(' ', '_')}"] = value.strip()
-        except Exception:  # lsb_release może nie być zainstalowane
-            pass
+            for stream_name, data in chunks: # Pusty fragment = koniec strumienia
+                if data: captures[stream_name].write(data)
+                text = decoders[stream_name].decode(data, final=not data)
+                if text: yield stream_name, text
+        finally:
+            chunks.close() # Konsument przerwał iterację - generator źródła sprząta proces
+            for capture in captures.values(): capture.close()
+
+        if builtin: return_code, final_cwd = builtin.return_code, builtin.working_dir
+        elif shell:
+            return_code, final_cwd, self._resource_usage = shell.last_return_code, shell.last_working_dir, shell.last_resource_usage
+            self._timed_out, self._cancelled = shell.last_timed_out, shell.last_cancelled
+        else: return_code, final_cwd = self.process.returncode, self._final_cwd
+        self.result = self.executor._result_from_captures(self.command, return_code, captures, self.effective_cwd, final_cwd,
+                                                          time.time() - start_time, self._resource_usage, self._timed_out,
+                                                          self._cancelled, None if builtin else oom_kills_before)
+        if not builtin: reap_orphans()
 
+    @staticmethod
+    def _builtin_chunks(builtin: BuiltinResult) -> Iterator[Tuple[str, bytes]]:
+        # Polecenie obsłużone w procesie (builtin_commands) - ten sam format fragmentów co dla procesu
+        for stream_name, data in (("stdout", builtin.stdout), ("stderr", builtin.stderr)):
+            if data: yield stream_name, data
+            yield stream_name, b""
+
+    def _spawn(self) -> Tuple[subprocess.Popen, Optional[int]]:
+        plain_argv = resolve_plain_argv(self.command, self.effective_cwd)
+        if plain_argv:
+            # Szybka ścieżka: proste polecenie bez metaznaków powłoki uruchamiane bezpośrednio (bez startu bash);
+            # nie może zmienić katalogu roboczego, więc nie potrzebuje potoku z $PWD
+            try:
+                program, argv, preexec_fn = self.executor._spawn_options(*plain_argv) # argv[0] jak w wpisanym poleceniu (tak przekazuje go bash)
+                return subprocess.Popen(argv, executable=program, cwd=self.effective_cwd, env=os.environ.copy(), start_new_session=True,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=preexec_fn), None
+            except OSError as e_spawn: # Np. brak uprawnień - niech bash zgłosi błąd tak jak zwykle
+                self.executor.logger.debug(f"Szybka ścieżka argv nie powiodła się dla '{self.command}': {e_spawn}")
+        cwd_read_fd, cwd_write_fd = os.pipe()
         try:
-            temp_executor_uname = CommandExecutor(timeout=5)
-            uname_cmd_res = temp_executor_uname.execute("uname -r") # -r dla samej wersji kernela
-            if uname_cmd_res.success:
-                result["KERNEL"] = uname_cmd_res.stdout.strip()
-        except Exception:
-            pass
-
-        package_managers = {"apt": "apt", "dnf": "dnf", "yum": "yum", "pacman": "pacman", "zypper": "zypper"}
-        temp_executor_pm = CommandExecutor(timeout=5)
-        for pm_name in package_managers.keys():
-            check_exists_cmd = f"command -v {pm_name}" # command -v jest bardziej POSIX-owe niż which
-            if temp_executor_pm.execute(check_exists_cmd).success:
-                result["PACKAGE_MANAGER"] = pm_name
-                break
-        return result
+            program, argv, preexec_fn = self.executor._spawn_options(*shell_argv(cwd_trap_script(self.command, cwd_write_fd)))
+            return subprocess.Popen(
+                argv, executable=program, cwd=self.effective_cwd, env=os.environ.copy(), start_new_session=True, # Własna grupa procesów
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, pass_fds=(cwd_write_fd,), preexec_fn=preexec_fn
+            ), cwd_read_fd
+        except BaseException:
+            os.close(cwd_read_fd); raise
+        finally:
+            os.close(cwd_write_fd)
+
+    def _run_subprocess(self) -> Iterator[Tuple[str, bytes]]:
+        # Osobny proces na polecenie (Popen + selektor zamiast capture_output). Po przekroczeniu czasu grupa procesów
+        # dostaje SIGTERM, potem SIGKILL, a wyjście zebrane do tego momentu trafia do wyniku (timed_out=True).
+        process, cwd_read_fd = self._spawn()
+        self.process = process
+        track_process_group(process.pid)
+        escalation = TimeoutEscalation(process.pid, self.executor.timeout, f"'{self.command}'", self.executor.termination_grace_period)
+        self.executor._escalations.add(escalation)
+        selector = selectors.DefaultSelector()
+        selector.register(process.stdout, selectors.EVENT_READ, "stdout")
+        selector.register(process.stderr, selectors.EVENT_READ, "stderr")
+        try:
+            while selector.get_map():
+                if escalation.remaining() == 0:
+                    if escalation.expire(): continue
+                    break # Proces spoza grupy trzyma potoki - kończymy bez EOF
+                for key, _ in selector.select(escalation.poll_timeout()):
+                    data = os.read(key.fd, self.READ_CHUNK_SIZE)
+                    if not data: selector.unregister(key.fileobj) # EOF - proces zamknął strumień
+                    yield key.data, data
+            for key in list(selector.get_map().values()): yield key.data, b""
+            while True:
+                try:
+                    self._resource_usage = wait_with_rusage(process, escalation.poll_timeout()); break
+                except subprocess.TimeoutExpired: # Proces zamknął potoki, ale nadal działa
+                    if escalation.remaining() == 0 and not escalation.expire(): break
+            self._final_cwd = read_reported_cwd(cwd_read_fd, self.effective_cwd)
+            self._timed_out, self._cancelled = escalation.timed_out, escalation.cancelled
+        finally:
+            self.executor._escalations.discard(escalation)
+            selector.close()
+            if cwd_read_fd is not None: os.close(cwd_read_fd)
+            if process.poll() is None: # Przerwana iteracja albo proces nie zakończył się nawet po SIGKILL
+                signal_process_group(process.pid, signal.SIGKILL); process.wait()
+            process.stdout.close(); process.stderr.close()
 
 
 class CommandExecutor:
-    def __init__(self, timeout: int = 120, max_output_size: int = 1024 * 1024):
+    SPILL_FILES_KEPT = 8 # Ile ostatnich plików z pełnym wyjściem zostawić na dysku
+    READ_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, timeout: int = 120, max_output_size: int = 1024 * 1024, persistent_shell: bool = False,
+                 inprocess_builtins: bool = True, max_concurrent_processes: int = 4,
+                 resource_limits: Optional[ResourceLimits] = None, execution_history: Optional[ExecutionHistory] = None):
         self.timeout = timeout
-        self.max_output_size = max_output_size
-        self.history: List[CommandResult] = []
+        self.resource_limits = resource_limits # Limity pamięci/CPU/procesów dla każdego polecenia (rlimity, opcjonalnie cgroup v2)
+        self.termination_grace_period = TERMINATION_GRACE_PERIOD # Czas między SIGTERM a SIGKILL po przekroczeniu timeout
+        self.max_concurrent_processes = max_concurrent_processes # Limit równoczesnych procesów potomnych w execute_async()
+        self._async_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+        self.inprocess_builtins = inprocess_builtins # cd/pwd/echo/whoami/ls bez nowego procesu (builtin_commands)
+        self.max_output_size = max_output_size # Łącznie początek + koniec wyjścia trzymane w pamięci (na strumień)
+        self._spill_paths: deque = deque()
+        # Każde wykonane polecenie trafia do pierścienia historii (opcjonalnie z plikiem, np. współdzielonym przez backend)
+        self.history = execution_history if execution_history is not None else ExecutionHistory()
+        self._interactive_sessions: Set[PtySession] = set() # Działające sesje execute_interactive() (zamykane w close())
+        self._escalations: Set[TimeoutEscalation] = set() # Polecenia w osobnych procesach, które przerywa cancel()
         self.current_working_dir = os.path.abspath(os.getcwd())
         self.logger = logging.getLogger("command_executor")
-        self.logger.info(f"CommandExecutor initialized. Initial CWD: {self.current_working_dir}")
-
-    def execute(self, command: str, working_dir_override: Optional[str] = None) -> CommandResult:
-        effective_initial_cwd = os.path.abspath(working_dir_override if working_dir_override else self.current_working_dir)
-        # self.logger.info(f"!!! TEST EXECUTE: command='{command}', effective_initial_cwd='{effective_initial_cwd}'")
-        self.logger.debug(f"Executing command='{command}' in effective_cwd='{effective_initial_cwd}'")
-
-
+        # Jedna powłoka bash na sesję zamiast nowego procesu na polecenie (uruchamiana leniwie przy pierwszym poleceniu)
+        # Limity trwałej powłoki dziedziczy każde uruchomione w niej polecenie (rlimity są per proces)
+        self.persistent_shell: Optional[PersistentShell] = PersistentShell(self.current_working_dir, resource_limits=resource_limits) if persistent_shell else None
+        self.logger.info(f"CommandExecutor initialized. Initial CWD: {self.current_working_dir}, persistent shell: {persistent_shell}")
+
+    def execute(self, command: str, working_dir_override: Optional[str] = None,
+                output_callback: Optional[Callable[[str, str], None]] = None) -> CommandResult:
+        # output_callback(nazwa_strumienia, tekst) dostaje fragmenty stdout/stderr na bieżąco, zanim proces się zakończy
+        execution = self.stream(command, working_dir_override)
+        for stream_name, text in execution:
+            if output_callback: output_callback(stream_name, text)
+        return execution.result
+
+    def stream(self, command: str, working_dir_override: Optional[str] = None) -> "StreamingExecution":
+        return StreamingExecution(self, command, working_dir_override)
+
+    async def execute_async(self, command: str, working_dir_override: Optional[str] = None,
+                            output_callback: Optional[Callable[[str, str], None]] = None) -> CommandResult:
+        # Wersja asyncio execute(): ta sama walidacja, polecenia wbudowane i śledzenie katalogu roboczego, ale każde polecenie
+        # to osobny proces (trwała powłoka wykonuje jedno polecenie naraz); liczbę procesów ogranicza max_concurrent_processes.
+        # Procesy zbiera pętla asyncio (waitpid), więc pola rusage w wyniku pozostają puste. Przekroczenie czasu jak w execute().
+        effective_cwd = os.path.abspath(working_dir_override if working_dir_override else self.current_working_dir)
+        self.logger.debug(f"Executing (async) command='{command}' in effective_cwd='{effective_cwd}'")
         is_safe, safety_message = SecurityValidator.validate(command)
         if not is_safe:
-            return CommandResult(False, "", safety_message, -1, command, 0.0, effective_initial_cwd)
-
-        start_time = time.time()
-
-        # Sanitize command if it's a complex cd for Popen to avoid shell errors with complex paths
-        # However, for subprocess.run with shell=True, direct command is usually fine.
-        # For cd, the special handling below is more important.
-
-        process = subprocess.run(
-            command, shell=True, cwd=effective_initial_cwd,
-            env=os.environ.copy(), capture_output=True, text=True,
-            timeout=self.timeout, check=False, executable='/bin/bash'
-        )
-        execution_time = time.time() - start_time
-        stdout = process.stdout[:self.max_output_size] if process.stdout else ""
-        stderr = process.stderr[:self.max_output_size] if process.stderr else ""
-        rc = process.returncode
-
-        new_cwd_for_executor = effective_initial_cwd
-        # Check if the command was 'cd' and if it succeeded
-        # Use regex to be more robust about "cd" and "cd "
-        if re.match(r"^\s*cd(\s+.*|$)", command.strip()) and rc == 0:
-            # If 'cd' was part of a compound command like 'cd /tmp && pwd',
-            # we need to determine the final CWD if the whole compound command succeeded.
-            # The most reliable way for compound commands is to ask the shell.
-            # For simple 'cd <dir>', our existing logic is fine.
-
-            is_simple_cd = "&&" not in command and "|" not in command and ";" not in command
-
-            if is_simple_cd:
-                parts = shlex.split(command.strip()) # shlex.split correctly handles "cd" and "cd /some/path"
-                target_dir_part = "~" # Default to home if just "cd"
-                if len(parts) > 1:
-                    target_dir_part = parts[1]
-
-                expanded_target = os.path.expanduser(target_dir_part)
-
-                # Determine absolute path: if target is absolute, use it; otherwise, join with CWD
-                if os.path.isabs(expanded_target):
-                    prospective_abs_path = expanded_target
-                else:
-                    prospective_abs_path = os.path.join(effective_initial_cwd, expanded_target)
+            return CommandResult(False, "", safety_message, -1, command, 0.0, effective_cwd)
 
-                # Normalize the path (e.g., resolve '..')
-                normalized_abs_path = os.path.normpath(prospective_abs_path)
+        captures = {name: self._new_output_capture() for name in ("stdout", "stderr")}
+        decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in ("stdout", "stderr")}
 
-                if os.path.isdir(normalized_abs_path):
-                    new_cwd_for_executor = normalized_abs_path
-                    self.current_working_dir = new_cwd_for_executor # Update executor's state
-                    # For simple 'cd', stdout might be empty. Provide a confirmation.
-                    if not stdout.strip(): # only if subprocess did not produce output
-                         stdout = f"Changed directory to {new_cwd_for_executor}"
-                else:
-                    # This case should ideally be caught by rc != 0, but as a fallback:
-                    self.logger.warning(f"'cd' command to '{target_dir_part}' resulted in non-directory path '{normalized_abs_path}' despite rc=0. CWD not changed by special 'cd' logic.")
-            else: # Compound command potentially involving 'cd'
-                # The most robust way to get the CWD after a compound command is to ask the shell
-                # by appending '; pwd' to the command IF it succeeded.
-                # We assume 'pwd' is available and safe.
-                # This is run in a new subprocess, so it doesn't affect the current one's Popen CWD.
-                if rc == 0: # Only if the compound command was successful
-                    try:
-                        pwd_check_process = subprocess.run(
-                            f"({command}) && pwd", # Group original command to ensure pwd runs in the same subshell context
-                            shell=True, cwd=effective_initial_cwd,
-                            capture_output=True, text=True, timeout=2, check=True, executable='/bin/bash'
-                        )
-                        final_cwd_from_pwd = pwd_check_process.stdout.strip()
-                        if os.path.isdir(final_cwd_from_pwd):
-                            new_cwd_for_executor = final_cwd_from_pwd
-                            self.current_working_dir = new_cwd_for_executor
-                            self.logger.info(f"Compound command with 'cd' succeeded. New CWD from 'pwd': {new_cwd_for_executor}")
-                        else:
-                            self.logger.warning(f"Compound command with 'cd' succeeded, but 'pwd' check yielded non-dir: {final_cwd_from_pwd}")
-                    except Exception as e_pwd:
-                        self.logger.error(f"Error trying to determine CWD after compound command '{command}': {e_pwd}")
-                        # Fallback to not changing CWD if pwd check fails
-                        new_cwd_for_executor = effective_initial_cwd
+        def consume(stream_name: str, data: bytes):
+            if data: captures[stream_name].write(data)
+            text = decoders[stream_name].decode(data, final=not data)
+            if text and output_callback: output_callback(stream_name, text)
+
+        start_time, oom_kills_before = time.time(), self._oom_kill_count()
+        timed_out = False
+        try:
+            builtin = run_builtin(command, effective_cwd) if self.inprocess_builtins else None
+            if builtin:
+                for stream_name, data in StreamingExecution._builtin_chunks(builtin): consume(stream_name, data)
+                return_code, final_cwd = builtin.return_code, builtin.working_dir
+            else:
+                async with self._async_semaphore():
+                    return_code, final_cwd, timed_out = await self._run_subprocess_async(command, effective_cwd, consume)
+                reap_orphans()
+        finally:
+            for capture in captures.values(): capture.close()
+        return self._result_from_captures(command, return_code, captures, effective_cwd, final_cwd, time.time() - start_time,
+                                          timed_out=timed_out, oom_kills_before=None if builtin else oom_kills_before)
+
+    def execute_many(self, steps: List[Any], stop_on_failure: bool = True,
+                     output_callback: Optional[Callable[[int, str, str], None]] = None) -> List[CommandResult]:
+        # Wersja synchroniczna execute_many_async() - nie wywoływać z działającej pętli asyncio
+        return asyncio.run(self.execute_many_async(steps, stop_on_failure, output_callback))
+
+    async def execute_many_async(self, steps: List[Any], stop_on_failure: bool = True,
+                                 output_callback: Optional[Callable[[int, str, str], None]] = None) -> List[CommandResult]:
+        # Kroki (str albo CommandStep) tworzą graf zależności; niezależne kroki działają równolegle (limit max_concurrent_processes).
+        # Wyniki są w kolejności kroków; krok z nieudaną zależnością jest pomijany, a przy stop_on_failure pierwszy błąd
+        # przerywa działające kroki i nie uruchamia kolejnych. output_callback(indeks_kroku, nazwa_strumienia, tekst).
+        plan = [step if isinstance(step, CommandStep) else CommandStep(step) for step in steps]
+        self._check_step_graph(plan)
+        start_cwd = self.current_working_dir
+        # Cały plan sprawdzany przed uruchomieniem pierwszego kroku - niebezpieczny krok blokuje wszystkie
+        blocked = [index for index, verdict in enumerate(SecurityValidator.validate_many(step.command for step in plan)) if not verdict.is_safe]
+        if blocked:
+            self.logger.warning(f"Plan zablokowany - niebezpieczne kroki: {blocked}")
+            return [CommandResult(False, "", SecurityValidator.validate(step.command)[1] if index in blocked else
+                                  f"Pominięto: plan zawiera niebezpieczne kroki: {blocked}.", -1, step.command, 0.0, start_cwd)
+                    for index, step in enumerate(plan)]
+        results: List[Optional[CommandResult]] = [None] * len(plan)
+        finished: List[int] = [] # Indeksy kroków, które zostały wykonane, w kolejności zakończenia
+        tasks: Dict[int, asyncio.Task] = {}
+        running: set = set() # Kroki, których proces właśnie działa - tylko je przerywa pierwszy błąd
+        aborted = False
+
+        def skipped(index: int, working_dir: str, reason: str) -> CommandResult:
+            return CommandResult(False, "", reason, -1, plan[index].command, 0.0, working_dir)
+
+        async def run_step(index: int):
+            nonlocal aborted
+            step = plan[index]
+            working_dir = start_cwd
+            try:
+                if step.depends_on: await asyncio.wait([tasks[dependency] for dependency in step.depends_on])
+                failed = [dependency for dependency in step.depends_on if not results[dependency].success]
+                if step.depends_on: working_dir = results[step.depends_on[-1]].working_dir
+                if failed:
+                    results[index] = skipped(index, working_dir, f"Pominięto: nie powiodły się kroki, od których zależy ten krok: {failed}.")
+                    return
+                if aborted:
+                    results[index] = skipped(index, working_dir, "Pominięto: wcześniejszy krok nie powiódł się.")
+                    return
+                callback = (lambda stream_name, text: output_callback(index, stream_name, text)) if output_callback else None
+                running.add(index)
+                try:
+                    results[index] = await self.execute_async(step.command, working_dir, callback)
+                except Exception as e: # Np. usunięty katalog roboczy - nieudany krok, zależne kroki są pomijane jak zwykle
+                    self.logger.error(f"Krok {index} ('{step.command}') nie został uruchomiony: {e}")
+                    results[index] = CommandResult(False, "", f"Błąd uruchomienia polecenia: {e}", -1, step.command, 0.0, working_dir)
+                finally:
+                    running.discard(index)
+                finished.append(index)
+            except asyncio.CancelledError:
+                results[index] = skipped(index, working_dir, "Przerwano: wcześniejszy krok nie powiódł się.")
+                raise
+            if not results[index].success and stop_on_failure and not aborted:
+                aborted = True
+                self.logger.warning(f"Krok {index} ('{step.command}') nie powiódł się - przerywanie pozostałych kroków.")
+                for other_index in running: tasks[other_index].cancel() # Oczekujące kroki zobaczą `aborted` i zostaną pominięte
+
+        for index in range(len(plan)): tasks[index] = asyncio.ensure_future(run_step(index))
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        # Katalog roboczy sesji: ten, w którym skończył się ostatni (wg kolejności kroków) wykonany krok
+        self.current_working_dir = results[max(finished)].working_dir if finished else start_cwd
+        return results
 
+    @staticmethod
+    def _check_step_graph(plan: List[CommandStep]):
+        for index, step in enumerate(plan):
+            for dependency in step.depends_on:
+                if not 0 <= dependency < len(plan) or dependency == index:
+                    raise ValueError(f"Krok {index} ma nieprawidłową zależność: {dependency}")
+        remaining = {index: set(step.depends_on) for index, step in enumerate(plan)}
+        while remaining: # Algorytm Kahna - jeśli nie ma kroku bez zależności, graf ma cykl
+            ready = [index for index, dependencies in remaining.items() if not dependencies & remaining.keys()]
+            if not ready: raise ValueError(f"Cykl w zależnościach kroków: {sorted(remaining)}")
+            for index in ready: del remaining[index]
+
+    def _spawn_options(self, program: str, argv: List[str]) -> Tuple[str, List[str], Optional[Callable[[], None]]]:
+        limits = self.resource_limits
+        if not limits or not limits.is_set(): return program, argv, None
+        program, argv = limits.wrap_argv(program, argv)
+        return program, argv, limits.preexec_fn()
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        # Semafor jest związany z pętlą zdarzeń - osobny dla każdej pętli (np. kolejne asyncio.run())
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._async_semaphores[loop] = asyncio.Semaphore(self.max_concurrent_processes)
+        return semaphore
+
+    async def _spawn_async(self, command: str, effective_cwd: str) -> Tuple[asyncio.subprocess.Process, Optional[int]]:
+        plain_argv = resolve_plain_argv(command, effective_cwd)
+        if plain_argv:
+            try:
+                program, argv, preexec_fn = self._spawn_options(*plain_argv)
+                return await asyncio.create_subprocess_exec(*argv, executable=program, cwd=effective_cwd, env=os.environ.copy(), start_new_session=True,
+                                                            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                            preexec_fn=preexec_fn), None
+            except OSError as e_spawn:
+                self.logger.debug(f"Szybka ścieżka argv nie powiodła się dla '{command}': {e_spawn}")
+        cwd_read_fd, cwd_write_fd = os.pipe()
+        try:
+            program, argv, preexec_fn = self._spawn_options(*shell_argv(cwd_trap_script(command, cwd_write_fd)))
+            return await asyncio.create_subprocess_exec(
+                *argv, executable=program, cwd=effective_cwd, env=os.environ.copy(), start_new_session=True,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, pass_fds=(cwd_write_fd,), preexec_fn=preexec_fn
+            ), cwd_read_fd
+        except BaseException:
+            os.close(cwd_read_fd); raise
+        finally:
+            os.close(cwd_write_fd)
+
+    async def _run_subprocess_async(self, command: str, effective_cwd: str,
+                                    consume: Callable[[str, bytes], None]) -> Tuple[int, Optional[str], bool]:
+        process, cwd_read_fd = await self._spawn_async(command, effective_cwd)
+        track_process_group(process.pid)
+        escalation = TimeoutEscalation(process.pid, self.timeout, f"'{command}'", self.termination_grace_period)
+
+        async def pump(stream_name: str, reader: asyncio.StreamReader):
+            while True:
+                data = await reader.read(self.READ_CHUNK_SIZE)
+                consume(stream_name, data)
+                if not data: return # EOF - proces zamknął strumień
+
+        streams = [("stdout", process.stdout), ("stderr", process.stderr)]
+        pumps = [asyncio.ensure_future(pump(stream_name, reader)) for stream_name, reader in streams]
+        completion = asyncio.gather(*pumps, process.wait())
+        completion.add_done_callback(lambda future: future.cancelled() or future.exception()) # Przy przerwaniu - bez "exception was never retrieved"
+        try:
+            while not completion.done():
+                try: await asyncio.wait_for(asyncio.shield(completion), escalation.remaining())
+                except asyncio.TimeoutError:
+                    if not escalation.expire(): break # Proces spoza grupy trzyma potoki - kończymy bez EOF
+            final_cwd = read_reported_cwd(cwd_read_fd, effective_cwd)
+        finally:
+            if not completion.done():
+                completion.cancel()
+                await asyncio.gather(*pumps, return_exceptions=True)
+            if cwd_read_fd is not None: os.close(cwd_read_fd)
+            if process.returncode is None: # Anulowane zadanie albo proces nie zakończył się nawet po SIGKILL
+                signal_process_group(process.pid, signal.SIGKILL)
+                await process.wait()
+        for (stream_name, _), pump_task in zip(streams, pumps):
+            if pump_task.cancelled(): consume(stream_name, b"") # Domknięcie dekodera strumienia bez EOF
+        return process.returncode, final_cwd, escalation.timed_out
+
+    def _new_output_capture(self) -> OutputCapture:
+        head_limit = self.max_output_size // 2
+        return OutputCapture(head_limit, self.max_output_size - head_limit, on_spill=self._track_spill_file)
+
+    def _oom_kill_count(self) -> Optional[int]:
+        return self.resource_limits.oom_kill_count() if self.resource_limits and self.resource_limits.is_set() else None
+
+    def _track_spill_file(self, path: str):
+        self._spill_paths.append(path)
+        while len(self._spill_paths) > self.SPILL_FILES_KEPT:
+            old_path = self._spill_paths.popleft()
+            try: os.unlink(old_path)
+            except OSError: pass
+
+    def _result_from_captures(self, command: str, rc: int, captures: Dict[str, OutputCapture], effective_initial_cwd: str,
+                              final_cwd: Optional[str], execution_time: float,
+                              resource_usage: Optional[Dict[str, Any]] = None, timed_out: bool = False,
+                              cancelled: bool = False, oom_kills_before: Optional[int] = None) -> CommandResult:
+        result = self._finalize_result(command, rc, captures["stdout"].text(), captures["stderr"].text(),
+                                       effective_initial_cwd, final_cwd, execution_time)
+        result.stdout_total_bytes, result.stderr_total_bytes = captures["stdout"].total_bytes, captures["stderr"].total_bytes
+        result.stdout_spill_path, result.stderr_spill_path = captures["stdout"].spill_path, captures["stderr"].spill_path
+        result.stdout_digest, result.stderr_digest = captures["stdout"].digest, captures["stderr"].digest
+        for field_name, value in (resource_usage or {}).items(): setattr(result, field_name, value)
+        if self.resource_limits and self.resource_limits.is_set() and not (timed_out or cancelled): # Przerwanie to nie przekroczenie limitu
+            cpu_time = None if result.cpu_user_time is None else result.cpu_user_time + result.cpu_system_time
+            oom_kills_after = self.resource_limits.oom_kill_count() if oom_kills_before is not None else None
+            oom_kills = None if oom_kills_after is None else oom_kills_after - oom_kills_before
+            result.limits_exceeded = self.resource_limits.detect_exceeded(rc, result.stderr, cpu_time, oom_kills)
+            if result.limits_exceeded:
+                exceeded_text = ", ".join(self.resource_limits.describe(limit_name) for limit_name in result.limits_exceeded)
+                self.logger.warning(f"Polecenie '{command}' przekroczyło limit: {exceeded_text}")
+                result.stderr += f"\n[Przekroczono limit: {exceeded_text}]"
+        if timed_out:
+            result.success, result.timed_out = False, True
+            result.stderr += f"\n[Przekroczono limit czasu {self.timeout} s - polecenie zostało przerwane]"
+        elif cancelled:
+            result.success, result.cancelled = False, True
+            result.stderr += "\n[Polecenie przerwane na żądanie użytkownika]"
+        self.history.record(result, time.time() - execution_time, effective_initial_cwd)
+        return result
 
+    def _finalize_result(self, command: str, rc: int, stdout: str, stderr: str,
+                         effective_initial_cwd: str, final_cwd: Optional[str], execution_time: float) -> CommandResult:
+        # Powłoka sama zgłasza $PWD po poleceniu (znacznik trwałej powłoki albo osobny deskryptor) - katalog jest dokładny
+        # także dla `cd` w poleceniach złożonych, bez ponownego uruchamiania polecenia z `&& pwd`
+        new_cwd_for_executor = final_cwd if final_cwd and os.path.isdir(final_cwd) else effective_initial_cwd
+        if new_cwd_for_executor != effective_initial_cwd:
+            self.current_working_dir = new_cwd_for_executor
+            if rc == 0 and not stdout.strip() and re.match(r"^\s*cd(\s+.*|$)", command.strip()):
+                stdout = f"Changed directory to {new_cwd_for_executor}"
         res = CommandResult((rc == 0), stdout, stderr, rc, command, execution_time, new_cwd_for_executor)
         self.logger.debug(f"Execution Result: Success={res.success}, RC={rc}, Result CWD: {res.working_dir}, Executor CWD after exec: {self.current_working_dir}")
-        if self.current_working_dir != new_cwd_for_executor and rc == 0 and re.match(r"^\s*cd(\s+.*|$)", command.strip()):
-             self.logger.warning(f"Mismatch: Executor CWD is {self.current_working_dir} but result CWD is {new_cwd_for_executor} for a 'cd' command that succeeded. This might indicate an issue in CWD update logic for compound commands if it wasn't updated by '&& pwd'.")
+        return res
 
+    def cancel(self) -> bool:
+        # Przerwanie wykonywanych właśnie poleceń (wywoływane z innego wątku niż execute()): SIGTERM, po
+        # termination_grace_period SIGKILL do ich procesów. Trwała powłoka działa dalej - z katalogiem roboczym i
+        # zmiennymi sesji. Wynik przerwanego polecenia ma cancelled=True. False - nic się nie wykonywało.
+        escalations = list(self._escalations)
+        for escalation in escalations: escalation.cancel()
+        shell_cancelled = self.persistent_shell.cancel() if self.persistent_shell else False
+        return bool(escalations) or shell_cancelled
 
-        return res
+    def close(self, force: bool = False):
+        if self.persistent_shell: self.persistent_shell.close(force=force)
+        for session in list(self._interactive_sessions): session.close(grace_period=0 if force else self.termination_grace_period)
 
     def get_current_working_dir(self) -> str:
         return self.current_working_dir
@@ -230,30 +897,53 @@ class CommandExecutor:
         return False
 
     def execute_interactive(self, command: str, working_dir_override: Optional[str] = None,
-                           env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+                            env: Optional[Dict[str, str]] = None, rows: int = DEFAULT_PTY_ROWS, cols: int = DEFAULT_PTY_COLS,
+                            on_update: Optional[Callable[[Dict[str, Any]], None]] = None,
+                            on_exit: Optional[Callable[[CommandResult], None]] = None) -> PtySession:
+        # Polecenie interaktywne (htop, vim, less...) w pseudoterminalu, bez zewnętrznego emulatora terminala.
+        # Zwraca od razu działającą sesję: write() przekazuje klawisze, resize() zmienia rozmiar, close() kończy program.
+        # on_update dostaje zmienione wiersze ekranu, on_exit - CommandResult (stdout to końcowa zawartość ekranu).
         effective_working_dir = os.path.abspath(working_dir_override if working_dir_override else self.current_working_dir)
         is_safe, message = SecurityValidator.validate(command)
         if not is_safe:
             self.logger.warning(f"Próba wykonania niebezpiecznego polecenia w trybie interaktywnym: {command}")
             raise ValueError(message)
 
-        # Dla trybu interaktywnego, zmiana katalogu musi być częścią polecenia
-        safe_cwd_for_shell_cd = shlex.quote(effective_working_dir)
-        interactive_command_with_cd = f"cd {safe_cwd_for_shell_cd} && ({command})"
-
-        execution_env = os.environ.copy()
+        execution_env = dict(os.environ, TERM=PTY_TERM_NAME) # TERM procesu backendu/GUI nie opisuje tego ekranu
         if env: execution_env.update(env)
+        start_time, oom_kills_before = time.time(), self._oom_kill_count()
+        cwd_read_fd, cwd_write_fd = os.pipe()
+
+        def finished(session: PtySession) -> CommandResult:
+            try:
+                resource_usage = wait_with_rusage(session.process)
+                final_cwd = read_reported_cwd(cwd_read_fd, effective_working_dir)
+            finally:
+                os.close(cwd_read_fd)
+                self._interactive_sessions.discard(session)
+            reap_orphans()
+            captures = {"stdout": self._new_output_capture(), "stderr": self._new_output_capture()}
+            captures["stdout"].write(session.screen.text().encode("utf-8"))
+            for capture in captures.values(): capture.close()
+            result = self._result_from_captures(command, session.process.returncode, captures, effective_working_dir, final_cwd,
+                                                time.time() - start_time, resource_usage, oom_kills_before=oom_kills_before)
+            self.logger.info(f"Sesja interaktywna '{command}' zakończona (RC: {result.return_code}).")
+            if on_exit:
+                try: on_exit(result)
+                except Exception as e_exit: self.logger.debug(f"Nie można przekazać wyniku sesji interaktywnej '{command}': {e_exit}")
+            return result
+
+        session = PtySession(rows, cols, on_update=on_update, on_finished=finished)
         try:
-            self.logger.info(f"Uruchamianie procesu interaktywnego: '{interactive_command_with_cd}' (original CWD for Popen: {os.getcwd()})")
-            process = subprocess.Popen(
-                interactive_command_with_cd, shell=True, cwd=None, # cwd=None, bo `cd` jest w poleceniu
-                env=execution_env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, text=True, bufsize=1, executable='/bin/bash'
-            )
-            return process
-        except Exception as e:
-            self.logger.error(f"Błąd podczas uruchamiania procesu interaktywnego: {command}, {str(e)}", exc_info=True)
-            raise
+            program, argv, preexec_fn = self._spawn_options(*shell_argv(cwd_trap_script(command, cwd_write_fd)))
+            self.logger.info(f"Uruchamianie polecenia interaktywnego w pseudoterminalu {rows}x{cols}: '{command}' w CWD: '{effective_working_dir}'")
+            session.start(program, argv, effective_working_dir, execution_env, preexec_fn=preexec_fn, pass_fds=(cwd_write_fd,))
+        except BaseException:
+            os.close(cwd_read_fd); raise
+        finally:
+            os.close(cwd_write_fd)
+        self._interactive_sessions.add(session)
+        return session
 
     def kill_process(self, process: subprocess.Popen) -> bool:
         # ... (bez zmian z poprzedniej poprawnej wersji)
@@ -269,8 +959,8 @@ class CommandExecutor:
         except Exception as e: self.logger.error(f"Błąd zabijania procesu (PID: {process.pid if process else 'N/A'}): {e}"); return False
 
 
-    def get_history(self, limit: int = 10) -> List[CommandResult]:
-        return self.history[-limit:]
+    def get_history(self, limit: int = 10) -> List[HistoryRecord]:
+        return self.history.latest(limit)
 
 
 if __name__ == '__main__':
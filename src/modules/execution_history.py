@@ -0,0 +1,184 @@
+# Plik: src/modules/execution_history.py
+
+import os
+import re
+import sys
+import json
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger("execution_history")
+
+# Historia wykonanych poleceń: pierścień o stałej pojemności z kompaktowymi rekordami (__slots__, skróty wyjścia
+# zamiast pełnego tekstu) i opcjonalny plik JSON-lines, do którego rekordy są tylko dopisywane.
+DEFAULT_CAPACITY = 50000
+MAX_COMMAND_LENGTH = 1024 # Dłuższe polecenia są obcinane - stały rozmiar rekordu
+COMPACT_FACTOR = 2 # Plik jest przepisywany do `capacity` ostatnich rekordów, gdy urośnie do capacity * COMPACT_FACTOR linii
+FILE_MODE = 0o600 # Polecenia mogą zawierać dane wrażliwe - plik tylko dla właściciela
+# Hasło przekazywane przez GUI i CLI jako `echo <hasło> | sudo -S -p '' ...` (hasło po shlex.quote) - nie trafia do historii
+SUDO_PASSWORD_PIPE = re.compile(r"""^(\s*echo\s+)(?:'[^']*'|"(?:[^"\\]|\\.)*"|\\.|[^\s'"\\|;&])+(?=\s*\|\s*sudo\s+(?:\S+\s+)*?-S\b)""")
+REDACTED_PASSWORD = "'****'"
+
+
+def redact_command(command: str) -> str:
+    return SUDO_PASSWORD_PIPE.sub(lambda match: match.group(1) + REDACTED_PASSWORD, command, count=1)
+
+
+def _open_private(path: str, flags: int):
+    # Plik tekstowy z uprawnieniami FILE_MODE - także gdy istniał wcześniej z szerszymi
+    fd = os.open(path, flags | os.O_CREAT, FILE_MODE)
+    try: os.fchmod(fd, FILE_MODE)
+    except OSError: pass
+    return os.fdopen(fd, "a" if flags & os.O_APPEND else "w", encoding="utf-8")
+
+
+class HistoryRecord:
+    __slots__ = ("command", "return_code", "working_dir", "started_at", "execution_time",
+                 "stdout_digest", "stderr_digest", "stdout_bytes", "stderr_bytes", "timed_out")
+
+    def __init__(self, command: str, return_code: int, working_dir: str, started_at: float, execution_time: float,
+                 stdout_digest: Optional[str] = None, stderr_digest: Optional[str] = None,
+                 stdout_bytes: int = 0, stderr_bytes: int = 0, timed_out: bool = False):
+        self.command = redact_command(command)[:MAX_COMMAND_LENGTH]
+        self.return_code = return_code
+        self.working_dir = sys.intern(working_dir) # Ten sam katalog w wielu rekordach - jedna kopia napisu
+        self.started_at = started_at
+        self.execution_time = execution_time
+        self.stdout_digest = stdout_digest
+        self.stderr_digest = stderr_digest
+        self.stdout_bytes = stdout_bytes
+        self.stderr_bytes = stderr_bytes
+        self.timed_out = timed_out
+
+    @classmethod
+    def from_result(cls, result: Any, started_at: float, working_dir: str) -> "HistoryRecord":
+        # result: CommandResult (bez importu - command_executor importuje ten moduł); working_dir - katalog, w którym
+        # polecenie zostało uruchomione (result.working_dir to katalog PO poleceniu)
+        return cls(result.command, result.return_code, working_dir, started_at, result.execution_time,
+                   result.stdout_digest, result.stderr_digest, result.stdout_total_bytes, result.stderr_total_bytes, result.timed_out)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"HistoryRecord({self.command!r}, rc={self.return_code}, cwd={self.working_dir!r}, started_at={self.started_at:.3f})"
+
+
+class ExecutionHistory:
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, path: Optional[str] = None):
+        self.capacity = capacity
+        self.path = path
+        self._records: List[Optional[HistoryRecord]] = [None] * capacity # Pierścień: _next to miejsce kolejnego wpisu
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_lines = 0
+        if path: self._load()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[HistoryRecord]:
+        # Od najstarszego do najnowszego (migawka - bezpieczne przy równoległym dopisywaniu)
+        with self._lock:
+            start = (self._next - self._count) % self.capacity
+            snapshot = [self._records[(start + offset) % self.capacity] for offset in range(self._count)]
+        return iter(snapshot)
+
+    def append(self, record: HistoryRecord):
+        with self._lock:
+            self._store(record)
+            if self.path: self._persist(record)
+
+    def _store(self, record: HistoryRecord):
+        self._records[self._next] = record
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def record(self, result: Any, started_at: float, working_dir: str) -> HistoryRecord:
+        history_record = HistoryRecord.from_result(result, started_at, working_dir)
+        self.append(history_record)
+        return history_record
+
+    def latest(self, limit: int = 10) -> List[HistoryRecord]:
+        return list(self)[-limit:] if limit > 0 else []
+
+    def query(self, prefix: Optional[str] = None, return_code: Optional[int] = None, working_dir: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None, limit: Optional[int] = None) -> List[HistoryRecord]:
+        # Rekordy spełniające wszystkie podane warunki, od najnowszego; since/until to znaczniki czasu startu (time.time())
+        matches: List[HistoryRecord] = []
+        for record in reversed(list(self)):
+            if prefix is not None and not record.command.startswith(prefix): continue
+            if return_code is not None and record.return_code != return_code: continue
+            if working_dir is not None and record.working_dir != working_dir: continue
+            if since is not None and record.started_at < since: continue
+            if until is not None and record.started_at > until: continue
+            matches.append(record)
+            if limit is not None and len(matches) >= limit: break
+        return matches
+
+    def close(self):
+        with self._lock:
+            if self._file: self._file.close(); self._file = None
+
+    def _load(self):
+        # Tylko ostatnie `capacity` linii trafia do pamięci; uszkodzone linie (np. przerwany zapis) są pomijane
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                tail: deque = deque(maxlen=self.capacity)
+                for line in f:
+                    self._file_lines += 1
+                    tail.append(line)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"Nie można odczytać historii wykonań {self.path}: {e}")
+            return
+        redacted = False
+        for line in tail:
+            try: fields = json.loads(line); record = HistoryRecord(**fields)
+            except (ValueError, TypeError): continue
+            redacted = redacted or record.command != fields.get("command", "")[:MAX_COMMAND_LENGTH]
+            self._store(record)
+        logger.info(f"Wczytano {self._count} rekordów historii wykonań z {self.path}")
+        if redacted: # Plik z wcześniejszych wersji zawierał hasła sudo - przepisz go bez nich
+            try: self._rewrite([json.dumps(record.to_dict(), ensure_ascii=False) + "\n" for record in self])
+            except OSError as e: logger.warning(f"Nie można przepisać historii wykonań {self.path}: {e}")
+
+    def _persist(self, record: HistoryRecord):
+        # Wywoływane z założoną blokadą. Inny proces (np. drugi backend) mógł przepisać plik - wtedy otwórz go ponownie.
+        try:
+            if self._file is not None and not self._same_file():
+                self._file.close(); self._file = None
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = _open_private(self.path, os.O_WRONLY | os.O_APPEND)
+            self._file.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+            self._file.flush()
+            self._file_lines += 1
+            if self._file_lines >= self.capacity * COMPACT_FACTOR: self._compact()
+        except OSError as e:
+            logger.warning(f"Nie można zapisać historii wykonań do {self.path}: {e}")
+
+    def _same_file(self) -> bool:
+        try: return os.path.samestat(os.fstat(self._file.fileno()), os.stat(self.path))
+        except OSError: return False
+
+    def _compact(self):
+        # Przepisz plik do `capacity` ostatnich linii (atomowo przez os.replace). Źródłem jest plik, nie pierścień -
+        # zachowuje rekordy dopisane przez inne procesy backendu.
+        with open(self.path, "r", encoding="utf-8") as f:
+            tail: deque = deque(f, maxlen=self.capacity)
+        self._rewrite(tail)
+        self._file.close(); self._file = None
+        logger.info(f"Historia wykonań {self.path} przepisana do {len(tail)} ostatnich rekordów.")
+
+    def _rewrite(self, lines):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with _open_private(temp_path, os.O_WRONLY | os.O_TRUNC) as f:
+            f.writelines(lines)
+        os.replace(temp_path, self.path)
+        self._file_lines = len(lines)
@@ -4,6 +4,14 @@ import os
 import logging
 import json
 import re
+from collections import deque
+
+try:
+    from .prompt_budget import (PromptBudget, PromptSection, BudgetAllocation, PRIORITY_SEARCH_RESULTS, PRIORITY_SYSTEM_CONTEXT,
+                                PRIORITY_HISTORY, PRIORITY_CWD_FILES)
+except ImportError: # Import płaski (backend_cli.py dodaje src/modules do sys.path)
+    from prompt_budget import (PromptBudget, PromptSection, BudgetAllocation, PRIORITY_SEARCH_RESULTS, PRIORITY_SYSTEM_CONTEXT,
+                               PRIORITY_HISTORY, PRIORITY_CWD_FILES)
 
 from google import genai
 from google.genai import types as genai_types
@@ -30,6 +38,85 @@ class GeminiApiResponse:
     file_search_message: Optional[str] = None
     needs_external_terminal: bool = False
     working_dir: Optional[str] = None
+    prompt_token_count: Optional[int] = None # usage_metadata odpowiedzi API
+    output_token_count: Optional[int] = None
+
+MAX_PENDING_NOTES = 10 # Zdarzenia spoza czatu (wyniki poleceń itp.) czekające na następną wiadomość
+HISTORY_TRIM_RATIO = 0.75 # Po przekroczeniu budżetu historia jest skracana z zapasem - sesja nie jest odtwarzana w każdej turze
+
+
+def content_text(content: Any) -> str:
+    return "".join(getattr(part, "text", None) or "" for part in (getattr(content, "parts", None) or []))
+
+
+class GeminiConversation:
+    # Jedna sesja czatu Gemini na rozmowę: tworzona raz, z instrukcją systemową w konfiguracji sesji; każda tura
+    # dopisuje tylko nową wiadomość. Sekcje kontekstu (CWD, lista plików, stan systemu) trafiają do wiadomości
+    # tylko po zmianie, a zdarzenia spoza czatu (note()) - raz, w najbliższej wiadomości. Ile historii i kontekstu
+    # zmieści się w prompcie, decyduje budżet tokenów silnika (PromptBudget).
+    def __init__(self, engine: "GeminiIntegration", history: Optional[List[Dict[str, Any]]] = None):
+        self.engine = engine
+        self.chat: Optional[Any] = None # google.genai Chat
+        self.system_instruction: Optional[str] = None
+        seed = engine._convert_legacy_history_to_new_format(history)
+        while seed and seed[-1].role == "user": seed.pop() # Bieżące zapytanie jest wysyłane jako nowa wiadomość
+        self._seed_history: List[Any] = seed
+        self._pending_notes: deque = deque(maxlen=MAX_PENDING_NOTES)
+        self._sent_context: Dict[str, str] = {} # Sekcja -> ostatnio wysłana treść (przed skróceniem)
+        self.last_allocation: Optional[BudgetAllocation] = None
+
+    def note(self, text: str):
+        self._pending_notes.append(text)
+
+    def _history(self) -> List[Any]:
+        return list(self._seed_history if self.chat is None else self.chat.get_history(curated=True))
+
+    def _ensure_chat(self, system_instruction: str, keep_history: Optional[int] = None):
+        # keep_history - liczba ostatnich wpisów historii, które mieszczą się w budżecie (None - wszystkie)
+        history = self._history()
+        trim = keep_history is not None and keep_history < len(history)
+        if self.chat is not None and system_instruction == self.system_instruction and not trim: return
+        if trim:
+            history = history[len(history) - int(keep_history * HISTORY_TRIM_RATIO):] if keep_history > 1 else []
+            while history and history[0].role != "user": history = history[1:]
+            self._sent_context.clear() # Usunięte tury mogły zawierać ostatni wysłany kontekst
+        self.chat = self.engine.client.chats.create(model=self.engine.model_name_str,
+                                                    config=self.engine.chat_config(system_instruction), history=history)
+        self.system_instruction, self._seed_history = system_instruction, []
+
+    def _changed(self, sections: List[PromptSection]) -> List[PromptSection]:
+        return [section for section in sections if section.render() and self._sent_context.get(section.name) != section.render()]
+
+    def _allocate(self, system_instruction: str, changed: List[PromptSection], text: str) -> BudgetAllocation:
+        return self.engine.prompt_budget.allocate(
+            [PromptSection("system_instruction", text=system_instruction),
+             PromptSection("history", items=[content_text(content) for content in self._history()], separator="\n",
+                           priority=PRIORITY_HISTORY, keep_last=True),
+             PromptSection("notes", items=list(self._pending_notes), separator="\n", priority=PRIORITY_SEARCH_RESULTS, keep_last=True)]
+            + changed + [PromptSection("query", text=text)])
+
+    def send(self, system_instruction: str, sections: List[PromptSection], text: str) -> GeminiApiResponse:
+        # sections - kontekst tej tury (z priorytetami do skracania); instrukcja systemowa i text nie są skracane
+        if not self.engine.is_configured or not self.engine.client:
+            return GeminiApiResponse(success=False, error="Klient API Google nie skonfigurowany.")
+        changed = self._changed(sections)
+        allocation = self._allocate(system_instruction, changed, text)
+        self._ensure_chat(system_instruction, len(allocation.sections["history"].items))
+        if self._changed(sections) != changed: # Sesja odtworzona ze skróconą historią - kontekst trzeba wysłać od nowa
+            changed = self._changed(sections)
+            allocation = self._allocate(system_instruction, changed, text)
+        self.last_allocation = allocation
+        message = "\n".join(part for part in [allocation.text("notes")] + [allocation.text(section.name) for section in changed] + [text] if part)
+        logger.debug(f"Gemini: Wiadomość czatu (~{allocation.total_tokens} tokenów promptu, nowe sekcje: "
+                     f"{[section.name for section in changed]}):\n{message[:1000]}")
+        response = self.engine._send_request_to_gemini(contents_arg=message, is_chat=True, chat_session=self.chat)
+        if response.success: # Po błędzie notatki i kontekst zostaną wysłane ponownie
+            prompt_chars = len(system_instruction) + sum(len(content_text(content)) for content in self._history()) - len(response.explanation or "")
+            self.engine.prompt_budget.calibrate(prompt_chars, response.prompt_token_count)
+            self._pending_notes.clear()
+            self._sent_context.update({section.name: section.render() for section in changed})
+        return response
+
 
 class GeminiIntegration:
     def __init__(self, model_name: str = 'gemini-1.5-flash-latest'): # Użyj stabilnej nazwy modelu
@@ -37,6 +124,7 @@ class GeminiIntegration:
         self.model_name_str = model_name
         self.client: Optional[genai.Client] = None
         self.is_configured = False
+        self.prompt_budget = PromptBudget() # Budżet tokenów promptu (LAA_PROMPT_TOKEN_BUDGET), kalibrowany z usage_metadata
 
         # Parametry dla obiektu types.GenerateContentConfig
         self.default_generation_config_params = {
@@ -67,6 +155,15 @@ class GeminiIntegration:
                 self.client = None
                 self.is_configured = False
 
+    def chat_config(self, system_instruction: str) -> genai_types.GenerateContentConfig:
+        # Konfiguracja sesji czatu: instrukcja systemowa, parametry generowania i safety settings
+        return genai_types.GenerateContentConfig(system_instruction=system_instruction,
+                                                 safety_settings=self.default_safety_settings_list,
+                                                 **self.default_generation_config_params)
+
+    def new_conversation(self) -> "GeminiConversation":
+        return GeminiConversation(self)
+
     def _convert_legacy_history_to_new_format(self, history: Optional[List[Dict[str, Any]]]) -> List[genai_types.Content]:
         if not history: return []
         new_history: List[genai_types.Content] = []
@@ -102,20 +199,8 @@ class GeminiIntegration:
                 elif isinstance(contents_arg, list) and all(isinstance(p, genai_types.Part) for p in contents_arg): content_to_send_in_chat = contents_arg
                 else: content_to_send_in_chat = str(contents_arg)
 
-                # Dla czatu, konfiguracja i safety settings są zwykle ustawiane podczas tworzenia sesji
-                # lub dziedziczone z modelu. send_message ich nie przyjmuje.
-                # Jednak jeśli chcemy je dynamicznie zmieniać dla każdej wiadomości w czacie (co nie jest typowe dla tego SDK),
-                # musielibyśmy prawdopodobnie tworzyć nową sesję czatu z nową konfiguracją, co jest nieefektywne.
-                # Na razie zakładamy, że konfiguracja sesji czatu jest wystarczająca.
-                # Jeśli `chat_session.send_message` w Twojej wersji SDK *przyjmuje* `generation_config` i `safety_settings`,
-                # możesz je tutaj dodać, ale dokumentacja, którą widziałem, tego nie sugeruje.
-                # Sprawdźmy dokumentację dla `chat_session.send_message` dla google-genai 1.16.1.
-                # Jeśli nie, to te ustawienia są brane z `self.client.chats.create` (czyli z modelu).
-                # Dla pewności można by jawnie tworzyć `GenerationConfig` i `SafetySettings` dla czatu,
-                # ale tylko jeśli `send_message` je akceptuje.
-                # Zostawmy na razie tak, jak było - jeśli będą problemy z bezpieczeństwem/konfiguracją czatu,
-                # będziemy musieli to zbadać głębiej.
-
+                # Konfiguracja (instrukcja systemowa, safety settings, parametry generowania) pochodzi z sesji czatu -
+                # GeminiIntegration.chat_config() przy chats.create()
                 response = chat_session.send_message(content_to_send_in_chat)
             else: # non-chat
                 # Przygotuj config_dict
@@ -165,7 +250,10 @@ class GeminiIntegration:
                  else:
                     logger.error("Brak części (parts) lub tekstu w zawartości odpowiedzi Gemini.")
                     return GeminiApiResponse(success=False, error="Brak zawartości tekstowej w odpowiedzi AI.")
-            return GeminiApiResponse(success=True, explanation=raw_text)
+            usage = getattr(response, "usage_metadata", None)
+            return GeminiApiResponse(success=True, explanation=raw_text,
+                                     prompt_token_count=getattr(usage, "prompt_token_count", None),
+                                     output_token_count=getattr(usage, "candidates_token_count", None))
 
         except google_genai_errors.APIError as api_err:
             error_message = str(api_err)
@@ -189,42 +277,34 @@ class GeminiIntegration:
                                            working_dir: Optional[str] = None,
                                            cwd_file_list: Optional[List[str]] = None,
                                            history: Optional[List[Dict[str, Any]]] = None,
-                                           language_instruction: Optional[str] = None) -> GeminiApiResponse:
+                                           language_instruction: Optional[str] = None,
+                                           system_context: Optional[Dict[str, str]] = None,
+                                           conversation: Optional["GeminiConversation"] = None) -> GeminiApiResponse:
+        # system_context - opisy kategorii z SystemContext.describe() (tylko tych, których dotyczy zapytanie);
+        # conversation - sesja czatu rozmowy (new_conversation()), history jest wtedy pomijane
         if not self.is_configured or not self.client:
             return GeminiApiResponse(success=False, error="Model Gemini nie został poprawnie zainicjalizowany.")
 
         distro_context = f"Dystrybucja: {distro_info.get('ID', 'nieznana')} {distro_info.get('VERSION_ID', '')}, Menedżer pakietów: {distro_info.get('PACKAGE_MANAGER', 'nieznany')}."
         wd_context = f"Aktualny katalog roboczy: {working_dir}" if working_dir else "Katalog roboczy nieznany."
+        system_context_info = "".join(f"\n- {text}" for text in (system_context or {}).values())
+        if system_context_info: system_context_info = f"Stan systemu istotny dla zapytania:{system_context_info}"
         lang_instr = language_instruction if language_instruction else "Respond in English."
-        cwd_files_info = "Brak informacji o plikach/katalogach w CWD."
-        if cwd_file_list:
-            file_limit = 30; temp_list = [f for f in cwd_file_list if f]
-            if len(temp_list) > file_limit:
-                cwd_files_info = f"Dostępne pliki i katalogi w bieżącym katalogu roboczym ({working_dir}) (pierwsze {file_limit}): {', '.join(temp_list[:file_limit])}, ..."
-            elif temp_list:
-                 cwd_files_info = f"Dostępne pliki i katalogi w bieżącym katalogu roboczym ({working_dir}): {', '.join(temp_list)}."
-            else:
-                 cwd_files_info = f"Brak plików/katalogów w bieżącym katalogu roboczym ({working_dir})."
-
-        formatted_history_for_prompt = ""
-        if history:
-            for entry in history:
-                role = entry.get("role", "user")
-                parts_list = entry.get("parts", [])
-                text_content_hist_entry = ""
-                if isinstance(parts_list, list) and parts_list:
-                    first_part = parts_list[0]
-                    if isinstance(first_part, dict): text_content_hist_entry = first_part.get("text", "")
-                if text_content_hist_entry: formatted_history_for_prompt += f"{role.capitalize()}: {text_content_hist_entry}\n"
-        if not formatted_history_for_prompt: formatted_history_for_prompt = "Brak historii."
+        # Lista plików bez stałego limitu - ile pozycji zmieści się w prompcie, decyduje budżet tokenów
+        cwd_files = [f for f in (cwd_file_list or []) if f]
+        if cwd_files:
+            cwd_files_section = PromptSection("cwd_files", items=cwd_files, priority=PRIORITY_CWD_FILES, min_items=1,
+                                              prefix=f"Dostępne pliki i katalogi w bieżącym katalogu roboczym ({working_dir}): ")
+        elif cwd_file_list is not None:
+            cwd_files_section = PromptSection("cwd_files", text=f"Brak plików/katalogów w bieżącym katalogu roboczym ({working_dir}).")
+        else:
+            cwd_files_section = PromptSection("cwd_files", text="Brak informacji o plikach/katalogach w CWD.")
 
         system_instruction_template = """Jesteś ekspertem od terminala Linux. Twoim zadaniem jest pomoc użytkownikowi przez wygenerowanie odpowiedniego polecenia LUB odpowiedź na pytanie dotyczące plików w katalogu.
-Kontekst systemu: {distro_context} {wd_context}
-{cwd_files_info}
+Kontekst systemu: {distro_context}
 {lang_instr}
-
-Historia konwersacji (jeśli istnieje):
-{formatted_history_for_prompt}
+Katalog roboczy, pliki w nim i stan systemu podaje wiadomość użytkownika, gdy się zmienią - obowiązują najnowsze z nich.
+Wcześniejsze wiadomości tego czatu to historia konwersacji.
 
 ZASADY:
 1. Jeśli zapytanie użytkownika jest PROŚBĄ O WYKONANIE AKCJI (np. "pokaż pliki", "zainstaluj coś", "usuń plik.txt", "rozjaśnij obraz.jpg"), wygeneruj polecenie.
@@ -269,42 +349,14 @@ ZASADY:
 4. Jeśli zapytanie wydaje się niebezpieczne, odpowiedz TYLKO słowami: DANGEROUS_REQUEST
 
 Nie dodawaj nic więcej, żadnych wstępów, markdown, poza wymaganym formatem."""
-        system_instruction_formatted = system_instruction_template.format(
-            distro_context=distro_context, wd_context=wd_context,
-            cwd_files_info=cwd_files_info, lang_instr=lang_instr,
-            formatted_history_for_prompt=formatted_history_for_prompt
-        )
-
-        new_sdk_history = self._convert_legacy_history_to_new_format(history)
-
-        # Tworzenie sesji czatu. Konfiguracja safety/generation jest dziedziczona z klienta/modelu.
-        # Dla czatu, system_instruction jest często częścią pierwszej tury użytkownika lub specjalnej tury 'system'.
-        # Tutaj dołączamy ją do pierwszej tury użytkownika.
-        # Historia `new_sdk_history` powinna być przekazana tutaj, jeśli ma być użyta.
-        chat_session = self.client.chats.create(
-            model=self.model_name_str,
-            history=new_sdk_history,
-            # Safety settings i generation config są stosowane na poziomie klienta lub modelu,
-            # ale dla sesji czatu można je też (w niektórych wersjach/sposobach SDK) przekazać tu.
-            # Jednak najnowsze SDK zdaje się preferować, by były one częścią `client.chat(...)` lub dziedziczone.
-            # Sprawdzimy, czy przekazanie ich tutaj jest konieczne lub poprawne dla `client.chats.create`.
-            # Według dokumentacji `google-genai==0.5.4` (na którą patrzę), `chats.create` nie przyjmuje
-            # `safety_settings` ani `generation_config` bezpośrednio. Są one częścią `send_message` dla ChatSession,
-            # lub `generate_content` dla `GenerativeModel`.
-            # Dla client.chats.create, dziedziczy z modelu.
-        )
-        # Jeśli chcemy użyć system_instruction w czacie, musi być jako pierwsza tura w historii
-        # lub połączona z pierwszym zapytaniem użytkownika.
-        # Tutaj łączymy ją z zapytaniem użytkownika.
-
-        current_turn_content_str = f"{system_instruction_formatted}\n\nZadanie/Pytanie od użytkownika: \"{user_prompt}\"\n"
-        logger.debug(f"Pełny prompt dla Gemini (generate_command_with_explanation - chat turn):\n{current_turn_content_str[:1000]}...")
-
-        api_response_wrapper = self._send_request_to_gemini(
-            contents_arg=current_turn_content_str, # String jest automatycznie konwertowany na Part przez SDK
-            is_chat=True,
-            chat_session=chat_session
-            # Nie przekazujemy system_instruction_for_non_chat, bo to jest czat
+        system_instruction_formatted = system_instruction_template.format(distro_context=distro_context, lang_instr=lang_instr)
+        # Bez obiektu rozmowy (wywołania jednorazowe) - sesja tylko na tę turę, z historią przekazaną jako tury czatu
+        if conversation is None: conversation = GeminiConversation(self, history)
+        api_response_wrapper = conversation.send(
+            system_instruction_formatted,
+            [PromptSection("wd", text=wd_context), cwd_files_section,
+             PromptSection("system", text=system_context_info, priority=PRIORITY_SYSTEM_CONTEXT)],
+            f"Zadanie/Pytanie od użytkownika: \"{user_prompt}\""
         )
 
         if not api_response_wrapper.success or not api_response_wrapper.explanation:
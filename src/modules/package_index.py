@@ -0,0 +1,152 @@
+# Plik: src/modules/package_index.py
+
+import os
+import re
+import shutil
+import logging
+import threading
+import subprocess
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("package_index")
+
+# Indeks nazwa -> wersja zainstalowanych pakietów, czytany wprost z bazy menedżera pakietów:
+# dpkg - /var/lib/dpkg/status (+ niezastosowane jeszcze wpisy z /var/lib/dpkg/updates), pacman - katalogi
+# /var/lib/pacman/local/<nazwa>-<wersja>-<wydanie>, rpm - `rpm -qa` (baza Berkeley DB/SQLite bez czytelnego formatu).
+# refresh() kosztuje kilka stat(), dopóki baza się nie zmieni; pacman jest odświeżany przyrostowo (tylko różnica
+# listy katalogów).
+RPM_QUERY_TIMEOUT = 30 # Sekundy; rpm -qa tylko po zmianie bazy
+PACKAGE_NAME = r"[A-Za-z0-9][A-Za-z0-9.+_@:-]*"
+# Pytania, na które backend odpowiada sam: (rodzaj, wzorzec z grupą "name" lub "package"); końcowe "?" i kropka opcjonalne
+PACKAGE_QUESTIONS = [(kind, re.compile(rf"^\s*{pattern}\s*[?.!]*\s*$", re.IGNORECASE)) for kind, pattern in [
+    ("installed", rf"(?:is|are)\s+(?:the\s+)?(?:package\s+)?(?P<name>{PACKAGE_NAME})\s+installed"),
+    ("installed", rf"do\s+i\s+have\s+(?:the\s+)?(?:package\s+(?P<package>{PACKAGE_NAME})|(?P<name>{PACKAGE_NAME})\s+installed)"),
+    ("installed", rf"czy\s+(?:mam\s+)?(?:pakiet\s+)?(?P<name>{PACKAGE_NAME})\s+(?:jest\s+)?zainstalowan\w*"),
+    ("installed", rf"czy\s+(?:mam\s+|jest\s+)?zainstalowan\w*\s+(?:pakiet\s+)?(?P<name>{PACKAGE_NAME})"),
+    ("installed", rf"czy\s+mam\s+pakiet\s+(?P<package>{PACKAGE_NAME})"), # Bez słowa "pakiet" zbyt ogólne ("czy mam internet")
+    ("version", rf"(?:what|which)\s+version\s+of\s+(?:the\s+)?(?:package\s+)?(?P<name>{PACKAGE_NAME})"
+                rf"(?:\s+(?:do\s+i\s+have|is\s+installed|have\s+i\s+got))?"),
+    ("version", rf"(?:jak[aą]|któr[aą])\s+(?:mam\s+)?wersj[eęa]\s+(?:pakietu\s+|programu\s+)?(?P<name>{PACKAGE_NAME})"
+                rf"(?:\s+(?:mam|jest\s+zainstalowan\w*))?"),
+    ("version", rf"wersja\s+(?:pakietu\s+|programu\s+)?(?P<name>{PACKAGE_NAME})"),
+]]
+
+
+NOT_PACKAGE_NAMES = frozenset(["it", "this", "that", "they", "them", "to", "ten", "ta", "on", "ona", "ono", "one", "go"])
+
+
+def parse_package_question(query: str) -> Optional[Tuple[str, str]]:
+    # ("installed" | "version", nazwa) dla prostych pytań o pakiet; None - zapytanie idzie do AI
+    # (także "is it installed?" - zaimek odnosi się do historii rozmowy, którą zna tylko AI)
+    for kind, pattern in PACKAGE_QUESTIONS:
+        match = pattern.match(query)
+        if not match: continue
+        name = match.groupdict().get("name") or match.group("package")
+        return None if name.lower() in NOT_PACKAGE_NAMES else (kind, name)
+    return None
+
+
+def _path_signature(path: str) -> Optional[Tuple[int, int]]:
+    try: stat_result = os.stat(path)
+    except OSError: return None
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+class PackageIndex:
+    DPKG_STATUS_FILE = "/var/lib/dpkg/status"
+    DPKG_UPDATES_DIR = "/var/lib/dpkg/updates"
+    PACMAN_LOCAL_DIR = "/var/lib/pacman/local"
+    RPM_DATABASE_DIRS = ("/var/lib/rpm", "/usr/lib/sysimage/rpm")
+
+    def __init__(self):
+        self.manager = "" # "dpkg", "pacman", "rpm" albo "" (brak obsługiwanej bazy)
+        self._packages: Dict[str, str] = {}
+        self._pacman_entries: Dict[str, Tuple[str, str]] = {} # Katalog w local/ -> (nazwa, wersja)
+        self._signature: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+    def sources(self) -> Sequence[str]:
+        return (self.DPKG_STATUS_FILE, self.DPKG_UPDATES_DIR, self.PACMAN_LOCAL_DIR) + tuple(self.RPM_DATABASE_DIRS)
+
+    def refresh(self) -> bool:
+        # True, jeśli indeks został przebudowany. Słownik jest podmieniany w całości - czytelnicy bez blokady.
+        signature = tuple(_path_signature(path) for path in self.sources())
+        if signature == self._signature: return False
+        with self._lock:
+            if signature == self._signature: return False
+            if os.path.isfile(self.DPKG_STATUS_FILE): manager, packages = "dpkg", self._read_dpkg()
+            elif os.path.isdir(self.PACMAN_LOCAL_DIR): manager, packages = "pacman", self._read_pacman()
+            elif any(os.path.isdir(path) for path in self.RPM_DATABASE_DIRS) and shutil.which("rpm"):
+                manager, packages = "rpm", self._read_rpm()
+            else: manager, packages = "", {}
+            if packages is None: return False # Błąd odczytu - zostaje poprzedni indeks, następne refresh() spróbuje znowu
+            self.manager, self._packages, self._signature = manager, packages, signature
+            logger.debug(f"Indeks pakietów ({manager}): {len(packages)} pakietów")
+            return True
+
+    def _read_dpkg(self) -> Optional[Dict[str, str]]:
+        # Plik status, potem pliki z updates/ w kolejności numerów - dpkg stosuje je przy następnym uruchomieniu
+        packages: Dict[str, str] = {}
+        try:
+            updates = sorted((entry for entry in os.listdir(self.DPKG_UPDATES_DIR) if entry.isdigit()), key=int)
+        except OSError: updates = []
+        try:
+            for path in [self.DPKG_STATUS_FILE] + [os.path.join(self.DPKG_UPDATES_DIR, entry) for entry in updates]:
+                with open(path, "r", encoding="utf-8", errors="replace") as f: self._apply_dpkg_records(f, packages)
+        except OSError as e:
+            logger.warning(f"Nie można odczytać bazy dpkg: {e}")
+            return None
+        return packages
+
+    @staticmethod
+    def _apply_dpkg_records(lines, packages: Dict[str, str]):
+        name = status = version = None
+        for line in lines:
+            if line.startswith("Package: "): name = line[9:].strip()
+            elif line.startswith("Status: "): status = line[8:].strip()
+            elif line.startswith("Version: "): version = line[9:].strip()
+            elif not line.strip(): # Koniec rekordu
+                if name and status: # Pakiety multiarch (libc6:amd64, libc6:i386) mają wspólny wpis
+                    if status.endswith(" installed"): packages[name] = version or ""
+                    else: packages.pop(name, None)
+                name = status = version = None
+        if name and status:
+            if status.endswith(" installed"): packages[name] = version or ""
+            else: packages.pop(name, None)
+
+    def _read_pacman(self) -> Optional[Dict[str, str]]:
+        # Przyrostowo: nowe katalogi są dodawane, zniknięte usuwane, reszta zostaje z poprzedniego odczytu
+        try: entries = set(os.listdir(self.PACMAN_LOCAL_DIR))
+        except OSError as e:
+            logger.warning(f"Nie można odczytać bazy pacman: {e}")
+            return None
+        for entry in set(self._pacman_entries) - entries: del self._pacman_entries[entry]
+        for entry in entries - set(self._pacman_entries):
+            parts = entry.rsplit("-", 2) # Nazwa może zawierać "-", wersja i wydanie - nie
+            if len(parts) == 3: self._pacman_entries[entry] = (parts[0], f"{parts[1]}-{parts[2]}")
+        return dict(self._pacman_entries.values())
+
+    def _read_rpm(self) -> Optional[Dict[str, str]]:
+        try:
+            output = subprocess.run(["rpm", "-qa", "--qf", "%{NAME}\\t%{VERSION}-%{RELEASE}\\n"], capture_output=True,
+                                    text=True, timeout=RPM_QUERY_TIMEOUT, check=True).stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Nie można odczytać bazy rpm: {e}")
+            return None
+        return dict(line.split("\t", 1) for line in output.splitlines() if "\t" in line)
+
+    def packages(self) -> Dict[str, str]:
+        self.refresh()
+        return self._packages
+
+    def version(self, name: str) -> Optional[str]:
+        # None - pakiet nie jest zainstalowany
+        return self.packages().get(name)
+
+    def similar(self, name: str, limit: int = 5) -> List[Tuple[str, str]]:
+        # Zainstalowane pakiety z tą nazwą jako członem (docker -> docker-ce, docker.io; python -> python3)
+        name = name.lower()
+        pattern = re.compile(rf"(?:^|[-.+_]){re.escape(name)}(?:$|[-.+_0-9])")
+        matches = sorted((package, version) for package, version in self.packages().items()
+                         if package != name and pattern.search(package.lower()))
+        return sorted(matches, key=lambda item: (not item[0].lower().startswith(name), len(item[0])))[:limit]
@@ -0,0 +1,234 @@
+# Plik: src/modules/persistent_shell.py
+
+import os
+import subprocess
+import shlex
+import signal
+import logging
+import selectors
+import threading
+import uuid
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    from .resource_limits import ResourceLimits
+    from .process_control import TimeoutEscalation, TERMINATION_GRACE_PERIOD, track_process_group
+except ImportError: # Import płaski (backend_cli.py dodaje src/modules do sys.path)
+    from resource_limits import ResourceLimits
+    from process_control import TimeoutEscalation, TERMINATION_GRACE_PERIOD, track_process_group
+
+logger = logging.getLogger("persistent_shell")
+
+# Znaczniki końca polecenia (separator rekordów \x1e nie występuje w normalnym wyjściu tekstowym)
+MARKER_SEPARATOR = b"\x1e"
+
+
+class PersistentShell:
+    # Jeden długo działający proces bash na sesję. Polecenia trafiają na jego stdin, a koniec każdego z nich
+    # oznaczany jest znacznikiem z kodem wyjścia i $PWD - bez nowego procesu bash i bez ponownego `&& pwd`.
+    # Zmienne (export), aliasy i `cd` w poleceniach złożonych zostają w powłoce między poleceniami.
+    READ_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, initial_working_dir: Optional[str] = None, shell_path: str = "/bin/bash",
+                 resource_limits: Optional[ResourceLimits] = None):
+        self.shell_path = shell_path
+        self.resource_limits = resource_limits # Rlimity ustawiane powłoce dziedziczą polecenia; zakres cgroup obejmuje całą powłokę
+        self.process: Optional[subprocess.Popen] = None
+        self.last_return_code: Optional[int] = None
+        self.last_working_dir = os.path.abspath(initial_working_dir or os.getcwd())
+        self.last_resource_usage: Dict[str, float] = {}
+        self.last_timed_out = False
+        self.last_cancelled = False
+        self._escalation: Optional[TimeoutEscalation] = None # Eskalacja wykonywanego polecenia (dla cancel())
+        self._lock = threading.Lock()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        program, argv, preexec_fn = self.shell_path, [self.shell_path, "--noprofile", "--norc"], None
+        if self.resource_limits and self.resource_limits.is_set():
+            program, argv = self.resource_limits.wrap_argv(program, argv)
+            preexec_fn = self.resource_limits.preexec_fn()
+        self.process = subprocess.Popen(
+            argv, executable=program, cwd=self.last_working_dir, env=os.environ.copy(),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=preexec_fn,
+            start_new_session=True # Własna grupa procesów - przy przekroczeniu czasu zabijamy całą
+        )
+        track_process_group(self.process.pid)
+        # Nieinteraktywny bash nie rozwija aliasów - bez tego `alias` z jednego polecenia nie działałby w kolejnych
+        self.process.stdin.write(b"shopt -s expand_aliases\n"); self.process.stdin.flush()
+        logger.info(f"Uruchomiono trwałą powłokę (PID: {self.process.pid}) w {self.last_working_dir}")
+
+    def close(self, force: bool = False):
+        # force=True zabija powłokę od razu (np. zamknięcie okna GUI), także gdy wykonuje polecenie w innym wątku
+        process, self.process = self.process, None
+        if process is None: return
+        try:
+            if force: self._kill(process)
+            elif process.poll() is None:
+                process.stdin.write(b"exit\n"); process.stdin.flush()
+                process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self._kill(process)
+        if self._lock.acquire(blocking=False): # Jeśli run() trwa w innym wątku, sam zamknie potoki po odczytaniu EOF
+            try: self._close_pipes(process)
+            finally: self._lock.release()
+
+    def cancel(self) -> bool:
+        # Przerwanie wykonywanego polecenia z innego wątku: SIGTERM, potem SIGKILL do jego procesów - sama powłoka
+        # (katalog roboczy, zmienne) działa dalej, chyba że polecenie nie skończy się nawet po SIGKILL (np. pętla
+        # wbudowanych poleceń bash) - wtedy jest uruchamiana od nowa. False - nic się nie wykonuje.
+        escalation = self._escalation
+        if escalation is None: return False
+        escalation.cancel(spare_leader=True)
+        return True
+
+    def _kill(self, process: subprocess.Popen):
+        try: os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError): pass
+        process.wait()
+
+    def _discard(self, process: subprocess.Popen):
+        # Wywoływane z run() (z założoną blokadą): proces kończy się, potoki są zamykane
+        self._kill(process)
+        self._close_pipes(process)
+        if self.process is process: self.process = None
+
+    @staticmethod
+    def _close_pipes(process: subprocess.Popen):
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            try: pipe.close()
+            except OSError: pass
+
+    @staticmethod
+    def _usage_counters(process: subprocess.Popen) -> Dict[str, float]:
+        # Liczniki powłoki razem z zebranymi przez nią potomkami: czas CPU (utime+cutime, stime+cstime z /proc/PID/stat)
+        # i bajty zapisane/odczytane z urządzeń blokowych (/proc/PID/io, w jednostkach 512 B jak ru_inblock/ru_oublock).
+        # Polecenia działają wewnątrz powłoki, więc os.wait4 nie ma tu zastosowania; maksymalnego RSS i przełączeń
+        # kontekstu potomków jądro nigdzie nie sumuje, więc tych pól brak. Różnica liczników przed i po to zużycie polecenia.
+        counters: Dict[str, float] = {}
+        try:
+            with open(f"/proc/{process.pid}/stat", "rb") as f:
+                fields = f.read().rpartition(b")")[2].split()
+        except OSError:
+            return counters
+        ticks = os.sysconf("SC_CLK_TCK")
+        counters["cpu_user_time"] = (int(fields[11]) + int(fields[13])) / ticks
+        counters["cpu_system_time"] = (int(fields[12]) + int(fields[14])) / ticks
+        try:
+            with open(f"/proc/{process.pid}/io", "rb") as f:
+                io_fields = dict(line.split(b": ") for line in f.read().splitlines())
+        except (OSError, ValueError): # Bez CONFIG_TASK_IO_ACCOUNTING albo bez uprawnień - tylko czas CPU
+            return counters
+        counters["block_input_ops"] = int(io_fields[b"read_bytes"]) // 512
+        counters["block_output_ops"] = (int(io_fields[b"write_bytes"]) - int(io_fields[b"cancelled_write_bytes"])) // 512
+        return counters
+
+    def _build_script(self, command: str, working_dir: str, token: str) -> bytes:
+        # stdin polecenia to /dev/null - inaczej czytałoby kolejne polecenia przeznaczone dla powłoki. `cd` tylko przy
+        # zmianie katalogu (inaczej nadpisałby OLDPWD dla `cd -`); gdy się nie uda, polecenie nie jest wykonywane -
+        # wynikiem jest błąd `cd` na stderr i jego kod wyjścia
+        quoted_dir = shlex.quote(working_dir)
+        return (f"if [ \"$PWD\" = {quoted_dir} ] || cd -- {quoted_dir}; then\n"
+                f"{{ eval {shlex.quote(command)}\n}} </dev/null\n"
+                f"__laa_rc=$?\nelse __laa_rc=$?; fi\n"
+                f"printf '\\036LAA:%s:%d:%s\\036' {token} \"$__laa_rc\" \"$PWD\"; printf '\\036LAA:%s\\036' {token} >&2\n"
+                ).encode("utf-8")
+
+    def run(self, command: str, working_dir: str, timeout: Optional[float] = None,
+            grace_period: float = TERMINATION_GRACE_PERIOD) -> Iterator[Tuple[str, bytes]]:
+        # Zwraca fragmenty (nazwa_strumienia, bajty); pusty fragment oznacza koniec strumienia.
+        # Po zakończeniu iteracji last_return_code, last_working_dir, last_resource_usage i last_timed_out opisują wykonane polecenie.
+        # Po przekroczeniu czasu grupa procesów powłoki dostaje SIGTERM, a po grace_period SIGKILL; powłoka jest uruchamiana od nowa.
+        # Po cancel() sygnały dostają tylko procesy polecenia (last_cancelled=True), powłoka zostaje.
+        with self._lock:
+            if not self.is_alive(): self.start()
+            process = self.process
+            token = uuid.uuid4().hex
+            usage_before = self._usage_counters(process) # Przed wysłaniem polecenia - powłoka czeka wtedy bezczynnie na stdin
+            self.last_resource_usage = {}
+            self.last_timed_out = self.last_cancelled = False
+            markers = {"stdout": MARKER_SEPARATOR + f"LAA:{token}:".encode(), "stderr": MARKER_SEPARATOR + f"LAA:{token}".encode() + MARKER_SEPARATOR}
+            try:
+                process.stdin.write(self._build_script(command, working_dir, token)); process.stdin.flush()
+            except BrokenPipeError: # Powłoka zakończyła się między poleceniami - uruchom nową i spróbuj raz jeszcze
+                self._discard(process); self.start(); process = self.process; usage_before = self._usage_counters(process)
+                process.stdin.write(self._build_script(command, working_dir, token)); process.stdin.flush()
+
+            escalation = TimeoutEscalation(process.pid, timeout, f"'{command}' (trwała powłoka)", grace_period)
+            self._escalation = escalation
+            buffers: Dict[str, bytearray] = {"stdout": bytearray(), "stderr": bytearray()}
+            pending = {"stdout", "stderr"}
+            shell_exited = abandoned = False
+            selector = selectors.DefaultSelector()
+            selector.register(process.stdout, selectors.EVENT_READ, "stdout")
+            selector.register(process.stderr, selectors.EVENT_READ, "stderr")
+            try:
+                while pending:
+                    if escalation.remaining() == 0:
+                        if escalation.expire(): continue
+                        abandoned = True
+                        break # Proces spoza grupy trzyma potoki albo polecenie działa w samej powłoce - kończymy bez znacznika
+                    for key, _ in selector.select(escalation.poll_timeout()):
+                        stream_name = key.data
+                        data = os.read(key.fd, self.READ_CHUNK_SIZE)
+                        if not data: # Powłoka zakończyła się w trakcie polecenia (np. `exit` w poleceniu)
+                            shell_exited = True
+                            selector.unregister(key.fileobj); pending.discard(stream_name)
+                            if buffers[stream_name]: yield stream_name, bytes(buffers[stream_name]); buffers[stream_name].clear()
+                            yield stream_name, b""
+                            continue
+                        buffer = buffers[stream_name]
+                        buffer.extend(data)
+                        output, finished = self._consume(stream_name, buffer, markers[stream_name])
+                        if output: yield stream_name, output
+                        if finished:
+                            selector.unregister(key.fileobj); pending.discard(stream_name)
+                            yield stream_name, b""
+                for stream_name in pending:
+                    if buffers[stream_name]: yield stream_name, bytes(buffers[stream_name])
+                    yield stream_name, b""
+            except BaseException: # Przerwana iteracja - stan powłoki jest nieznany
+                logger.warning(f"Przerwano polecenie '{command}' w trwałej powłoce (PID: {process.pid}); powłoka zostanie uruchomiona ponownie.")
+                self._discard(process)
+                raise
+            finally:
+                selector.close()
+                self._escalation = None
+
+            self.last_cancelled = escalation.cancelled
+            if not (shell_exited or abandoned or escalation.timed_out):
+                usage_after = self._usage_counters(process)
+                self.last_resource_usage = {name: usage_after[name] - before for name, before in usage_before.items() if name in usage_after}
+            if escalation.timed_out: # Stan powłoki po sygnałach jest nieznany - kolejne polecenie uruchomi nową
+                self._discard(process)
+                self.last_return_code, self.last_timed_out = process.returncode, True
+                logger.warning(f"Trwała powłoka (PID: {process.pid}) zakończona po przekroczeniu czasu przez '{command}'.")
+            elif abandoned: # Przerwane polecenie nie zakończyło się nawet po SIGKILL swoich procesów
+                self._discard(process)
+                self.last_return_code = process.returncode
+                logger.warning(f"Trwała powłoka (PID: {process.pid}) zakończona - przerwane polecenie '{command}' nie zakończyło się.")
+            elif shell_exited:
+                self.last_return_code = process.wait()
+                self._discard(process)
+                logger.info(f"Trwała powłoka zakończyła się (kod {self.last_return_code}); kolejne polecenie uruchomi nową.")
+
+    def _consume(self, stream_name: str, buffer: bytearray, marker: bytes) -> Tuple[bytes, bool]:
+        index = buffer.find(marker)
+        if index < 0:
+            # Zatrzymaj końcówkę, która może być początkiem znacznika rozciętego między odczytami
+            safe_length = max(len(buffer) - len(marker) + 1, 0)
+            output = bytes(buffer[:safe_length]); del buffer[:safe_length]
+            return output, False
+        if stream_name == "stdout":
+            end = buffer.find(MARKER_SEPARATOR, index + len(marker))
+            if end < 0: # Kod wyjścia i $PWD jeszcze nie dotarły w całości
+                output = bytes(buffer[:index]); del buffer[:index]
+                return output, False
+            status = buffer[index + len(marker):end].decode("utf-8", errors="replace")
+            return_code, _, working_dir = status.partition(":")
+            self.last_return_code = int(return_code)
+            self.last_working_dir = working_dir
+        output = bytes(buffer[:index]); buffer.clear()
+        return output, True
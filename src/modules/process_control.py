@@ -0,0 +1,158 @@
+# Plik: src/modules/process_control.py
+
+import os
+import signal
+import ctypes
+import logging
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+logger = logging.getLogger("process_control")
+
+# Kończenie poleceń po przekroczeniu czasu albo na żądanie (operacja 'cancel') i sprzątanie osieroconych wnuków.
+# Każde polecenie działa we własnej grupie procesów (start_new_session), więc sygnał trafia do całego drzewa:
+# najpierw SIGTERM, po TERMINATION_GRACE_PERIOD sekundach SIGKILL.
+TERMINATION_GRACE_PERIOD = 3.0
+KILL_DRAIN_PERIOD = 1.0 # Ile jeszcze czekać na EOF po SIGKILL (potok może trzymać proces spoza grupy)
+CANCEL_CHECK_INTERVAL = 0.2 # Najdłuższe oczekiwanie pętli odczytu - po tym czasie zauważa cancel() z innego wątku
+PR_SET_CHILD_SUBREAPER = 36
+TRACKED_GROUPS_KEPT = 256
+
+_subreaper_enabled = False
+_tracked_groups: deque = deque(maxlen=TRACKED_GROUPS_KEPT)
+_tracked_lock = threading.Lock()
+
+
+def signal_process_group(pgid: int, sig: int, spare_leader: bool = False) -> bool:
+    # spare_leader - sygnał do wszystkich procesów grupy oprócz lidera (trwała powłoka przeżywa przerwanie polecenia)
+    if spare_leader:
+        signalled = False
+        for pid in process_group_members(pgid):
+            if pid == pgid: continue
+            try: os.kill(pid, sig); signalled = True
+            except (ProcessLookupError, PermissionError): pass
+        return signalled
+    try:
+        os.killpg(pgid, sig)
+        return True
+    except (ProcessLookupError, PermissionError):
+        return False
+
+
+def process_group_members(pgid: int) -> List[int]:
+    pids: List[int] = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit(): continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f: fields = f.read().rpartition(b")")[2].split()
+        except OSError: continue
+        if int(fields[2]) == pgid and fields[0] != b"Z": pids.append(int(entry))
+    return pids
+
+
+def become_child_subreaper() -> bool:
+    # Osierocone wnuki (np. `polecenie &` po zakończeniu powłoki) trafiają do tego procesu zamiast do init,
+    # więc reap_orphans() może je zebrać. Włączane tylko w procesie backendu - GUI ma własne procesy potomne (QProcess).
+    global _subreaper_enabled
+    if _subreaper_enabled: return True
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    except (OSError, AttributeError) as e:
+        logger.warning(f"Nie można ustawić PR_SET_CHILD_SUBREAPER: {e}")
+        return False
+    _subreaper_enabled = True
+    logger.info("Proces backendu zbiera osierocone procesy poleceń (child subreaper).")
+    return True
+
+
+def track_process_group(pgid: int):
+    # Grupy procesów utworzone dla poleceń - tylko ich osierocone procesy zbiera reap_orphans()
+    with _tracked_lock: _tracked_groups.append(pgid)
+
+
+def _child_pids() -> List[int]:
+    pids: List[int] = []
+    try:
+        for task in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{task}/children") as f: pids.extend(int(pid) for pid in f.read().split())
+    except OSError: # Jądro bez CONFIG_PROC_CHILDREN - pełne przejrzenie /proc
+        own_pid = str(os.getpid())
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit(): continue
+            try:
+                with open(f"/proc/{entry}/stat", "rb") as f: fields = f.read().rpartition(b")")[2].split()
+            except OSError: continue
+            if fields[1].decode() == own_pid: pids.append(int(entry))
+    return pids
+
+
+def reap_orphans() -> int:
+    # Zbiera zombie przejęte jako subreaper. Liderzy grup (pid == pgid) to procesy uruchomione przez executor
+    # i czekają na nich ich właściciele (Popen/asyncio) - tych nie ruszamy, tak samo jak procesów spoza grup poleceń.
+    if not _subreaper_enabled: return 0
+    with _tracked_lock: groups = set(_tracked_groups)
+    reaped = 0
+    for pid in _child_pids():
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f: fields = f.read().rpartition(b")")[2].split()
+        except OSError: continue
+        state, pgid = fields[0], int(fields[2])
+        if state != b"Z" or pid == pgid or pgid not in groups: continue
+        try:
+            if os.waitpid(pid, os.WNOHANG)[0]: reaped += 1
+        except ChildProcessError: pass
+    if reaped: logger.debug(f"Zebrano {reaped} osieroconych procesów poleceń.")
+    return reaped
+
+
+class TimeoutEscalation:
+    # Etapy po przekroczeniu czasu polecenia albo po cancel(): SIGTERM do grupy procesów, po okresie karencji SIGKILL,
+    # potem już tylko krótkie oczekiwanie na EOF. expire() wywołuje się po każdym upływie remaining();
+    # pętla odczytu czeka najwyżej poll_timeout(), więc cancel() z innego wątku działa bez budzenia jej.
+    def __init__(self, pgid: int, timeout: Optional[float], description: str, grace_period: float = TERMINATION_GRACE_PERIOD):
+        self.pgid = pgid
+        self.timeout = timeout
+        self.description = description
+        self.grace_period = grace_period
+        self.deadline = time.time() + timeout if timeout else None
+        self.timed_out = False
+        self.cancelled = False
+        self._spare_leader = False
+        self._stage = 0
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else max(self.deadline - time.time(), 0)
+
+    def poll_timeout(self) -> float:
+        remaining = self.remaining()
+        return CANCEL_CHECK_INTERVAL if remaining is None else min(remaining, CANCEL_CHECK_INTERVAL)
+
+    def cancel(self, spare_leader: bool = False):
+        # Przerwanie na żądanie: te same etapy co po przekroczeniu czasu, od razu. spare_leader - lider grupy
+        # (trwała powłoka) nie dostaje sygnałów, tylko uruchomione w niej procesy polecenia.
+        if self._stage > 0: return # Eskalacja już trwa
+        self.cancelled, self._spare_leader = True, spare_leader
+        self.deadline = time.time()
+
+    def expire(self) -> bool:
+        # False - wszystkie etapy wyczerpane, dalsze oczekiwanie nie ma sensu
+        if self._stage == 0:
+            if self.cancelled:
+                logger.info(f"Przerwanie polecenia {self.description} na żądanie - SIGTERM do grupy procesów {self.pgid}.")
+            else:
+                self.timed_out = True
+                logger.warning(f"Polecenie {self.description} przekroczyło limit czasu {self.timeout}s - SIGTERM do grupy procesów {self.pgid}.")
+            signal_process_group(self.pgid, signal.SIGTERM, self._spare_leader)
+            self.deadline = time.time() + self.grace_period
+        elif self._stage == 1:
+            if signal_process_group(self.pgid, signal.SIGKILL, self._spare_leader):
+                logger.warning(f"Grupa procesów {self.pgid} nie zakończyła się po {self.grace_period}s od SIGTERM - SIGKILL.")
+            self.deadline = time.time() + KILL_DRAIN_PERIOD
+        else:
+            return False
+        self._stage += 1
+        return True
@@ -0,0 +1,135 @@
+# Plik: src/modules/prompt_budget.py
+
+import os
+import math
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger("prompt_budget")
+
+# Budżet tokenów wejściowych promptu. Każda sekcja (reguły, kontekst dystrybucji, lista plików CWD, historia, wyniki
+# wyszukiwania...) ma szacowany koszt w tokenach i priorytet; gdy suma przekracza budżet, sekcje o najniższym
+# priorytecie są skracane jako pierwsze (listy - od końca albo od najstarszych pozycji, tekst - obcięciem).
+# Szacunek to liczba znaków / znaki_na_token; współczynnik jest kalibrowany z usage_metadata odpowiedzi API.
+DEFAULT_PROMPT_TOKEN_BUDGET = 6000
+PROMPT_TOKEN_BUDGET_ENV = "LAA_PROMPT_TOKEN_BUDGET" # Nadpisanie budżetu (liczba tokenów)
+DEFAULT_CHARS_PER_TOKEN = 3.5 # Polski tekst z poleceniami; angielski zwykle bliżej 4
+CALIBRATION_WEIGHT = 0.2 # Waga nowej próbki w średniej wykładniczej znaków na token
+MIN_CHARS_PER_TOKEN, MAX_CHARS_PER_TOKEN = 1.5, 8.0 # Odrzucenie próbek, które nie mogą być prawdziwe
+TRIMMED_TEXT_MARK = " ... (skrócono)"
+
+# Priorytety sekcji (wyższy - ważniejszy, skracany później); None w PromptSection.priority - sekcja nieskracalna
+PRIORITY_SEARCH_RESULTS = 50
+PRIORITY_SYSTEM_CONTEXT = 40
+PRIORITY_HISTORY = 30
+PRIORITY_CWD_FILES = 20
+
+
+@dataclass
+class PromptSection:
+    name: str
+    text: str = "" # Sekcja tekstowa
+    items: Optional[List[str]] = None # Sekcja-lista: prefix + pozycje rozdzielone separatorem
+    prefix: str = ""
+    separator: str = ", "
+    priority: Optional[int] = None
+    keep_last: bool = False # Przy skracaniu listy zostają ostatnie pozycje (historia), a nie pierwsze
+    min_items: int = 0
+
+    def render(self) -> str:
+        if self.items is None: return self.text
+        return f"{self.prefix}{self.separator.join(self.items)}" if self.items else ""
+
+
+@dataclass
+class BudgetAllocation:
+    sections: Dict[str, PromptSection] = field(default_factory=dict) # Po skróceniu
+    tokens: Dict[str, int] = field(default_factory=dict) # Szacunek po skróceniu
+    trimmed: Dict[str, int] = field(default_factory=dict) # Sekcja -> tokeny odjęte
+    budget: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.tokens.values())
+
+    def text(self, name: str) -> str:
+        section = self.sections.get(name)
+        return section.render() if section else ""
+
+
+def budget_from_environment(default: int = DEFAULT_PROMPT_TOKEN_BUDGET) -> int:
+    value = os.environ.get(PROMPT_TOKEN_BUDGET_ENV)
+    if not value: return default
+    try:
+        budget = int(value)
+        if budget > 0: return budget
+    except ValueError: pass
+    logger.warning(f"Niepoprawna wartość {PROMPT_TOKEN_BUDGET_ENV}='{value}', używam {default}.")
+    return default
+
+
+class PromptBudget:
+    # Jedna instancja na GeminiIntegration; calibrate() może być wołane z wielu wątków
+    def __init__(self, max_input_tokens: Optional[int] = None, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN):
+        self.max_input_tokens = max_input_tokens if max_input_tokens is not None else budget_from_environment()
+        self.chars_per_token = chars_per_token
+        self.calibration_samples = 0
+        self._lock = threading.Lock()
+
+    def estimate(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token) if text else 0
+
+    def calibrate(self, prompt_chars: int, prompt_tokens: Optional[int]):
+        # prompt_tokens - usage_metadata.prompt_token_count odpowiedzi na prompt o długości prompt_chars znaków
+        if not prompt_tokens or prompt_chars <= 0: return
+        sample = prompt_chars / prompt_tokens
+        if not MIN_CHARS_PER_TOKEN <= sample <= MAX_CHARS_PER_TOKEN: return
+        with self._lock:
+            weight = 1.0 if self.calibration_samples == 0 else CALIBRATION_WEIGHT # Pierwsza próbka zastępuje wartość domyślną
+            self.chars_per_token += weight * (sample - self.chars_per_token)
+            self.calibration_samples += 1
+        logger.debug(f"Kalibracja budżetu promptu: {prompt_chars} znaków = {prompt_tokens} tokenów, "
+                     f"średnio {self.chars_per_token:.2f} znaku na token")
+
+    def allocate(self, sections: Sequence[PromptSection], budget: Optional[int] = None) -> BudgetAllocation:
+        budget = budget if budget is not None else self.max_input_tokens
+        allocation = BudgetAllocation(sections={section.name: section for section in sections}, budget=budget)
+        allocation.tokens = {section.name: self.estimate(section.render()) for section in sections}
+        excess = allocation.total_tokens - budget
+        trimmable = sorted((section for section in sections if section.priority is not None), key=lambda section: section.priority)
+        for section in trimmable:
+            if excess <= 0: break
+            before = allocation.tokens[section.name]
+            trimmed = self._trim(section, max(before - excess, 0))
+            allocation.sections[section.name] = trimmed
+            allocation.tokens[section.name] = self.estimate(trimmed.render())
+            saved = before - allocation.tokens[section.name]
+            if saved > 0: allocation.trimmed[section.name] = saved
+            excess -= saved
+        if allocation.trimmed:
+            logger.info(f"Budżet promptu {budget} tokenów: skrócono {allocation.trimmed}, razem ~{allocation.total_tokens}")
+        return allocation
+
+    def _trim(self, section: PromptSection, max_tokens: int) -> PromptSection:
+        if section.items is None:
+            max_chars = int(max_tokens * self.chars_per_token) - len(TRIMMED_TEXT_MARK)
+            if max_chars <= 0: return PromptSection(section.name, priority=section.priority)
+            cut = section.text[:max_chars]
+            if " " in cut[max_chars // 2:]: cut = cut[:cut.rindex(" ")] # Bez urwanego słowa
+            return PromptSection(section.name, text=cut + TRIMMED_TEXT_MARK, priority=section.priority)
+        # Lista: zachowaj tyle pozycji, ile się mieści, z podsumowaniem liczby pominiętych
+        items = list(reversed(section.items)) if section.keep_last else list(section.items)
+        max_chars = max_tokens * self.chars_per_token - len(section.prefix)
+        kept: List[str] = []
+        used = 0
+        for item in items:
+            cost = len(item) + len(section.separator)
+            if len(kept) >= section.min_items and used + cost > max_chars - 24: break # Zapas na podsumowanie
+            kept.append(item); used += cost
+        omitted = len(items) - len(kept)
+        if section.keep_last: kept.reverse()
+        if omitted and not section.keep_last: kept.append(f"... (+{omitted} pominiętych)")
+        return PromptSection(section.name, items=kept, prefix=section.prefix, separator=section.separator,
+                             priority=section.priority, keep_last=section.keep_last, min_items=section.min_items)
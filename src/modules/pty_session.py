@@ -0,0 +1,398 @@
+# Plik: src/modules/pty_session.py
+
+import os
+import re
+import time
+import fcntl
+import codecs
+import select
+import signal
+import struct
+import termios
+import logging
+import threading
+import subprocess
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+try:
+    from .process_control import TERMINATION_GRACE_PERIOD, signal_process_group, track_process_group
+except ImportError: # Import płaski (backend_cli.py dodaje src/modules do sys.path)
+    from process_control import TERMINATION_GRACE_PERIOD, signal_process_group, track_process_group
+
+logger = logging.getLogger("pty_session")
+
+# Polecenia interaktywne (htop, vim, less, man...) w pseudoterminalu zamiast w osobnym emulatorze terminala.
+# Wyjście programu trafia do TerminalScreen (podzbiór VT100/xterm wystarczający dla ncurses), a do klienta idą tylko
+# zmienione wiersze ekranu, najwyżej raz na FRAME_INTERVAL sekund.
+DEFAULT_ROWS = 24
+DEFAULT_COLS = 80
+TERM_NAME = "xterm"
+FRAME_INTERVAL = 0.02
+READ_CHUNK_SIZE = 64 * 1024
+EXIT_POLL_INTERVAL = 0.25 # Jak często sprawdzać zakończenie procesu, gdy potomek w tle trzyma pseudoterminal otwarty
+MAX_PENDING_SEQUENCE = 512 # Niedokończona sekwencja sterująca dłuższa niż to jest porzucana
+
+# CSI (ESC [ ...), OSC (ESC ] ... BEL/ST), wybór zestawu znaków (ESC ( 0), pozostałe ESC x, znaki sterujące C0 poza ESC
+CONTROL_PATTERN = re.compile(
+    r"\x1b\[([<=>?]?)([0-9;:]*)[ -/]*([@-~])"
+    r"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"
+    r"|\x1b([()*+])(.)"
+    r"|\x1b[ -/]*([0-Z\\^-~])"
+    r"|([\x00-\x1a\x1c-\x1f\x7f])"
+)
+# Zestaw znaków graficznych DEC (ESC ( 0) - ramki ncurses
+DEC_GRAPHICS = str.maketrans("`abcdefghijklmnopqrstuvwxyz{|}~",
+                             "◆▒␉␌␍␊°±␤␋┘┐┌└┼⎺⎻─⎼⎽├┤┴┬│≤≥π≠£·")
+
+
+class TerminalScreen:
+    def __init__(self, rows: int = DEFAULT_ROWS, cols: int = DEFAULT_COLS):
+        self.rows, self.cols = rows, cols
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending = ""
+        self._lines = self._blank_lines(rows)
+        self._main_screen: Optional[Tuple[List[List[str]], Tuple[int, int]]] = None # Ekran główny na czas ekranu alternatywnego
+        self.cursor_row = self.cursor_col = 0
+        self._saved_cursor = (0, 0)
+        self._wrap_pending = False
+        self._scroll_top, self._scroll_bottom = 0, rows - 1
+        self._charsets = ["B", "B"] # G0, G1; "0" = grafika DEC
+        self._active_charset = 0
+        self._last_char = " "
+        self.cursor_visible = True
+        self.application_cursor_keys = False # DECCKM: klawisze strzałek jako ESC O x zamiast ESC [ x
+        self.responses: List[str] = [] # Odpowiedzi na zapytania programu (pozycja kursora, atrybuty urządzenia)
+        self._dirty: Set[int] = set(range(rows))
+        self._reported_state: Optional[Tuple[Any, ...]] = None
+
+    def _blank_lines(self, count: int) -> List[List[str]]:
+        return [[" "] * self.cols for _ in range(count)]
+
+    def feed(self, data: bytes):
+        text = self._pending + self._decoder.decode(data)
+        self._pending = ""
+        position = 0
+        for match in CONTROL_PATTERN.finditer(text):
+            if match.start() > position: self._draw(text[position:match.start()])
+            self._control(match)
+            position = match.end()
+        rest = text[position:]
+        escape_at = rest.find("\x1b")
+        if escape_at >= 0 and len(rest) - escape_at < MAX_PENDING_SEQUENCE: # Sekwencja urwana na granicy odczytu
+            rest, self._pending = rest[:escape_at], rest[escape_at:]
+        if rest: self._draw(rest)
+
+    def _draw(self, text: str):
+        text = text.replace("\x1b", "") # Nierozpoznane sekwencje - bez śmieci na ekranie
+        if self._charsets[self._active_charset] == "0": text = text.translate(DEC_GRAPHICS)
+        while text:
+            if self._wrap_pending:
+                self.cursor_col = 0; self._linefeed()
+            line = self._lines[self.cursor_row]
+            chunk, text = text[:self.cols - self.cursor_col], text[self.cols - self.cursor_col:]
+            line[self.cursor_col:self.cursor_col + len(chunk)] = chunk
+            self._dirty.add(self.cursor_row)
+            self._last_char = chunk[-1]
+            self.cursor_col += len(chunk)
+            if self.cursor_col >= self.cols:
+                self.cursor_col, self._wrap_pending = self.cols - 1, True
+
+    def _control(self, match: "re.Match"):
+        csi_private, csi_params, csi_final, charset_slot, charset, esc_final, c0 = match.groups()
+        if c0 is not None: self._execute_c0(c0)
+        elif csi_final is not None: self._execute_csi(csi_private, [int(p) if p else 0 for p in re.split("[;:]", csi_params)], csi_final)
+        elif charset_slot is not None:
+            if charset_slot in "()": self._charsets["()".index(charset_slot)] = charset
+        elif esc_final is not None: self._execute_esc(esc_final)
+        # OSC (tytuł okna itp.) jest pomijane
+
+    def _execute_c0(self, char: str):
+        if char == "\r": self.cursor_col, self._wrap_pending = 0, False
+        elif char in "\n\x0b\x0c": self._linefeed()
+        elif char == "\x08":
+            self.cursor_col, self._wrap_pending = max(self.cursor_col - 1, 0), False
+        elif char == "\t": self.cursor_col = min((self.cursor_col // 8 + 1) * 8, self.cols - 1)
+        elif char == "\x0e": self._active_charset = 1
+        elif char == "\x0f": self._active_charset = 0
+        # BEL i pozostałe znaki sterujące - bez efektu na ekranie
+
+    def _execute_esc(self, final: str):
+        if final == "7": self._saved_cursor = (self.cursor_row, self.cursor_col)
+        elif final == "8": self._move_to(*self._saved_cursor)
+        elif final == "D": self._linefeed()
+        elif final == "E": self.cursor_col = 0; self._linefeed()
+        elif final == "M": self._reverse_index()
+        elif final == "c": self.__init__(self.rows, self.cols)
+        # ESC = / ESC > (tryb klawiatury numerycznej) i inne - ignorowane
+
+    def _execute_csi(self, private: str, params: List[int], final: str):
+        first = params[0]
+        count = first or 1
+        if private == "?":
+            if final in "hl": self._set_private_modes(params, final == "h")
+            return
+        if private: return # ESC [ > c itp. - zapytania, na które nie odpowiadamy
+        if final == "m": return # Atrybuty znaków (kolory) nie są przenoszone do klienta
+        if final in "Hf": self._move_to(count - 1, (params[1] if len(params) > 1 and params[1] else 1) - 1)
+        elif final == "A": self._move_to(max(self.cursor_row - count, self._scroll_top if self.cursor_row >= self._scroll_top else 0), self.cursor_col)
+        elif final in "Be": self._move_to(min(self.cursor_row + count, self._scroll_bottom if self.cursor_row <= self._scroll_bottom else self.rows - 1), self.cursor_col)
+        elif final in "Ca": self._move_to(self.cursor_row, self.cursor_col + count)
+        elif final == "D": self._move_to(self.cursor_row, self.cursor_col - count)
+        elif final == "E": self._move_to(self.cursor_row + count, 0)
+        elif final == "F": self._move_to(self.cursor_row - count, 0)
+        elif final in "G`": self._move_to(self.cursor_row, count - 1)
+        elif final == "d": self._move_to(count - 1, self.cursor_col)
+        elif final == "J": self._erase_display(first)
+        elif final == "K": self._erase_line(first)
+        elif final == "X": self._fill(self.cursor_row, self.cursor_col, self.cursor_col + count)
+        elif final == "@": self._shift_line(count, insert=True)
+        elif final == "P": self._shift_line(count, insert=False)
+        elif final == "L": self._insert_lines(count)
+        elif final == "M": self._delete_lines(count)
+        elif final == "S": self._scroll_up(count)
+        elif final == "T": self._scroll_down(count)
+        elif final == "b": self._draw(self._last_char * count)
+        elif final == "r":
+            top, bottom = (first or 1) - 1, (params[1] if len(params) > 1 and params[1] else self.rows) - 1
+            if 0 <= top < bottom < self.rows:
+                self._scroll_top, self._scroll_bottom = top, bottom
+                self._move_to(0, 0)
+        elif final == "s": self._saved_cursor = (self.cursor_row, self.cursor_col)
+        elif final == "u": self._move_to(*self._saved_cursor)
+        elif final == "n":
+            if first == 6: self.responses.append(f"\x1b[{self.cursor_row + 1};{self.cursor_col + 1}R")
+            elif first == 5: self.responses.append("\x1b[0n")
+        elif final == "c" and first == 0: self.responses.append("\x1b[?1;2c") # VT100 z AVO
+
+    def _set_private_modes(self, modes: List[int], enabled: bool):
+        for mode in modes:
+            if mode == 1: self.application_cursor_keys = enabled
+            elif mode == 25: self.cursor_visible = enabled
+            elif mode in (47, 1047, 1049): self._switch_screen(alternate=enabled, save_cursor=(mode == 1049))
+
+    def _switch_screen(self, alternate: bool, save_cursor: bool):
+        if alternate == (self._main_screen is not None): return
+        if alternate:
+            self._main_screen = (self._lines, (self.cursor_row, self.cursor_col))
+            self._lines = self._blank_lines(self.rows)
+        else:
+            self._lines, cursor = self._main_screen
+            self._main_screen = None
+            if save_cursor: self._move_to(*cursor)
+        self._dirty.update(range(self.rows))
+
+    def _move_to(self, row: int, col: int):
+        self.cursor_row = min(max(row, 0), self.rows - 1)
+        self.cursor_col = min(max(col, 0), self.cols - 1)
+        self._wrap_pending = False
+
+    def _linefeed(self):
+        self._wrap_pending = False
+        if self.cursor_row == self._scroll_bottom: self._scroll_up(1)
+        elif self.cursor_row < self.rows - 1: self.cursor_row += 1
+
+    def _reverse_index(self):
+        if self.cursor_row == self._scroll_top: self._scroll_down(1)
+        elif self.cursor_row > 0: self.cursor_row -= 1
+
+    def _scroll_up(self, count: int, top: Optional[int] = None):
+        top = self._scroll_top if top is None else top
+        count = min(count, self._scroll_bottom - top + 1)
+        del self._lines[top:top + count]
+        self._lines[self._scroll_bottom + 1 - count:self._scroll_bottom + 1 - count] = self._blank_lines(count)
+        self._dirty.update(range(top, self._scroll_bottom + 1))
+
+    def _scroll_down(self, count: int, top: Optional[int] = None):
+        top = self._scroll_top if top is None else top
+        count = min(count, self._scroll_bottom - top + 1)
+        del self._lines[self._scroll_bottom + 1 - count:self._scroll_bottom + 1]
+        self._lines[top:top] = self._blank_lines(count)
+        self._dirty.update(range(top, self._scroll_bottom + 1))
+
+    def _insert_lines(self, count: int):
+        if self._scroll_top <= self.cursor_row <= self._scroll_bottom:
+            self._scroll_down(count, top=self.cursor_row); self.cursor_col = 0
+
+    def _delete_lines(self, count: int):
+        if self._scroll_top <= self.cursor_row <= self._scroll_bottom:
+            self._scroll_up(count, top=self.cursor_row); self.cursor_col = 0
+
+    def _fill(self, row: int, start: int, end: int):
+        start, end = max(start, 0), min(end, self.cols)
+        if start < end:
+            self._lines[row][start:end] = " " * (end - start)
+            self._dirty.add(row)
+
+    def _erase_line(self, mode: int):
+        if mode == 0: self._fill(self.cursor_row, self.cursor_col, self.cols)
+        elif mode == 1: self._fill(self.cursor_row, 0, self.cursor_col + 1)
+        else: self._fill(self.cursor_row, 0, self.cols)
+
+    def _erase_display(self, mode: int):
+        if mode == 0:
+            self._erase_line(0); rows = range(self.cursor_row + 1, self.rows)
+        elif mode == 1:
+            self._erase_line(1); rows = range(0, self.cursor_row)
+        else: rows = range(self.rows)
+        for row in rows: self._fill(row, 0, self.cols)
+
+    def _shift_line(self, count: int, insert: bool):
+        line = self._lines[self.cursor_row]
+        count = min(count, self.cols - self.cursor_col)
+        if insert: line[self.cursor_col:self.cursor_col] = " " * count; del line[self.cols:]
+        else: del line[self.cursor_col:self.cursor_col + count]; line.extend(" " * count)
+        self._dirty.add(self.cursor_row)
+
+    def resize(self, rows: int, cols: int):
+        def fit(lines: List[List[str]]) -> List[List[str]]:
+            lines = [(line + [" "] * (cols - len(line)))[:cols] for line in lines[-rows:]]
+            return lines + [[" "] * cols for _ in range(rows - len(lines))]
+        shift = max(self.rows - rows, 0) # Przy zmniejszeniu zachowaj dolną część ekranu (tam zwykle jest kursor)
+        self._lines = fit(self._lines)
+        if self._main_screen is not None:
+            self._main_screen = (fit(self._main_screen[0]), self._main_screen[1])
+        self.rows, self.cols = rows, cols
+        self._scroll_top, self._scroll_bottom = 0, rows - 1
+        self._move_to(self.cursor_row - shift, self.cursor_col)
+        self._dirty = set(range(rows))
+
+    def take_update(self, full: bool = False) -> Optional[Dict[str, Any]]:
+        # Zmienione wiersze od poprzedniego wywołania (albo cały ekran) i stan kursora; None, gdy nic się nie zmieniło
+        state = (self.cursor_row, self.cursor_col, self.cursor_visible, self.application_cursor_keys, self.rows, self.cols)
+        rows = range(self.rows) if full else sorted(self._dirty)
+        if not rows and state == self._reported_state: return None
+        self._dirty.clear()
+        self._reported_state = state
+        return {"rows": self.rows, "cols": self.cols, "lines": [[row, "".join(self._lines[row]).rstrip()] for row in rows],
+                "cursor": [self.cursor_row, self.cursor_col], "cursor_visible": self.cursor_visible,
+                "application_cursor_keys": self.application_cursor_keys}
+
+    def take_responses(self) -> str:
+        responses, self.responses = "".join(self.responses), []
+        return responses
+
+    def text(self) -> str:
+        return "\n".join("".join(line).rstrip() for line in self._lines).rstrip("\n")
+
+
+def set_window_size(fd: int, rows: int, cols: int):
+    # TIOCSWINSZ na pseudoterminalu - jądro wysyła SIGWINCH do pierwszoplanowej grupy procesów
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+
+
+class PtySession:
+    # Proces we własnej sesji z pseudoterminalem jako terminalem sterującym. Wątek czytający aktualizuje ekran
+    # i woła on_update(zmiany); po zakończeniu procesu on_finished(sesja) zbiera proces i zwraca wynik dla wait().
+    def __init__(self, rows: int = DEFAULT_ROWS, cols: int = DEFAULT_COLS,
+                 on_update: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 on_finished: Optional[Callable[["PtySession"], Any]] = None, frame_interval: float = FRAME_INTERVAL):
+        self.screen = TerminalScreen(rows, cols)
+        self.on_update = on_update
+        self.on_finished = on_finished
+        self.frame_interval = frame_interval
+        self.process: Optional[subprocess.Popen] = None
+        self.result: Any = None
+        self.master_fd: Optional[int] = None
+        self._lock = threading.Lock() # Ekran jest zmieniany przez wątek czytający i przez resize() z wątku żądań
+        self._finished = threading.Event()
+        self._reader: Optional[threading.Thread] = None
+
+    def start(self, program: str, argv: Sequence[str], cwd: str, env: Dict[str, str],
+              preexec_fn: Optional[Callable[[], None]] = None, pass_fds: Sequence[int] = ()) -> "PtySession":
+        master_fd, slave_fd = os.openpty()
+        try:
+            set_window_size(master_fd, self.screen.rows, self.screen.cols)
+
+            def child_setup():
+                fcntl.ioctl(0, termios.TIOCSCTTY, 0) # Po setsid (start_new_session) - pseudoterminal staje się terminalem sterującym
+                if preexec_fn: preexec_fn()
+            self.process = subprocess.Popen(list(argv), executable=program, cwd=cwd, env=dict(env, TERM=env.get("TERM") or TERM_NAME),
+                                            stdin=slave_fd, stdout=slave_fd, stderr=slave_fd, start_new_session=True,
+                                            preexec_fn=child_setup, pass_fds=tuple(pass_fds))
+        except BaseException:
+            os.close(master_fd); raise
+        finally:
+            os.close(slave_fd)
+        self.master_fd = master_fd
+        track_process_group(self.process.pid)
+        self._reader = threading.Thread(target=self._pump, name=f"laa-pty-{self.process.pid}", daemon=True)
+        self._reader.start()
+        return self
+
+    @property
+    def running(self) -> bool:
+        return not self._finished.is_set()
+
+    def write(self, data: bytes) -> bool:
+        # Klawisze od użytkownika; False, gdy pseudoterminal jest już zamknięty
+        master_fd = self.master_fd
+        if master_fd is None: return False
+        try:
+            while data:
+                written = os.write(master_fd, data)
+                data = data[written:]
+            return True
+        except OSError:
+            return False
+
+    def resize(self, rows: int, cols: int):
+        if rows < 1 or cols < 1: return
+        with self._lock:
+            if (rows, cols) == (self.screen.rows, self.screen.cols): return
+            self.screen.resize(rows, cols)
+            if self.master_fd is not None: set_window_size(self.master_fd, rows, cols)
+        self._emit_update()
+
+    def close(self, grace_period: float = TERMINATION_GRACE_PERIOD):
+        # Jak zamknięcie okna terminala: SIGHUP do grupy procesów, SIGKILL, jeśli po grace_period nadal działa
+        if self.process is None or not self.running: return
+        signal_process_group(self.process.pid, signal.SIGHUP)
+        signal_process_group(self.process.pid, signal.SIGCONT)
+        killer = threading.Timer(grace_period, lambda: self.running and signal_process_group(self.process.pid, signal.SIGKILL))
+        killer.daemon = True
+        killer.start()
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        if not self._finished.wait(timeout): raise subprocess.TimeoutExpired(self.process.args if self.process else "", timeout)
+        return self.result
+
+    def _emit_update(self, full: bool = False):
+        with self._lock: update = self.screen.take_update(full)
+        if update is None or not self.on_update: return
+        try: self.on_update(update)
+        except Exception as e: # Klient rozłączony - proces działa dalej, aż zostanie zamknięty
+            logger.debug(f"Nie można przekazać aktualizacji ekranu PID {self.process.pid}: {e}")
+
+    def _process_exited(self) -> bool:
+        # Bez zbierania procesu (WNOWAIT) - rusage odczyta on_finished przez wait4
+        try: return os.waitid(os.P_PID, self.process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+        except ChildProcessError: return True
+
+    def _pump(self):
+        frame_deadline: Optional[float] = None
+        try:
+            while True:
+                now = time.monotonic()
+                if frame_deadline is not None and now >= frame_deadline:
+                    self._emit_update(); frame_deadline = None
+                timeout = EXIT_POLL_INTERVAL if frame_deadline is None else frame_deadline - now
+                if not select.select([self.master_fd], [], [], timeout)[0]:
+                    if frame_deadline is None and self._process_exited(): break # Potomek w tle trzyma pseudoterminal
+                    continue
+                try: data = os.read(self.master_fd, READ_CHUNK_SIZE)
+                except OSError: data = b"" # EIO - wszystkie procesy zamknęły swoją stronę pseudoterminala
+                if not data: break
+                with self._lock:
+                    self.screen.feed(data)
+                    responses = self.screen.take_responses()
+                if responses: self.write(responses.encode("utf-8"))
+                if frame_deadline is None: frame_deadline = time.monotonic() + self.frame_interval
+            self._emit_update()
+        finally:
+            master_fd, self.master_fd = self.master_fd, None
+            os.close(master_fd)
+            try: self.result = self.on_finished(self) if self.on_finished else self.process.wait()
+            except Exception as e:
+                logger.error(f"Błąd kończenia sesji pseudoterminala PID {self.process.pid}: {e}", exc_info=True)
+            finally:
+                self._finished.set()
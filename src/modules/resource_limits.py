@@ -0,0 +1,133 @@
+# Plik: src/modules/resource_limits.py
+
+import os
+import re
+import shutil
+import signal
+import logging
+import resource
+import functools
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger("resource_limits")
+
+# Limity zasobów dla poleceń (zwłaszcza wygenerowanych przez AI): rlimity ustawiane w procesie potomnym przed exec
+# i opcjonalnie zakres cgroup v2 (systemd-run --user --scope), gdy jest dostępny.
+LIMIT_MEMORY = "memory"
+LIMIT_CPU = "cpu"
+LIMIT_PROCESSES = "processes"
+
+# Komunikaty, którymi programy zgłaszają brak pamięci przy RLIMIT_AS (jądro nie wysyła wtedy sygnału)
+MEMORY_FAILURE_MARKERS = ("Cannot allocate memory", "MemoryError", "memory exhausted", "std::bad_alloc")
+PROCESS_FAILURE_PATTERN = re.compile(r"fork: (retry: )?Resource temporarily unavailable") # fork() z EAGAIN przy RLIMIT_NPROC / pids.max
+CGROUP_SLICE = "laa-commands.slice" # Wspólny wycinek zakresów poleceń - jego memory.events przeżywa usunięcie zakresu (--collect)
+CPU_HARD_LIMIT_GRACE = 5 # Sekundy między SIGXCPU (limit miękki) a SIGKILL (twardy)
+
+
+@functools.lru_cache(maxsize=1)
+def cgroup_scope_available() -> bool:
+    # cgroup v2 (ujednolicona hierarchia) i menedżer systemd użytkownika osiągalny przez D-Bus
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "")
+    return bool(shutil.which("systemd-run") and os.path.exists("/sys/fs/cgroup/cgroup.controllers")
+                and (os.environ.get("DBUS_SESSION_BUS_ADDRESS") or (runtime_dir and os.path.exists(os.path.join(runtime_dir, "bus")))))
+
+
+def user_manager_cgroup() -> Optional[str]:
+    # Katalog cgroup menedżera systemd użytkownika (…/user@UID.service), pod którym systemd-run --user tworzy wycinki
+    try:
+        with open("/proc/self/cgroup") as cgroup_file:
+            for line in cgroup_file:
+                if not line.startswith("0::"): continue
+                parts = line[3:].strip().split("/")
+                for index, part in enumerate(parts):
+                    if part.startswith("user@") and part.endswith(".service"): return "/sys/fs/cgroup" + "/".join(parts[:index + 1])
+    except OSError: pass
+    return None
+
+
+@dataclass
+class ResourceLimits:
+    memory_mb: Optional[int] = None # RLIMIT_AS każdego procesu albo MemoryMax całego zakresu cgroup
+    cpu_seconds: Optional[int] = None # RLIMIT_CPU - czas CPU każdego procesu (SIGXCPU po przekroczeniu)
+    max_processes: Optional[int] = None # RLIMIT_NPROC liczy WSZYSTKIE procesy użytkownika; w cgroup - TasksMax zakresu
+    cpu_quota_percent: Optional[int] = None # Tylko cgroup: CPUQuota (np. 50 = pół rdzenia), polecenie jest dławione, nie przerywane
+    use_cgroup: bool = False
+
+    def is_set(self) -> bool:
+        return any(value is not None for value in (self.memory_mb, self.cpu_seconds, self.max_processes, self.cpu_quota_percent))
+
+    def cgroup_active(self) -> bool:
+        if not self.use_cgroup: return False
+        if cgroup_scope_available(): return True
+        logger.warning("Zakres cgroup v2 niedostępny (brak systemd-run, cgroup v2 lub sesji D-Bus) - używam tylko rlimitów.")
+        self.use_cgroup = False
+        return False
+
+    def describe(self, limit_name: str) -> str:
+        return {LIMIT_MEMORY: f"pamięć ({self.memory_mb} MB)", LIMIT_CPU: f"czas CPU ({self.cpu_seconds} s)",
+                LIMIT_PROCESSES: f"liczba procesów ({self.max_processes})"}[limit_name]
+
+    def preexec_fn(self) -> Optional[Callable[[], None]]:
+        # Wywoływane w procesie potomnym między fork a exec; rlimity dziedziczą wszyscy potomkowie polecenia
+        rlimits: List[Tuple[int, int, int]] = []
+        in_cgroup = self.cgroup_active()
+        if self.memory_mb is not None and not in_cgroup:
+            rlimits.append((resource.RLIMIT_AS, self.memory_mb * 1024 * 1024, self.memory_mb * 1024 * 1024))
+        if self.cpu_seconds is not None:
+            rlimits.append((resource.RLIMIT_CPU, self.cpu_seconds, self.cpu_seconds + CPU_HARD_LIMIT_GRACE))
+            rlimits.append((resource.RLIMIT_CORE, 0, 0)) # SIGXCPU domyślnie zrzuca rdzeń - bez plików core w katalogu roboczym
+        if self.max_processes is not None and not in_cgroup:
+            rlimits.append((resource.RLIMIT_NPROC, self.max_processes, self.max_processes))
+        if not rlimits: return None
+
+        def apply_rlimits():
+            for limit, soft, hard in rlimits:
+                current_soft, current_hard = resource.getrlimit(limit)
+                if current_hard != resource.RLIM_INFINITY: # Nie można podnieść limitu twardego bez uprawnień
+                    soft, hard = min(soft, current_hard), min(hard, current_hard)
+                resource.setrlimit(limit, (soft, hard))
+        return apply_rlimits
+
+    def wrap_argv(self, program: str, argv: List[str]) -> Tuple[str, List[str]]:
+        # W zakresie cgroup polecenie uruchamia systemd-run --scope (exec w tym samym procesie - PID i rusage bez zmian)
+        if not self.cgroup_active(): return program, argv
+        properties = []
+        if self.memory_mb is not None: properties += [f"MemoryMax={self.memory_mb}M", "MemorySwapMax=0"]
+        if self.max_processes is not None: properties.append(f"TasksMax={self.max_processes}")
+        if self.cpu_quota_percent is not None: properties.append(f"CPUQuota={self.cpu_quota_percent}%")
+        systemd_run = shutil.which("systemd-run")
+        wrapped = [systemd_run, "--user", "--scope", "--quiet", "--collect", f"--slice={CGROUP_SLICE}"]
+        for prop in properties: wrapped += ["-p", prop]
+        return systemd_run, wrapped + ["--", program] + argv[1:]
+
+    def oom_kill_count(self) -> Optional[int]:
+        # Licznik oom_kill wycinka poleceń (memory.events jest hierarchiczne - obejmuje usunięte już zakresy);
+        # None poza trybem cgroup albo gdy nie da się ustalić katalogu menedżera użytkownika
+        if not (self.memory_mb is not None and self.cgroup_active()): return None
+        manager_cgroup = user_manager_cgroup()
+        if manager_cgroup is None: return None
+        try:
+            with open(os.path.join(manager_cgroup, CGROUP_SLICE, "memory.events")) as events_file:
+                for line in events_file:
+                    name, _, value = line.partition(" ")
+                    if name == "oom_kill": return int(value)
+        except (OSError, ValueError): pass
+        return 0 # Wycinek jeszcze nie istnieje - żadne polecenie nie zostało w nim zabite
+
+    def detect_exceeded(self, return_code: int, stderr: str, cpu_time: Optional[float],
+                        oom_kills: Optional[int] = None) -> Tuple[str, ...]:
+        # Które limity zakończyły polecenie: sygnał (ujemny kod z Popen albo 128+N zgłoszone przez bash) lub komunikat programu.
+        # oom_kills - przyrost licznika oom_kill wycinka cgroup w trakcie polecenia (None poza trybem cgroup)
+        if return_code == 0 or not self.is_set(): return ()
+        killed_by = -return_code if return_code < 0 else (return_code - 128 if return_code > 128 else None)
+        exceeded = []
+        if self.cpu_seconds is not None and (killed_by == signal.SIGXCPU or (killed_by == signal.SIGKILL and cpu_time is not None and cpu_time >= self.cpu_seconds)):
+            exceeded.append(LIMIT_CPU)
+        if self.memory_mb is not None:
+            if oom_kills is not None: memory_hit = oom_kills > 0 # MemoryMax: jądro zabija bez komunikatu, liczy się tylko licznik
+            else: memory_hit = any(marker in stderr for marker in MEMORY_FAILURE_MARKERS)
+            if memory_hit: exceeded.append(LIMIT_MEMORY)
+        if self.max_processes is not None and PROCESS_FAILURE_PATTERN.search(stderr):
+            exceeded.append(LIMIT_PROCESSES)
+        return tuple(exceeded)
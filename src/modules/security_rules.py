@@ -0,0 +1,244 @@
+# Plik: src/modules/security_rules.py
+
+import os
+import re
+import bisect
+import json
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger("security_rules")
+
+# Reguły SecurityValidator: wbudowane listy wzorców plus opcjonalny pakiet reguł użytkownika (JSON), np.:
+# {"rules": [{"id": "apt-purge", "keyword": "apt purge", "severity": "confirm", "description": "..."},
+#            {"id": "curl-sudo", "pattern": "curl\\s+.*\\|\\s*sudo", "severity": "block"}],
+#  "disable": ["shutdown"],
+#  "distributions": {"arch": {"rules": [{"id": "pacman-rdd", "pattern": "pacman\\s+-R\\w*dd", "severity": "block"}]}}}
+# Reguła o istniejącym id zastępuje poprzednią (także wbudowaną - jej id to tekst wzorca). Sekcja "distributions"
+# działa dla ID albo ID_LIKE z /etc/os-release. Słowa kluczowe (wzorce bez znaków specjalnych re) dopasowuje jeden
+# automat Aho-Corasick, pozostałe wzorce - jedno skompilowane wyrażenie.
+DEFAULT_RULES_FILE = os.path.expanduser("~/.config/linux_ai_assistant/security_rules.json") # Obok config.json GUI
+RELOAD_CHECK_INTERVAL = 1.0 # Sekundy między sprawdzeniami mtime pliku reguł
+SEVERITY_BLOCK = "block" # Polecenie blokowane
+SEVERITY_CONFIRM = "confirm" # Wymaga potwierdzenia użytkownika
+SEVERITY_WARN = "warn" # Tylko zgłaszane
+SEVERITIES = (SEVERITY_BLOCK, SEVERITY_CONFIRM, SEVERITY_WARN)
+REGEX_SPECIAL_CHARS = ".^$*+?{}[]\\|()"
+# Konstrukcje, które działają we wzorcu osobno, ale nie po scaleniu w jedno wyrażenie RuleEngine: flagi globalne
+# "(?i)" (dozwolone tylko na początku całego wyrażenia), odwołania do grup (numeracja grup się przesuwa) i nazwane grupy
+MERGE_UNSAFE_SYNTAX = re.compile(r"\(\?[aiLmsux]+\)|\\[1-9]|\(\?P[<=]|\(\?<[A-Za-z_]|\(\?\(")
+
+
+class RulePackError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class SecurityRule:
+    id: str
+    pattern: str # Wyrażenie regularne albo, dla literal=True, dosłowne słowo kluczowe
+    severity: str = SEVERITY_CONFIRM
+    literal: bool = False
+    description: str = ""
+
+
+@dataclass(frozen=True) # Współdzielony przez pamięć werdyktów
+class ValidationReport:
+    dangerous_rules: Tuple[str, ...] = () # Id reguł "block" pasujących do polecenia (dla wbudowanych - wzorce z DANGEROUS_PATTERNS)
+    confirmation_rules: Tuple[str, ...] = () # Id reguł "confirm" (wbudowane - CONFIRMATION_REQUIRED)
+    warning_rules: Tuple[str, ...] = () # Id reguł "warn"
+
+    @property
+    def is_safe(self) -> bool:
+        return not self.dangerous_rules
+
+
+def builtin_rules(dangerous_patterns: Sequence[str], confirmation_patterns: Sequence[str]) -> List[SecurityRule]:
+    return [SecurityRule(pattern, pattern, severity, literal=re.escape(pattern) == pattern)
+            for patterns, severity in ((dangerous_patterns, SEVERITY_BLOCK), (confirmation_patterns, SEVERITY_CONFIRM))
+            for pattern in patterns]
+
+
+def _rule_from_entry(entry: Any) -> SecurityRule:
+    if not isinstance(entry, dict) or not isinstance(entry.get("id"), str): raise RulePackError(f"Reguła bez id: {entry!r}")
+    severity = entry.get("severity", SEVERITY_CONFIRM)
+    if severity not in SEVERITIES: raise RulePackError(f"Reguła {entry['id']!r}: nieznany poziom {severity!r} (dozwolone: {', '.join(SEVERITIES)})")
+    if isinstance(entry.get("keyword"), str) and entry["keyword"]:
+        return SecurityRule(entry["id"], entry["keyword"], severity, True, str(entry.get("description", "")))
+    pattern = entry.get("pattern")
+    if not isinstance(pattern, str) or not pattern: raise RulePackError(f"Reguła {entry['id']!r}: brak 'pattern' albo 'keyword'")
+    try: re.compile(pattern)
+    except re.error as e: raise RulePackError(f"Reguła {entry['id']!r}: błędne wyrażenie: {e}")
+    if _merge_unsafe(pattern):
+        raise RulePackError(f"Reguła {entry['id']!r}: flagi globalne (np. (?i)), odwołania do grup i nazwane grupy nie są obsługiwane"
+                            " - użyj flag lokalnych (?i:...) i grup (?:...)")
+    return SecurityRule(entry["id"], pattern, severity, re.escape(pattern) == pattern, str(entry.get("description", "")))
+
+
+def _merge_unsafe(pattern: str) -> bool:
+    escaped = False
+    for index, char in enumerate(pattern):
+        if escaped: escaped = False; continue # Znak po ukośniku - we wzorcu "\\\\1" to dosłowny ukośnik i cyfra 1
+        if char == "\\": escaped = True
+        if char in "\\(" and MERGE_UNSAFE_SYNTAX.match(pattern, index): return True
+    return False
+
+
+def apply_rule_pack(rules: List[SecurityRule], pack: Dict[str, Any], distribution_ids: Iterable[str] = ()) -> List[SecurityRule]:
+    # Sekcja ogólna, potem sekcje pasujących dystrybucji (w kolejności ID, ID_LIKE...)
+    if not isinstance(pack, dict): raise RulePackError("Pakiet reguł musi być obiektem JSON")
+    distributions = pack.get("distributions") or {}
+    sections = [pack] + [distributions[distribution_id] for distribution_id in distribution_ids
+                         if isinstance(distributions, dict) and isinstance(distributions.get(distribution_id), dict)]
+    result = list(rules)
+    for section in sections:
+        disabled = set(section.get("disable") or ())
+        added = [_rule_from_entry(entry) for entry in section.get("rules") or ()]
+        replaced = disabled | {rule.id for rule in added}
+        result = [rule for rule in result if rule.id not in replaced] + added
+    return result
+
+
+def load_rule_pack(path: str) -> Optional[Dict[str, Any]]:
+    # None - brak pliku; RulePackError - plik nieczytelny albo nie jest poprawnym JSON
+    try:
+        with open(path, "r", encoding="utf-8") as f: return json.load(f)
+    except FileNotFoundError: return None
+    except (OSError, ValueError) as e: raise RulePackError(f"Nie można wczytać pakietu reguł {path}: {e}")
+
+
+def rules_file_signature(path: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    if not path: return None
+    try: stat_result = os.stat(path)
+    except OSError: return None
+    return stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino
+
+
+class KeywordAutomaton:
+    # Automat Aho-Corasick dla słów kluczowych: wszystkie wystąpienia w jednym przejściu przez tekst
+    def __init__(self, keywords: Iterable[Tuple[str, int]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[Tuple[Tuple[int, int], ...]] = [()] # (długość słowa, wartość)
+        self._alphabet: Set[str] = set() # Znak spoza słów kluczowych przerywa każde częściowe dopasowanie
+        for keyword, value in keywords:
+            self._alphabet.update(keyword)
+            state = 0
+            for char in keyword:
+                if char not in self._goto[state]:
+                    self._goto.append({}); self._fail.append(0); self._outputs.append(())
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._outputs[state] += ((len(keyword), value),)
+        queue = deque(self._goto[0].values()) # Stany na głębokości 1 wracają do korzenia
+        while queue: # Przejścia awaryjne wszerz - stan awaryjny jest płytszy, więc już policzony
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]: fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._outputs[next_state] += self._outputs[self._fail[next_state]]
+
+    def __bool__(self) -> bool:
+        return len(self._goto) > 1
+
+    def find_all(self, text: str) -> Iterator[Tuple[int, int]]:
+        # (pozycja początku, wartość) dla każdego wystąpienia
+        goto, fail, outputs, alphabet = self._goto, self._fail, self._outputs, self._alphabet
+        state = 0
+        for index, char in enumerate(text):
+            if char not in alphabet:
+                state = 0
+                continue
+            while state and char not in goto[state]: state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in outputs[state]: yield index - length + 1, value
+
+
+def _has_literal_first_char(pattern: str) -> bool:
+    # Czy każde dopasowanie wzorca zaczyna się jego pierwszym znakiem: zwykły znak bez kwantyfikatora i brak "|"
+    # na najwyższym poziomie (np. "a|b" - druga gałąź zaczyna się od "b")
+    if not pattern or pattern[0] in REGEX_SPECIAL_CHARS or pattern[1:2] in ("*", "+", "?", "{"): return False
+    depth, escaped, in_class = 0, False, False
+    for char in pattern:
+        if escaped: escaped = False
+        elif char == "\\": escaped = True
+        elif in_class: in_class = char != "]"
+        elif char == "[": in_class = True
+        elif char == "(": depth += 1
+        elif char == ")": depth -= 1
+        elif char == "|" and depth == 0: return False
+    return True
+
+
+def _any_lookahead(entries: List[Tuple[str, str]]) -> str:
+    # Pusta grupa <nazwa> jest ustawiana, gdy jej wzorzec pasuje w tym miejscu; przynajmniej jeden musi pasować
+    if not entries: return ""
+    if len(entries) == 1: return f"(?=(?:{entries[0][1]}))(?P<{entries[0][0]}>)"
+    any_matched = "(?!)"
+    for name, _ in reversed(entries): any_matched = f"(?({name})|{any_matched})"
+    return "".join(f"(?:(?=(?:{pattern}))(?P<{name}>))?" for name, pattern in entries) + any_matched
+
+
+class RuleEngine:
+    # Skompilowany, niezmienny zestaw reguł - przeładowanie tworzy nowy obiekt, więc walidacja w toku
+    # zawsze widzi jeden spójny zestaw. Wzorce regex są kompilowane do jednego wyrażenia z nazwaną grupą na unikalny
+    # wzorzec; wzorce zaczynające się stałym znakiem są grupowane po tym znaku (gałąź "znak + opcjonalne lookaheady
+    # reszt"), dzięki czemu silnik re przeskakuje pozycje, od których nie zaczyna się żadna reguła. Wzorce bez stałego
+    # pierwszego znaku (np. "(wget|curl)...") trafiają do drugiego, małego wyrażenia.
+    def __init__(self, rules: Sequence[SecurityRule]):
+        self.rules = tuple(rules)
+        self.keywords = KeywordAutomaton((rule.pattern, index) for index, rule in enumerate(self.rules) if rule.literal)
+        groups: Dict[str, str] = {}
+        self._group_rules: Dict[str, List[int]] = {} # Nazwa grupy -> indeksy reguł o tym wzorcu
+        for index, rule in enumerate(self.rules):
+            if rule.literal: continue
+            name = groups.get(rule.pattern) or f"r{len(groups)}"
+            groups[rule.pattern] = name
+            self._group_rules.setdefault(name, []).append(index)
+        buckets: Dict[str, List[Tuple[str, str]]] = {}
+        other: List[Tuple[str, str]] = []
+        for pattern, name in groups.items():
+            if _has_literal_first_char(pattern): buckets.setdefault(pattern[0], []).append((name, pattern[1:]))
+            else: other.append((name, pattern))
+        branches = [re.escape(first) + _any_lookahead(entries) for first, entries in buckets.items()]
+        self.matchers = tuple(re.compile(expression) for expression in ("|".join(branches), _any_lookahead(other)) if expression)
+        # Dopasowany tekst (pierwszy znak, "" w drugim wyrażeniu) -> nazwy grup
+        self._buckets = {first: [name for name, _ in entries] for first, entries in buckets.items()}
+        self._buckets[""] = [name for name, _ in other]
+
+    def _matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        # (pozycja początku, indeks reguły) dla każdego dopasowania
+        if self.keywords: yield from self.keywords.find_all(text)
+        for matcher in self.matchers:
+            for match in matcher.finditer(text):
+                for name in self._buckets[match.group()]:
+                    if match.group(name) is not None:
+                        for index in self._group_rules[name]: yield match.start(), index
+
+    def scan(self, text: str) -> ValidationReport:
+        # Dopasowania w dowolnym miejscu tekstu
+        return self.report({index for _, index in self._matches(text)})
+
+    def scan_command(self, raw: str, text: str, data_spans: Sequence[Tuple[int, int]]) -> ValidationReport:
+        # Reguły "block" - w dowolnym miejscu surowego i znormalizowanego tekstu polecenia; "confirm" i "warn" - tylko
+        # w znormalizowanym tekście i nie od pozycji wewnątrz data_spans (posortowane zakresy argumentów-danych,
+        # np. tekstu w cudzysłowie po echo)
+        rules = self.rules
+        matched = {index for _, index in self._matches(raw) if rules[index].severity == SEVERITY_BLOCK}
+        span_starts = [start for start, _ in data_spans]
+        for start, index in self._matches(text):
+            if rules[index].severity != SEVERITY_BLOCK:
+                span = bisect.bisect_right(span_starts, start) - 1
+                if span >= 0 and start < data_spans[span][1]: continue
+            matched.add(index)
+        return self.report(matched)
+
+    def report(self, matched: Set[int]) -> ValidationReport:
+        if not matched: return ValidationReport()
+        by_severity: Dict[str, Dict[str, None]] = {severity: {} for severity in SEVERITIES} # Id bez powtórzeń, w kolejności reguł
+        for index in sorted(matched): by_severity[self.rules[index].severity][self.rules[index].id] = None
+        return ValidationReport(*(tuple(by_severity[severity]) for severity in SEVERITIES))
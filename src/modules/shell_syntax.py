@@ -0,0 +1,507 @@
+# Plik: src/modules/shell_syntax.py
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Union
+
+# Uproszczony parser składni bash na potrzeby walidacji bezpieczeństwa: listy (; & && || nowa linia), potoki,
+# podpowłoki ( ) i grupy { }, definicje funkcji, przekierowania (treść heredoc i here-string jako dane wejściowe
+# polecenia), podstawienia $(...), `...`, <(...), >(...) oraz usuwanie cudzysłowów. Rozwinięć (zmienne, globy)
+# nie wykonuje - zostają w słowach dosłownie.
+# Konstrukcji, których nie obsługuje (np. case ... esac), nie zgaduje - zgłasza ShellSyntaxError.
+
+OPERATORS = ("&>>", "<<<", "<<-", "&&", "||", ";;", "|&", "&>", "<<", ">>", ">&", "<&", "<>", ">|",
+             ";", "&", "|", "(", ")", "<", ">", "\n")
+REDIRECTION_OPERATORS = frozenset(["<", ">", ">>", "<<", "<<-", "<<<", "<>", ">|", ">&", "<&", "&>", "&>>"])
+LIST_OPERATORS = frozenset([";", "&", "&&", "||", "\n"])
+PIPE_OPERATORS = frozenset(["|", "|&"])
+WORD_TERMINATORS = frozenset(" \t\n;&|()<>")
+OPERATOR_CHARS = frozenset(";&|()<>\n")
+PLAIN_CHARS = re.compile(r"[^ \t\n;&|()<>\\'\"$`]+") # Fragment słowa bez cudzysłowów, podstawień i ukośników
+FD_PREFIX = re.compile(r"\d+(?=[<>])") # 2>plik, 2>&1
+ASSIGNMENT = re.compile(r"[A-Za-z_][A-Za-z0-9_]*\+?=")
+ANSI_C_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "e": "\x1b", "a": "\a", "b": "\b", "f": "\f", "v": "\v", "0": "\0"}
+
+# Słowa, po których kolejne słowa też mogą być poleceniem (sudo rm ..., env X=1 rm ..., if rm ...; then rm ...)
+COMMAND_PREFIXES = frozenset([
+    "sudo", "doas", "pkexec", "runuser", "env", "nohup", "nice", "ionice", "chrt", "taskset", "time", "exec", "coproc",
+    "command", "builtin", "busybox", "xargs", "parallel", "timeout", "stdbuf", "setsid", "chroot", "unshare", "nsenter",
+    "systemd-run", "firejail", "fakeroot", "proxychains", "torsocks", "flock", "watch", "strace", "ltrace", "unbuffer",
+    "!", "if", "then", "else", "elif", "while", "until", "do",
+])
+# Programy wykonujące tekst podany po -c (jego treść jest parsowana jak osobne polecenie); eval - wszystkie argumenty
+COMMAND_STRING_PROGRAMS = frozenset(["sh", "bash", "dash", "zsh", "ksh", "su", "script"])
+# Programy wykonujące standardowe wejście jako skrypt: powłoki bez -c i bez pliku skryptu (echo ... | sh, bash <<< ...),
+# at/batch bez -f (echo "polecenie" | at now)
+STDIN_SCRIPT_PROGRAMS = frozenset(["sh", "bash", "dash", "zsh", "ksh", "su", "at", "batch"])
+SCHEDULER_PROGRAMS = frozenset(["at", "batch"])
+# Programy, których argumenty w cudzysłowie są tylko danymi (tekst, wzorzec, nazwa pliku) - reguły "confirm"/"warn" ich
+# nie sprawdzają. Argumenty wszystkich innych programów mogą być kodem (trap, alias, tmux new, xterm -e, systemctl...).
+INERT_ARGUMENT_PROGRAMS = frozenset(["echo", "printf", "grep", "egrep", "fgrep", "rg", "cat", "head", "tail", "wc", "less",
+                                     "more", "logger", "notify-send"])
+GIT_MESSAGE_OPTIONS = frozenset(["-m", "--message"]) # git commit -m '...', git tag -m '...'
+SSH_OPTIONS_WITH_ARGUMENT = frozenset("BbcDEeFIiJLlmOopQRSWw")
+
+
+class ShellSyntaxError(ValueError):
+    pass
+
+
+@dataclass
+class Token:
+    kind: str # "word" albo "op"
+    value: str # Słowo po usunięciu cudzysłowów; operator z ewentualnym numerem deskryptora (2>)
+    quoted: bool = False
+    substitutions: List["CommandList"] = field(default_factory=list)
+    heredoc: Optional[str] = None # Treść heredoc dla słowa-ogranicznika po << / <<-
+
+
+@dataclass
+class SimpleCommand:
+    words: List[str] = field(default_factory=list)
+    assignments: List[str] = field(default_factory=list)
+    quoted: List[bool] = field(default_factory=list) # Dla słów: czy zawierało cudzysłowy albo ukośniki
+    stdin: Optional[str] = None # Dane wejściowe z heredoc albo here-string (ostatnie takie przekierowanie)
+    redirections: List[Tuple[str, str]] = field(default_factory=list) # (operator, cel)
+    substitutions: List["CommandList"] = field(default_factory=list) # Podstawienia ze słów, przypisań i przekierowań
+
+
+@dataclass
+class Group:
+    body: "CommandList"
+    subshell: bool # ( ... ) albo { ...; }
+    redirections: List[Tuple[str, str]] = field(default_factory=list)
+
+
+@dataclass
+class FunctionDefinition:
+    name: str
+    body: "Node"
+
+
+@dataclass
+class Pipeline:
+    commands: List["Node"]
+    operators: List[str] = field(default_factory=list) # "|" albo "|&" między kolejnymi poleceniami
+
+
+@dataclass
+class CommandList:
+    items: List[Tuple[Pipeline, Optional[str]]] = field(default_factory=list) # (potok, następujący operator listy)
+
+
+Node = Union[SimpleCommand, Group, FunctionDefinition, Pipeline, CommandList]
+
+
+class _Lexer:
+    def __init__(self, text: str, pos: int = 0):
+        self.text = text
+        self.pos = pos
+        self.heredocs: List[Tuple[Token, bool]] = [] # (słowo-ogranicznik, <<- usuwa wiodące tabulatory)
+
+    def tokenize(self, nested: bool = False) -> List[Token]:
+        # nested - wnętrze $(...) albo <(...): kończy się na niesparowanym ")"
+        tokens: List[Token] = []
+        depth = 0
+        text = self.text
+        while True:
+            self._skip_blanks()
+            if self.pos >= len(text):
+                if nested: raise ShellSyntaxError("Brak zamykającego ')' podstawienia polecenia")
+                return tokens
+            char = text[self.pos]
+            if char == "#":
+                end = text.find("\n", self.pos)
+                self.pos = len(text) if end < 0 else end
+                continue
+            if char in "<>" and text.startswith("(", self.pos + 1):
+                tokens.append(self._word())
+                continue
+            fd_prefix = FD_PREFIX.match(text, self.pos) if char.isdigit() else None
+            operator = self._operator(fd_prefix.end() if fd_prefix else self.pos) if fd_prefix or char in OPERATOR_CHARS else None
+            if operator is None:
+                token = self._word()
+                if tokens and tokens[-1].kind == "op" and tokens[-1].value.lstrip("0123456789") in ("<<", "<<-"):
+                    self.heredocs.append((token, tokens[-1].value.endswith("-")))
+                tokens.append(token)
+                continue
+            self.pos = (fd_prefix.end() if fd_prefix else self.pos) + len(operator)
+            if operator == ")":
+                if nested and depth == 0: return tokens
+                depth -= 1
+            elif operator == "(": depth += 1
+            elif operator == "\n" and self.heredocs: self._skip_heredocs()
+            tokens.append(Token("op", (fd_prefix.group() if fd_prefix else "") + operator))
+
+    def _operator(self, pos: int) -> Optional[str]:
+        for operator in OPERATORS:
+            if self.text.startswith(operator, pos): return operator
+        return None
+
+    def _skip_blanks(self):
+        text = self.text
+        while self.pos < len(text):
+            if text[self.pos] in " \t": self.pos += 1
+            elif text.startswith("\\\n", self.pos): self.pos += 2 # Kontynuacja linii
+            else: break
+
+    def _skip_heredocs(self):
+        # Treść heredoc to dane, nie polecenia - zapamiętywana w słowie-ograniczniku i pomijana do linii z ogranicznikiem
+        text = self.text
+        for delimiter, strip_tabs in self.heredocs:
+            lines: List[str] = []
+            while self.pos < len(text):
+                end = text.find("\n", self.pos)
+                line = text[self.pos:] if end < 0 else text[self.pos:end]
+                self.pos = len(text) if end < 0 else end + 1
+                if strip_tabs: line = line.lstrip("\t")
+                if line == delimiter.value: break
+                lines.append(line)
+            delimiter.heredoc = "\n".join(lines)
+        self.heredocs = []
+
+    def _word(self) -> Token:
+        text = self.text
+        token = Token("word", "")
+        value: List[str] = []
+        while self.pos < len(text):
+            plain = PLAIN_CHARS.match(text, self.pos)
+            if plain:
+                value.append(plain.group())
+                self.pos = plain.end()
+                continue
+            char = text[self.pos]
+            if char in "<>" and text.startswith("(", self.pos + 1): # Podstawienie procesu <(...) / >(...)
+                start = self.pos
+                self.pos += 2
+                token.substitutions.append(self._substitution())
+                value.append(text[start:self.pos])
+            elif char in WORD_TERMINATORS:
+                break
+            elif char == "\\":
+                if text.startswith("\n", self.pos + 1): self.pos += 2; continue
+                value.append(text[self.pos + 1:self.pos + 2] or "\\")
+                self.pos += 2
+                token.quoted = True
+            elif char == "'":
+                end = text.find("'", self.pos + 1)
+                if end < 0: raise ShellSyntaxError("Niezamknięty apostrof")
+                value.append(text[self.pos + 1:end])
+                self.pos = end + 1
+                token.quoted = True
+            elif char == '"':
+                self._double_quoted(value, token)
+                token.quoted = True
+            elif char == "$":
+                self._dollar(value, token)
+            elif char == "`":
+                self._backtick(value, token)
+        token.value = "".join(value)
+        return token
+
+    def _double_quoted(self, value: List[str], token: Token):
+        text = self.text
+        self.pos += 1
+        while self.pos < len(text):
+            char = text[self.pos]
+            if char == '"':
+                self.pos += 1
+                return
+            if char == "\\":
+                escaped = text[self.pos + 1:self.pos + 2]
+                if escaped in ('"', "\\", "$", "`"): value.append(escaped)
+                elif escaped != "\n": value.append(char + escaped)
+                self.pos += 2
+            elif char == "$": self._dollar(value, token)
+            elif char == "`": self._backtick(value, token)
+            else:
+                value.append(char)
+                self.pos += 1
+        raise ShellSyntaxError("Niezamknięty cudzysłów")
+
+    def _dollar(self, value: List[str], token: Token):
+        text, start = self.text, self.pos
+        if text.startswith("$((", start): # Wyrażenie arytmetyczne - bez poleceń do sprawdzenia
+            self.pos = self._closing(start + 3, "(", ")", 2)
+        elif text.startswith("$(", start):
+            self.pos += 2
+            token.substitutions.append(self._substitution())
+        elif text.startswith("${", start):
+            self.pos = self._closing(start + 2, "{", "}", 1)
+        elif text.startswith("$'", start): # Napis ANSI-C: $'\n'
+            match = re.compile(r"((?:[^'\\]|\\.)*)'", re.S).match(text, start + 2)
+            if not match: raise ShellSyntaxError("Niezamknięty napis $'...'")
+            value.append(re.sub(r"\\(.)", lambda escape: ANSI_C_ESCAPES.get(escape.group(1), escape.group(1)), match.group(1), flags=re.S))
+            self.pos = match.end()
+            token.quoted = True
+            return
+        else:
+            self.pos += 1
+        value.append(text[start:self.pos])
+
+    def _closing(self, pos: int, opening: str, closing: str, count: int) -> int:
+        # Pozycja za `count` zamykającymi znakami na poziomie zagnieżdżenia 0 (bez analizy cudzysłowów wewnątrz)
+        depth = 0
+        text = self.text
+        while pos < len(text):
+            if text[pos] == opening: depth += 1
+            elif text[pos] == closing:
+                if depth == 0:
+                    if text.startswith(closing * count, pos): return pos + count
+                    raise ShellSyntaxError(f"Niezamknięte '{opening}'")
+                depth -= 1
+            pos += 1
+        raise ShellSyntaxError(f"Niezamknięte '{opening}'")
+
+    def _backtick(self, value: List[str], token: Token):
+        text, start = self.text, self.pos
+        inner: List[str] = []
+        self.pos += 1
+        while self.pos < len(text) and text[self.pos] != "`":
+            if text[self.pos] == "\\" and text[self.pos + 1:self.pos + 2] in ("`", "\\", "$"):
+                self.pos += 1
+            inner.append(text[self.pos])
+            self.pos += 1
+        if self.pos >= len(text): raise ShellSyntaxError("Niezamknięty '`'")
+        self.pos += 1
+        token.substitutions.append(parse("".join(inner)))
+        value.append(text[start:self.pos])
+
+    def _substitution(self) -> CommandList:
+        lexer = _Lexer(self.text, self.pos)
+        tokens = lexer.tokenize(nested=True)
+        self.pos = lexer.pos
+        return _Parser(tokens).parse()
+
+
+class _Parser:
+    def __init__(self, tokens: List[Token]):
+        self.tokens = tokens
+        self.index = 0
+
+    def _peek(self, offset: int = 0) -> Optional[Token]:
+        index = self.index + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def _is(self, token: Optional[Token], kind: str, value: str) -> bool:
+        return token is not None and token.kind == kind and token.value == value and not token.quoted
+
+    def _unexpected(self, token: Optional[Token]) -> ShellSyntaxError:
+        return ShellSyntaxError("Nieoczekiwany koniec polecenia" if token is None else f"Nieoczekiwany token {token.value!r}")
+
+    def parse(self) -> CommandList:
+        commands = self._list(None)
+        if self.index < len(self.tokens): raise self._unexpected(self._peek())
+        return commands
+
+    def _skip_newlines(self):
+        while self._is(self._peek(), "op", "\n"): self.index += 1
+
+    def _list(self, closer: Optional[Tuple[str, str]]) -> CommandList:
+        # closer - (rodzaj, wartość) tokenu kończącego grupę: ("op", ")") albo ("word", "}")
+        commands = CommandList()
+        while True:
+            self._skip_newlines()
+            token = self._peek()
+            if token is None or (closer and self._is(token, *closer)): return commands
+            pipeline = self._pipeline()
+            token = self._peek()
+            if token is not None and token.kind == "op" and token.value in LIST_OPERATORS:
+                self.index += 1
+                commands.items.append((pipeline, ";" if token.value == "\n" else token.value))
+            else:
+                commands.items.append((pipeline, None))
+                return commands
+
+    def _pipeline(self) -> Pipeline:
+        pipeline = Pipeline([self._command()])
+        while (token := self._peek()) is not None and token.kind == "op" and token.value in PIPE_OPERATORS:
+            self.index += 1
+            self._skip_newlines()
+            pipeline.operators.append(token.value)
+            pipeline.commands.append(self._command())
+        return pipeline
+
+    def _command(self) -> Node:
+        token = self._peek()
+        if self._is(token, "op", "("):
+            self.index += 1
+            return self._group(("op", ")"), True)
+        if self._is(token, "word", "{"):
+            self.index += 1
+            return self._group(("word", "}"), False)
+        if token is not None and token.kind == "word" and self._is(self._peek(1), "op", "(") and self._is(self._peek(2), "op", ")"):
+            self.index += 3
+            self._skip_newlines()
+            return FunctionDefinition(token.value, self._command())
+        return self._simple()
+
+    def _group(self, closer: Tuple[str, str], subshell: bool) -> Group:
+        body = self._list(closer)
+        if not self._is(self._peek(), *closer): raise self._unexpected(self._peek())
+        self.index += 1
+        group = Group(body, subshell)
+        while (token := self._peek()) is not None and token.kind == "op" and token.value.lstrip("0123456789") in REDIRECTION_OPERATORS:
+            group.redirections.append(self._redirection(SimpleCommand()))
+        return group
+
+    def _redirection(self, command: SimpleCommand) -> Tuple[str, str]:
+        operator = self.tokens[self.index].value
+        self.index += 1
+        target = self._peek()
+        if target is None or target.kind != "word": raise self._unexpected(target)
+        self.index += 1
+        command.substitutions.extend(target.substitutions)
+        base_operator = operator.lstrip("0123456789")
+        if base_operator == "<<<": command.stdin = target.value + "\n"
+        elif base_operator in ("<<", "<<-"): command.stdin = target.heredoc
+        return operator, target.value
+
+    def _simple(self) -> SimpleCommand:
+        command = SimpleCommand()
+        while (token := self._peek()) is not None:
+            if token.kind == "word":
+                if not command.words and ASSIGNMENT.match(token.value):
+                    command.assignments.append(token.value)
+                else:
+                    command.words.append(token.value)
+                    command.quoted.append(token.quoted)
+                command.substitutions.extend(token.substitutions)
+                self.index += 1
+            elif token.value.lstrip("0123456789") in REDIRECTION_OPERATORS:
+                command.redirections.append(self._redirection(command))
+            else:
+                break
+        if not (command.words or command.assignments or command.redirections): raise self._unexpected(token)
+        return command
+
+
+def parse(command: str) -> CommandList:
+    return _Parser(_Lexer(command).tokenize()).parse()
+
+
+def _program_name(word: str) -> str:
+    return os.path.basename(word).rstrip("0123456789.") or os.path.basename(word) # python3.12 -> python
+
+
+def _reads_script_from_stdin(words: List[str]) -> bool:
+    # Powłoka (także po sudo, env...) bez -c i bez pliku skryptu: sh, bash -s arg, sudo -u root bash, su - root
+    if not words or (os.path.basename(words[0]) not in COMMAND_PREFIXES and os.path.basename(words[0]) not in STDIN_SCRIPT_PROGRAMS):
+        return False
+    for index, word in enumerate(words):
+        name = os.path.basename(word)
+        if name not in STDIN_SCRIPT_PROGRAMS: continue
+        arguments = words[index + 1:]
+        if name in SCHEDULER_PROGRAMS: return not any(argument.startswith("-") and "f" in argument[1:] for argument in arguments)
+        if any(argument.startswith("-") and not argument.startswith("--") and "c" in argument[1:] for argument in arguments):
+            return False
+        return name == "su" or "-s" in arguments or all(argument.startswith("-") for argument in arguments)
+    return False
+
+
+def _pipe_output(command: Node) -> Optional[str]:
+    # Tekst, który polecenie przekazuje dalej potokiem, jeśli da się go ustalić bez wykonania: echo, printf, cat <<EOF
+    if not isinstance(command, SimpleCommand) or not command.words: return None
+    name, arguments = os.path.basename(command.words[0]), command.words[1:]
+    if name == "cat" and command.stdin is not None and all(argument == "-" for argument in arguments): return command.stdin
+    if name == "echo":
+        while arguments and re.fullmatch(r"-[neE]+", arguments[0]): arguments = arguments[1:]
+    elif name != "printf": return None
+    return " ".join(arguments).replace("\\n", "\n")
+
+
+class _Renderer:
+    def __init__(self):
+        self.parts: List[str] = []
+        self.length = 0
+        self.data_spans: List[Tuple[int, int]] = []
+        self.pending: List[CommandList] = [] # Podstawienia i skrypty - dopisywane na końcu jako osobne polecenia
+
+    def write(self, text: str, data: bool = False):
+        if data and text: self.data_spans.append((self.length, self.length + len(text)))
+        self.parts.append(text)
+        self.length += len(text)
+
+    def node(self, node: Node):
+        if isinstance(node, CommandList):
+            for index, (pipeline, operator) in enumerate(node.items):
+                if index: self.write(" ")
+                self.node(pipeline)
+                if operator: self.write(f" {operator}")
+        elif isinstance(node, Pipeline):
+            for index, command in enumerate(node.commands):
+                if index:
+                    self.write(f" {node.operators[index - 1]} ")
+                    # echo 'skrypt' | sh, cat <<EOF | sudo bash - wejście powłoki jest wykonywane
+                    script = _pipe_output(node.commands[index - 1])
+                    if script is not None and isinstance(command, SimpleCommand) and _reads_script_from_stdin(command.words):
+                        self.pending.append(parse(script))
+                self.node(command)
+        elif isinstance(node, Group):
+            self.write("( " if node.subshell else "{ ")
+            self.node(node.body)
+            self.write(" )" if node.subshell else " }")
+            self.redirections(node.redirections)
+        elif isinstance(node, FunctionDefinition):
+            self.write(f"{node.name}() ")
+            self.node(node.body)
+        else:
+            self.simple(node)
+
+    def simple(self, command: SimpleCommand):
+        # Argumenty w cudzysłowie są danymi tylko dla programów z INERT_ARGUMENT_PROGRAMS (echo "uruchom sudo") i dla
+        # komunikatu git -m; wartości przypisań (X="sudo reboot"; $X) są zawsze sprawdzane. Słowa po sudo, env, if...
+        # to kolejne polecenia.
+        for assignment in command.assignments: self.write(f"{assignment} ")
+        after_prefix = False
+        program = ""
+        for index, word in enumerate(command.words):
+            if index: self.write(" ")
+            is_command = index == 0 or after_prefix
+            if is_command: program = _program_name(word)
+            inert = program in INERT_ARGUMENT_PROGRAMS or (program == "git" and command.words[index - 1] in GIT_MESSAGE_OPTIONS)
+            self.write(word, data=command.quoted[index] and not is_command and inert)
+            name = os.path.basename(word)
+            if is_command and name in COMMAND_PREFIXES: after_prefix = True
+            if is_command and name == "eval": self.pending.append(parse(" ".join(command.words[index + 1:])))
+            if is_command and name in COMMAND_STRING_PROGRAMS: self.command_string(command.words[index + 1:])
+            if is_command and name == "ssh": self.remote_command(command.words[index + 1:])
+        if command.stdin is not None and _reads_script_from_stdin(command.words): self.pending.append(parse(command.stdin))
+        self.redirections(command.redirections)
+        self.pending.extend(command.substitutions)
+
+    def command_string(self, arguments: List[str]):
+        # bash -c 'skrypt', bash -lc 'skrypt', su -c 'polecenie' użytkownik, script -c 'polecenie'
+        for index, argument in enumerate(arguments):
+            if argument == "--" or not argument.startswith("-"): return
+            if "c" in argument[1:] and not argument.startswith("--"):
+                script = next((word for word in arguments[index + 1:] if not word.startswith("-")), None)
+                if script is not None: self.pending.append(parse(script))
+                return
+
+    def remote_command(self, arguments: List[str]):
+        # ssh [opcje] host polecenie... - polecenie wykonuje powłoka na zdalnym hoście
+        index = 0
+        while index < len(arguments) and arguments[index].startswith("-"):
+            if arguments[index] == "--":
+                index += 1
+                break
+            index += 2 if arguments[index][-1] in SSH_OPTIONS_WITH_ARGUMENT else 1
+        if index + 1 < len(arguments): self.pending.append(parse(" ".join(arguments[index + 1:])))
+
+    def redirections(self, redirections: List[Tuple[str, str]]):
+        for operator, target in redirections:
+            self.write(f" {operator} {target}")
+
+
+def command_text(tree: CommandList) -> Tuple[str, List[Tuple[int, int]]]:
+    # Znormalizowany tekst polecenia (bez cudzysłowów, pojedyncze spacje; podstawienia oraz skrypty z bash -c, ssh,
+    # heredoc/here-string/potoku do powłoki dopisane na końcu po " ; ") i posortowane zakresy (początek, koniec)
+    # argumentów-danych: słów w cudzysłowie po programach z INERT_ARGUMENT_PROGRAMS i komunikatów git commit -m.
+    renderer = _Renderer()
+    renderer.node(tree)
+    while renderer.pending:
+        renderer.write(" ; ")
+        renderer.node(renderer.pending.pop(0))
+    return "".join(renderer.parts), renderer.data_spans
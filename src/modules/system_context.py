@@ -0,0 +1,256 @@
+# Plik: src/modules/system_context.py
+
+import os
+import re
+import glob
+import pwd
+import time
+import logging
+import threading
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+try:
+    from .package_index import PackageIndex
+except ImportError: # Import płaski (backend_cli.py dodaje src/modules do sys.path)
+    from package_index import PackageIndex
+
+logger = logging.getLogger("system_context")
+
+# Kontekst systemu dla promptów AI, zbierany leniwie według kategorii: tylko kategorie, których dotyczy zapytanie
+# (słowa kluczowe), i tylko wtedy, gdy zmieniło się ich źródło (sygnatury plików/katalogów) albo minął TTL.
+# Zwykle zapytanie kosztuje więc kilka wywołań stat(), a nie ponowne czytanie baz pakietów.
+MAX_LISTED_NAMES = 40 # Najwięcej nazw (jednostek, pakietów) w opisie jednej kategorii
+QUERY_WORD = re.compile(r"[a-z0-9][a-z0-9.+_@-]*")
+
+
+def path_signature(path: str) -> Optional[Tuple[int, int]]:
+    # Dla katalogu mtime zmienia się przy dodaniu/usunięciu wpisu - wystarcza do wykrycia zmian listy plików
+    try: stat_result = os.stat(path)
+    except OSError: return None
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+def query_words(query: str) -> FrozenSet[str]:
+    return frozenset(QUERY_WORD.findall(query.lower()))
+
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f: return f.read().strip()
+    except OSError: return None
+
+
+def _limited(names: Sequence[str]) -> str:
+    listed = ", ".join(names[:MAX_LISTED_NAMES])
+    return f"{listed}, ... ({len(names)})" if len(names) > MAX_LISTED_NAMES else listed
+
+
+class ContextCategory:
+    # Kategoria kontekstu: collect() zbiera dane, describe() zamienia je na zdanie dla promptu. Dane są ważne,
+    # dopóki nie zmieni się sygnatura ścieżek z sources() i (jeśli ttl nie jest None) nie minie ttl sekund.
+    name = ""
+    keywords: "re.Pattern[str]" = re.compile(r"(?!)")
+    ttl: Optional[float] = None
+
+    def sources(self) -> Sequence[str]:
+        return ()
+
+    def is_relevant(self, query: str) -> bool:
+        return bool(self.keywords.search(query))
+
+    def collect(self) -> Any:
+        raise NotImplementedError
+
+    def describe(self, value: Any, query: str) -> str:
+        raise NotImplementedError
+
+
+class PackagesCategory(ContextCategory):
+    # Zainstalowane pakiety z PackageIndex (baza dpkg, pacman lub rpm); wspólny indeks z odpowiedziami lokalnymi
+    name = "packages"
+    keywords = re.compile(r"pakiet|zainstal|instal|wersj|version|package|\b(apt|apt-get|dpkg|dnf|yum|rpm|pacman|zypper)\b|"
+                          r"odinstal|uninstall|aktualiz|upgrade|update|czy\s+mam", re.IGNORECASE)
+
+    def __init__(self, index: Optional[PackageIndex] = None):
+        self.index = index if index is not None else PackageIndex()
+
+    def sources(self) -> Sequence[str]:
+        return self.index.sources()
+
+    def collect(self) -> Tuple[str, Dict[str, str]]:
+        packages = self.index.packages() # Najpierw odświeżenie - ustawia index.manager
+        return self.index.manager, packages
+
+    def describe(self, value: Tuple[str, Dict[str, str]], query: str) -> str:
+        manager, packages = value
+        if not manager: return ""
+        mentioned = sorted(f"{name} {packages[name]}" for name in query_words(query) if name in packages)
+        text = f"Zainstalowanych pakietów ({manager}): {len(packages)}."
+        if mentioned: text += f" Zainstalowane spośród wymienionych w zapytaniu: {_limited(mentioned)}."
+        return text
+
+
+class SystemdUnitsCategory(ContextCategory):
+    # Jednostki z katalogów systemd, włączone - według dowiązań w *.wants (bez systemctl i D-Bus)
+    name = "systemd_units"
+    keywords = re.compile(r"usług|serwis|service|systemd|systemctl|daemon|demon|\.(service|timer|socket)\b|"
+                          r"autostart|przy\s+starcie|boot|journalctl", re.IGNORECASE)
+    UNIT_DIRS = ("/etc/systemd/system", "/run/systemd/system", "/usr/lib/systemd/system", "/lib/systemd/system")
+    UNIT_SUFFIXES = (".service", ".timer", ".socket", ".mount", ".target", ".path")
+
+    def _wants_dirs(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.UNIT_DIRS[0], "*.wants")))
+
+    def sources(self) -> Sequence[str]:
+        return self.UNIT_DIRS + tuple(self._wants_dirs())
+
+    def collect(self) -> Tuple[FrozenSet[str], Tuple[str, ...]]:
+        units, seen_dirs = set(), set()
+        for unit_dir in self.UNIT_DIRS:
+            real_dir = os.path.realpath(unit_dir) # /lib -> /usr/lib w systemach z połączonym /usr
+            if real_dir in seen_dirs or not os.path.isdir(real_dir): continue
+            seen_dirs.add(real_dir)
+            units.update(entry for entry in os.listdir(real_dir) if entry.endswith(self.UNIT_SUFFIXES))
+        enabled = {entry for wants_dir in self._wants_dirs() for entry in os.listdir(wants_dir) if entry.endswith(self.UNIT_SUFFIXES)}
+        return frozenset(units), tuple(sorted(enabled))
+
+    def describe(self, value: Tuple[FrozenSet[str], Tuple[str, ...]], query: str) -> str:
+        units, enabled = value
+        if not units: return ""
+        words = query_words(query)
+        mentioned = sorted(unit for unit in units if unit in words or unit.rsplit(".", 1)[0] in words)
+        text = f"Włączone jednostki systemd: {_limited([unit for unit in enabled if not unit.endswith('.target')])}."
+        if mentioned: text += f" Jednostki pasujące do zapytania: {_limited(mentioned)}."
+        return text
+
+
+class BlockDevicesCategory(ContextCategory):
+    # Dyski i partycje z /sys/block, punkty montowania z /proc/self/mounts
+    name = "block_devices"
+    keywords = re.compile(r"dysk|partycj|disk|partition|mount|montow|usb|pendrive|\b(sd[a-z]\d*|nvme\w*|mmcblk\w*)\b|"
+                          r"lsblk|\bdf\b|format|miejsc|space|storage|\bfstab\b", re.IGNORECASE)
+    ttl = 5.0 # Montowania i nośniki wymienne zmieniają się bez śladu w plikach
+    SYS_BLOCK_DIR = "/sys/block"
+    MOUNTS_FILE = "/proc/self/mounts"
+    VIRTUAL_PREFIXES = ("loop", "ram", "zram", "dm-")
+
+    def collect(self) -> Tuple[Tuple[Tuple[str, int, bool, str, Tuple[str, ...]], ...], Tuple[Tuple[str, str, str], ...]]:
+        devices = []
+        try: names = sorted(os.listdir(self.SYS_BLOCK_DIR))
+        except OSError: names = []
+        for name in names:
+            if name.startswith(self.VIRTUAL_PREFIXES): continue
+            device_dir = os.path.join(self.SYS_BLOCK_DIR, name)
+            size = int(_read_text(os.path.join(device_dir, "size")) or 0) * 512 # W sektorach 512 B niezależnie od urządzenia
+            removable = _read_text(os.path.join(device_dir, "removable")) == "1"
+            model = _read_text(os.path.join(device_dir, "device", "model")) or ""
+            try: partitions = tuple(sorted(entry for entry in os.listdir(device_dir) if entry.startswith(name)))
+            except OSError: partitions = ()
+            devices.append((name, size, removable, model, partitions))
+        mounts = []
+        for line in (_read_text(self.MOUNTS_FILE) or "").splitlines():
+            fields = line.split()
+            if len(fields) >= 3 and fields[0].startswith("/dev/"):
+                mounts.append((fields[0], fields[1].replace("\\040", " "), fields[2]))
+        return tuple(devices), tuple(mounts)
+
+    def describe(self, value, query: str) -> str:
+        devices, mounts = value
+        if not devices and not mounts: return ""
+        described = [f"{name} {size / 1e9:.0f} GB{' ' + model if model else ''}{' (wymienny)' if removable else ''}"
+                     f"{' [' + ', '.join(partitions) + ']' if partitions else ''}" for name, size, removable, model, partitions in devices]
+        text = f"Urządzenia blokowe: {_limited(described)}." if described else ""
+        if mounts: text += f" Zamontowane: {_limited([f'{device} na {point} ({fs_type})' for device, point, fs_type in mounts])}."
+        return text.strip()
+
+
+class NetworkInterfacesCategory(ContextCategory):
+    # Interfejsy z /sys/class/net: stan i adres MAC
+    name = "network_interfaces"
+    keywords = re.compile(r"sie[ćc]|network|interfejs|interface|wi-?fi|ethernet|\b(eth|wlan|wlp|enp|ens|eno)\w*|\bip\b|"
+                          r"adres|address|\bmac\b|\bdns\b|ping|połącz|connect|router|brama|gateway", re.IGNORECASE)
+    ttl = 5.0
+    SYS_NET_DIR = "/sys/class/net"
+
+    def collect(self) -> Tuple[Tuple[str, str, str], ...]:
+        try: names = sorted(os.listdir(self.SYS_NET_DIR))
+        except OSError: return ()
+        interfaces = []
+        for name in names:
+            mac = _read_text(os.path.join(self.SYS_NET_DIR, name, "address")) or ""
+            interfaces.append((name, _read_text(os.path.join(self.SYS_NET_DIR, name, "operstate")) or "unknown",
+                               "" if mac.strip("0:") == "" else mac)) # lo i interfejsy bez adresu sprzętowego
+        return tuple(interfaces)
+
+    def describe(self, value: Tuple[Tuple[str, str, str], ...], query: str) -> str:
+        if not value: return ""
+        described = [f"{name} ({state}, {mac})" if mac else f"{name} ({state})" for name, state, mac in value]
+        return f"Interfejsy sieciowe: {_limited(described)}."
+
+
+class ShellsCategory(ContextCategory):
+    # Dostępne powłoki (/etc/shells) i powłoka logowania użytkownika
+    name = "shells"
+    keywords = re.compile(r"powłok|shell|\b(bash|zsh|fish|sh|dash|ksh|tcsh)\b|bashrc|zshrc|alias|prompt|\bchsh\b", re.IGNORECASE)
+    SHELLS_FILE = "/etc/shells"
+
+    def sources(self) -> Sequence[str]:
+        return (self.SHELLS_FILE,)
+
+    def collect(self) -> Tuple[Tuple[str, ...], str]:
+        shells = [line.strip() for line in (_read_text(self.SHELLS_FILE) or "").splitlines() if line.strip().startswith("/")]
+        try: login_shell = pwd.getpwuid(os.getuid()).pw_shell
+        except KeyError: login_shell = os.environ.get("SHELL", "")
+        return tuple(dict.fromkeys(shells)), login_shell
+
+    def describe(self, value: Tuple[Tuple[str, ...], str], query: str) -> str:
+        shells, login_shell = value
+        if not shells and not login_shell: return ""
+        return f"Dostępne powłoki: {_limited(list(shells))}. Powłoka użytkownika: {login_shell or 'nieznana'}."
+
+
+DEFAULT_CATEGORIES = (PackagesCategory, SystemdUnitsCategory, BlockDevicesCategory, NetworkInterfacesCategory, ShellsCategory)
+
+
+class SystemContext:
+    # Jedna instancja może być współdzielona przez wątki (tryb --socket); każda kategoria ma własny wpis w pamięci
+    # i jest zbierana od nowa niezależnie od pozostałych
+    def __init__(self, categories: Optional[Sequence[ContextCategory]] = None, package_index: Optional[PackageIndex] = None):
+        self.package_index = package_index if package_index is not None else PackageIndex() # Także dla odpowiedzi lokalnych
+        if categories is None:
+            categories = [PackagesCategory(self.package_index)] + [cls() for cls in DEFAULT_CATEGORIES if cls is not PackagesCategory]
+        self.categories: Dict[str, ContextCategory] = {category.name: category for category in categories}
+        self._entries: Dict[str, Tuple[Any, Any, float]] = {} # nazwa -> (sygnatura źródeł, dane, czas zebrania)
+        self._lock = threading.Lock()
+
+    def relevant_categories(self, query: str) -> List[str]:
+        return [name for name, category in self.categories.items() if category.is_relevant(query)]
+
+    def get(self, name: str) -> Any:
+        category = self.categories[name]
+        signature = tuple(path_signature(path) for path in category.sources())
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == signature and (category.ttl is None or time.monotonic() - entry[2] < category.ttl):
+            return entry[1]
+        with self._lock: # Jeden zbierający naraz; pozostałe wątki dostają jego wynik
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == signature and (category.ttl is None or time.monotonic() - entry[2] < category.ttl):
+                return entry[1]
+            started = time.perf_counter()
+            try: value = category.collect()
+            except OSError as e:
+                logger.warning(f"Nie można zebrać kontekstu systemu '{name}': {e}")
+                return entry[1] if entry is not None else None
+            self._entries[name] = (signature, value, time.monotonic())
+            logger.debug(f"Kontekst systemu '{name}' zebrany w {(time.perf_counter() - started) * 1000:.1f} ms")
+            return value
+
+    def describe(self, query: str, categories: Optional[Sequence[str]] = None) -> Dict[str, str]:
+        # Opisy kategorii dla promptu: domyślnie tylko tych, których dotyczy zapytanie; puste opisy są pomijane
+        descriptions: Dict[str, str] = {}
+        for name in (categories if categories is not None else self.relevant_categories(query)):
+            value = self.get(name)
+            if value is None: continue
+            text = self.categories[name].describe(value, query)
+            if text: descriptions[name] = text
+        return descriptions
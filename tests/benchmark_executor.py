@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark wykonywania prostych poleceń przez CommandExecutor.
+Porównuje szybką ścieżkę argv (bez powłoki), osobny proces bash na polecenie, trwałą powłokę
+oraz polecenia obsługiwane w procesie (builtin_commands).
+Uruchomienie: python3 tests/benchmark_executor.py [liczba_powtórzeń]
+"""
+
+import os
+import sys
+import time
+import statistics
+from unittest.mock import patch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.modules import command_executor
+from src.modules.command_executor import CommandExecutor
+
+COMMANDS = ["ls -la", "df -h", "free -m", "whoami", "uname -r"]
+BUILTIN_COMMANDS = ["pwd", "whoami", "ls", "echo hello"]
+
+
+def measure(executor: CommandExecutor, repeats: int, commands=COMMANDS) -> float:
+    timings = []
+    for _ in range(repeats):
+        for command in commands:
+            start = time.perf_counter()
+            executor.execute(command)
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    argv_ms = measure(CommandExecutor(inprocess_builtins=False), repeats)
+    with patch.object(command_executor, "resolve_plain_argv", return_value=None): # Wymuszenie ścieżki przez bash
+        bash_ms = measure(CommandExecutor(inprocess_builtins=False), repeats)
+        builtins_bash_ms = measure(CommandExecutor(inprocess_builtins=False), repeats, BUILTIN_COMMANDS)
+    persistent = CommandExecutor(persistent_shell=True, inprocess_builtins=False)
+    try:
+        persistent_ms = measure(persistent, repeats)
+    finally:
+        persistent.close()
+    builtins_ms = measure(CommandExecutor(), repeats, BUILTIN_COMMANDS)
+
+    print(f"Polecenia: {', '.join(COMMANDS)} (x{repeats}, mediana na polecenie)")
+    print(f"  bash -c na polecenie:    {bash_ms:8.3f} ms")
+    print(f"  szybka ścieżka argv:     {argv_ms:8.3f} ms  (oszczędność {bash_ms - argv_ms:.3f} ms, {100 * (bash_ms - argv_ms) / bash_ms:.0f}%)")
+    print(f"  trwała powłoka:          {persistent_ms:8.3f} ms")
+    print(f"Polecenia: {', '.join(BUILTIN_COMMANDS)}")
+    print(f"  bash -c na polecenie:    {builtins_bash_ms:8.3f} ms")
+    print(f"  w procesie:              {builtins_ms:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()